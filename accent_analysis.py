@@ -1,50 +1,200 @@
 
-import math
 import os
-# SpeechBrain and its dependencies
-from speechbrain.inference.classifiers import EncoderClassifier # Updated import as requested
-import torch
-import torchaudio
+import threading
+import time
+
+# Define a temporary directory for Hugging Face cache within the current working directory.
+# HF_HOME is set here, before anything can import huggingface_hub (which reads it on import).
+# This is crucial for resolving WinError 1314 permission issues on Windows,
+# as it ensures model files are downloaded and cached in a user-writable location.
+HF_CACHE_DIR = os.path.join(os.getcwd(), '.hf_cache')
+os.makedirs(HF_CACHE_DIR, exist_ok=True) # Create the directory if it doesn't exist
+os.environ['HF_HOME'] = HF_CACHE_DIR
+print(f"Hugging Face cache directory created/ensured at: {HF_CACHE_DIR}")
+
 import numpy
-import scipy
-from tqdm import tqdm
-from huggingface_hub import hf_hub_download
-import torch.nn.functional as F
+# torch, SpeechBrain and the Hugging Face Hub client are imported only when the model is loaded
+# (or a function that needs them first runs), which keeps them off the import path of the web
+# app: importing torch alone takes seconds on a cold start.
+
+import metrics
+from inference_engine import BatchInferenceEngine, wait_results
+from inference_workers import InferenceProcessPool, INFERENCE_WORKERS
+from video_processing import decode_audio
+from audio_segmentation import (segment_speech, aggregate_predictions, cluster_speakers, detect_speech_regions,
+                                make_windows, window_whole_clip, SEGMENT_WINDOW_SECONDS, MAX_SPEECH_SECONDS)
 
 import warnings
 warnings.filterwarnings("ignore")
 # --- Global variable for the accent classification model ---
 accent_classifier = None
+# Micro-batching worker shared by every background task (started once the model is loaded)
+inference_engine = None
+# Optional pool of inference worker processes (INFERENCE_WORKERS > 0)
+inference_pool = None
+# Forward pass implementation selected by INFERENCE_BACKEND (eager, int8, trace, compile, onnx)
+inference_backend = None
+
+# --- Progressive (early-exit) classification settings ---
+# Stop consuming audio once the aggregated top-1 probability leads the runner-up by this
+# many percentage points, after at least EARLY_EXIT_MIN_SPEECH_SECONDS of speech.
+EARLY_EXIT_MARGIN = float(os.environ.get('EARLY_EXIT_MARGIN', 5.0))
+EARLY_EXIT_MIN_SPEECH_SECONDS = float(os.environ.get('EARLY_EXIT_MIN_SPEECH_SECONDS', 20))
+# Audio is segmented and classified in blocks of this length as it arrives
+PROGRESSIVE_BLOCK_SECONDS = float(os.environ.get('PROGRESSIVE_BLOCK_SECONDS', 2 * SEGMENT_WINDOW_SECONDS))
+
+# --- Model source ---
+# 'hub':      resolve the model through the Hugging Face Hub (files are cached in MODEL_DIR).
+# 'snapshot': build it from MODEL_DIR/hyperparams.yaml and memory-map the weights from
+#             MODEL_SNAPSHOT_PATH (create it with `python model_snapshot.py`); no hub access.
+MODEL_SOURCE = os.environ.get('MODEL_SOURCE', 'hub')
+MODEL_HUB_ID = "Jzuluaga/accent-id-commonaccent_ecapa"
+MODEL_DIR = os.environ.get('MODEL_DIR', "pretrained_models/accent-id-commonaccent_ecapa")
+MODEL_SNAPSHOT_PATH = os.environ.get('MODEL_SNAPSHOT_PATH', os.path.join(MODEL_DIR, 'model_snapshot.pt'))
+
+# --- Model loading state (reported by /healthz and /readyz) ---
+# state: 'not_loaded' -> 'loading' -> 'ready' or 'failed'
+model_status = {"state": "not_loaded", "source": MODEL_SOURCE, "backend": None, "error": None, "load_seconds": None}
+_model_lock = threading.Lock()
+_model_loading_thread = None
+
+# --- Display names of the model's accent labels ---
+ACCENT_MAP = {
+    "australia": "Australian",
+    "canada": "Canadian",
+    "england": "British",
+    "us": "American",
+    "philippines": "Filipino",
+    "african": "South African",
+    "newzealand": "New Zealand",
+    "ireland": "Irish",
+    "scotland": "Scottish",
+    "wales": "Welsh",
+    "malaysia": "Malaysian",
+    "singapore": "Singaporean",
+    "bermuda": "Bermudian",
+    "hongkong": "Hong Kong",
+    "indian": "Indian",
+    "southatlandtic": "South Atlantic"
+}
+
+
+# Most likely accents listed in each result's "top_k"
+RESULT_TOP_K = int(os.environ.get('RESULT_TOP_K', 3))
+
+
+def accent_display_name(label):
+    """Display name of a model label; a label missing from ACCENT_MAP is title-cased rather than lost."""
+    return ACCENT_MAP.get(label) or label.replace('_', ' ').title()
+
+
+def format_result(accent, confidence, summary, probabilities, details=None):
+    """
+    Builds the client-facing result of a successful analysis from the detect_accent outputs.
+    The per-segment timeline and per-speaker breakdown are included when `details` has them.
+    """
+    ranked = sorted(probabilities.items(), key=lambda item: item[1], reverse=True)[:RESULT_TOP_K]
+    result = {
+        "status": "completed",
+        "accent": accent_display_name(accent),
+        "confidence": f"{confidence:.2f}%",
+        "summary": summary,
+        "probabilities": probabilities,
+        "top_k": [{"accent": accent_display_name(label), "label": label, "probability": probability}
+                  for label, probability in ranked],
+    }
+    for key in ("timeline", "speakers"):
+        if details and key in details:
+            result[key] = details[key]
+    return result
 
-# Define a temporary directory for Hugging Face cache within the current working directory
-HF_CACHE_DIR = os.path.join(os.getcwd(), '.hf_cache')
-os.makedirs(HF_CACHE_DIR, exist_ok=True) # Create the directory if it doesn't exist
-print(f"Hugging Face cache directory created/ensured at: {HF_CACHE_DIR}")
 
 # --- Function to load the SpeechBrain Accent Classification Model ---
+def load_classifier(source=MODEL_SOURCE):
+    """Builds the SpeechBrain EncoderClassifier from the given MODEL_SOURCE ('hub' or 'snapshot')."""
+    if source == 'snapshot':
+        from model_snapshot import load_snapshot
+        return load_snapshot(MODEL_SNAPSHOT_PATH, MODEL_DIR)
+    if source != 'hub':
+        raise ValueError(f"Unsupported MODEL_SOURCE: {source}")
+
+    from speechbrain.inference.classifiers import EncoderClassifier
+    # Using the ECAPA-TDNN based model for English accent classification
+    return EncoderClassifier.from_hparams(
+        source=MODEL_HUB_ID,
+        savedir=MODEL_DIR # A distinct directory for this model
+    )
+
+def start_model_loading():
+    """
+    Loads the model on a background thread (idempotent), so the web app can serve
+    requests, /healthz and /readyz while it loads. Poll is_model_ready() or model_status.
+    """
+    global _model_loading_thread
+    with _model_lock:
+        if _model_loading_thread is None:
+            _model_loading_thread = threading.Thread(target=load_accent_model, name="model-loader", daemon=True)
+            _model_loading_thread.start()
+    return _model_loading_thread
+
+def is_model_ready():
+    return model_status["state"] == "ready"
+
 def load_accent_model():
     """
-    Loads the SpeechBrain accent classification model from Hugging Face.
-    This function should be called once at application startup.
+    Loads the SpeechBrain accent classification model (see MODEL_SOURCE) and starts the inference engine.
+    Called once at application startup, usually through start_model_loading().
     """
-    global accent_classifier
-    if accent_classifier is None:
+    global accent_classifier, inference_engine, inference_pool, inference_backend
+    with _model_lock:
+        if accent_classifier is not None:
+            return
+        model_status.update(state="loading", error=None)
+        start = time.perf_counter()
         try:
-            print("Loading SpeechBrain accent classification model... This may take a moment.")
-
-            # Set the HF_HOME environment variable to redirect Hugging Face's cache.
-            # This is crucial for resolving WinError 1314 permission issues on Windows,
-            # as it ensures model files are downloaded and cached in a user-writable location.
-            os.environ['HF_HOME'] = HF_CACHE_DIR
-            print(f"HF_HOME environment variable set to: {os.environ['HF_HOME']}")
-
-            # Using the ECAPA-TDNN based model for English accent classification
-            accent_classifier = EncoderClassifier.from_hparams(
-                source="Jzuluaga/accent-id-commonaccent_ecapa",
-                savedir="pretrained_models/accent-id-commonaccent_ecapa" # A distinct directory for this model
-            )
+            source = MODEL_SOURCE
+            if INFERENCE_WORKERS > 0:
+                # Every worker process loads the model too, so all of them map the weights from
+                # the snapshot (one copy in memory); it is created from the hub if it is missing
+                source = 'snapshot'
+                model_status.update(source=source)
+                if not os.path.exists(MODEL_SNAPSHOT_PATH):
+                    from model_snapshot import save_snapshot
+                    print(f"Inference workers need the model snapshot; creating {MODEL_SNAPSHOT_PATH} from the hub...")
+                    save_snapshot(load_classifier('hub'), MODEL_SNAPSHOT_PATH)
+
+            print(f"Loading SpeechBrain accent classification model (source: {source})... This may take a moment.")
+            with metrics.stage('model_load'):
+                accent_classifier = load_classifier(source)
             print("SpeechBrain model loaded successfully.")
+
+            from inference_backends import build_backend, INFERENCE_BACKEND
+            inference_backend = build_backend(INFERENCE_BACKEND, accent_classifier)
+            model_status.update(backend=inference_backend.name)
+            print(f"Inference backend: {inference_backend.name}")
+
+            if INFERENCE_WORKERS > 0:
+                # Workers build the backend that passed the parity check here (see InferenceProcessPool)
+                inference_pool = InferenceProcessPool(setup=_load_worker_model,
+                                                      setup_args=(inference_backend.name,)).start()
+                print(f"Started {inference_pool.workers} inference worker process(es) "
+                      f"with {inference_pool.threads_per_worker} torch thread(s) each.")
+
+            # Route every classification through one batching worker instead of
+            # letting each executor thread run its own batch-size-1 forward pass.
+            inference_engine = BatchInferenceEngine(
+                _classify_batch,
+                executor=inference_pool,
+                max_in_flight=inference_pool.workers if inference_pool else 1,
+            ).start()
+            print(f"Inference engine started (max batch size: {inference_engine.max_batch_size}, "
+                  f"max wait: {inference_engine.max_wait * 1000:.0f} ms).")
+            model_status.update(state="ready", load_seconds=round(time.perf_counter() - start, 2))
         except Exception as e:
+            model_status.update(state="failed", error=str(e), load_seconds=round(time.perf_counter() - start, 2))
+            if inference_pool is not None:
+                inference_pool.shutdown(wait=False)
+                inference_pool = None
             print(f"Error loading SpeechBrain model: {e}")
             print("\n--------------------------------------------------------------")
             print("Troubleshooting Steps for Model Loading Errors:")
@@ -61,80 +211,385 @@ def load_accent_model():
             print("--------------------------------------------------------------\n")
             accent_classifier = None # Set to None if loading fails
 
+# --- Batched forward pass used by the inference engine ---
+def _model_memory():
+    """Bytes held by the loaded model's parameters and buffers (reported as a gauge on /metrics)."""
+    if accent_classifier is None:
+        return []
+    tensors = list(accent_classifier.mods.parameters()) + list(accent_classifier.mods.buffers())
+    return [({}, sum(t.numel() * t.element_size() for t in tensors))]
+
+
+metrics.register_callback("accent_model_parameter_bytes", "Memory held by model parameters and buffers.",
+                          "gauge", _model_memory)
+
+
+def _classify_batch(wavs, wav_lens):
+    """
+    Runs one forward pass over a padded batch and splits the outputs per clip.
+    Each row is returned in the same (out_prob, score, index, text_lab) shape
+    that classify_file produces for a single clip, followed by the clip's embedding.
+    """
+    out_prob, score, index, text_lab, embeddings = inference_backend.classify_batch(wavs, wav_lens)
+    return [
+        (out_prob[i:i + 1], score[i:i + 1], index[i:i + 1], [text_lab[i]], embeddings[i:i + 1])
+        for i in range(len(text_lab))
+    ]
+
+def _load_worker_model(backend_name):
+    """Initializer of the inference worker processes: maps the model snapshot and builds the backend."""
+    global accent_classifier, inference_backend
+    from inference_backends import build_backend
+    accent_classifier = load_classifier('snapshot')
+    # The web process has already run the parity check
+    inference_backend = build_backend(backend_name, accent_classifier, check=False)
+
+def clip_embedding(window_embeddings):
+    """One unit-length embedding for a clip: the mean direction of its windows' embeddings."""
+    import torch
+    embeddings = torch.nn.functional.normalize(window_embeddings.float(), dim=-1)
+    return torch.nn.functional.normalize(embeddings.mean(dim=0), dim=0).numpy()
+
+def segment_breakdown(windows, out_prob, window_embeddings):
+    """
+    Per-window timeline and per-speaker breakdown of a clip, from the outputs of the forward pass
+    that classified it (no extra inference). windows are (start, end) sample offsets in the clip,
+    out_prob and window_embeddings have one row per window.
+    Returns (timeline, speakers): speakers come from clustering the window embeddings, and each
+    speaker's accent aggregates that speaker's windows the same way a whole clip is aggregated.
+    """
+    import torch
+    ind2lab = accent_classifier.hparams.label_encoder.ind2lab
+    speaker_ids = cluster_speakers(window_embeddings)
+    window_probs = torch.softmax(out_prob, dim=-1)
+    timeline = []
+    for (start, end), probs, speaker in zip(windows, window_probs, speaker_ids):
+        index = int(torch.argmax(probs))
+        timeline.append({
+            "start": round(start / 16000, 2),
+            "end": round(end / 16000, 2),
+            "accent": accent_display_name(ind2lab[index]),
+            "confidence": round(float(probs[index]) * 100, 2),
+            "speaker": speaker,
+        })
+
+    speech_seconds = sum(end - start for start, end in windows) / 16000
+    speakers = []
+    for speaker in range(max(speaker_ids) + 1):
+        rows = [i for i, s in enumerate(speaker_ids) if s == speaker]
+        probabilities, confidence, agreement = aggregate_predictions(out_prob[rows])
+        seconds = sum(windows[i][1] - windows[i][0] for i in rows) / 16000
+        speakers.append({
+            "speaker": speaker,
+            "accent": accent_display_name(ind2lab[int(torch.argmax(probabilities))]),
+            "confidence": round(confidence, 2),
+            "segments": len(rows),
+            "speech_seconds": round(seconds, 1),
+            "share": round(seconds / speech_seconds, 3) if speech_seconds else 0.0,
+        })
+    return timeline, speakers
+
+def _classify_waveform(waveform, task_id, details=None):
+    """
+    Classifies a 1-D 16 kHz waveform: speech is segmented into fixed-length windows
+    (bounded by MAX_SPEECH_SECONDS), the windows are queued on the inference engine
+    together so they share batched forward passes, and the per-window outputs are aggregated.
+    Returns the classified accent, a confidence score, a summary,
+    the full per-class probability vector (label -> probability) and no error.
+    If a `details` dict is given, the clip's "embedding", per-window "timeline" and per-speaker
+    "speakers" breakdown (see segment_breakdown) are stored in it.
+    """
+    import torch
+    windows = segment_speech(waveform.numpy())
+    speech_seconds = sum(end - start for start, end in windows) / 16000
+    print(f"Task {task_id}: Classifying {len(windows)} window(s), {speech_seconds:.1f}s of speech")
+
+    futures = [inference_engine.submit(waveform[start:end]) for start, end in windows]
+    outputs = wait_results(futures)
+    out_prob = torch.cat([output[0] for output in outputs])
+    if details is not None:
+        window_embeddings = torch.cat([output[4] for output in outputs])
+        details["embedding"] = clip_embedding(window_embeddings)
+        details["timeline"], details["speakers"] = segment_breakdown(windows, out_prob, window_embeddings)
+
+    # Per-window softmax (same as the single-clip logic), aggregated across windows
+    probabilities, confidence, agreement = aggregate_predictions(out_prob)
+
+    ind2lab = accent_classifier.hparams.label_encoder.ind2lab
+    index = int(torch.argmax(probabilities))
+    accent = ind2lab[index]
+    summary = ("Analysis complete. The detected accent is based on the dominant English accent identified "
+               f"across {len(windows)} speech segment(s) ({speech_seconds:.0f}s of speech); "
+               f"{agreement * 100:.0f}% of the segments agree.")
+
+    # Keep the whole probability vector so callers (and the result cache) don't lose the other classes
+    class_probabilities = {ind2lab[i]: round(prob, 6) for i, prob in enumerate(probabilities.tolist())}
+
+    print(f"Task {task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
+    return accent, confidence, summary, class_probabilities, None
+
 # --- Function to detect accent from an audio file ---
-def detect_accent(audio_path, task_id):
+def detect_accent(audio_path, task_id, details=None):
     """
-    Analyzes the speaker's accent from the given audio file using the pre-loaded SpeechBrain model.
-    Returns the classified accent, a confidence score, and a summary.
+    Analyzes the speaker's accent from the given audio (or video) file using the pre-loaded SpeechBrain model.
+    FFmpeg decodes the file straight to 16 kHz PCM in memory, so SpeechBrain never opens (or
+    copies) the file itself and nothing is resampled again before the features are computed.
+    Returns the classified accent, a confidence score, a summary and the per-class probabilities.
     """
-    if accent_classifier is None:
-        return None, None, None, "Accent classification model not loaded. Please ensure the model loads correctly at startup."
+    if accent_classifier is None or inference_engine is None:
+        return None, None, None, None, "Accent classification model not loaded. Please ensure the model loads correctly at startup."
 
     print(f"Task {task_id}: Analyzing accent from {audio_path}...")
+    # Add checks for file existence and size
+    if not os.path.exists(audio_path):
+        return None, None, None, None, f"Audio file not found at: {audio_path}"
+    if os.path.getsize(audio_path) == 0:
+        return None, None, None, None, f"Audio file is empty at: {audio_path}"
+
+    waveform, error = decode_audio(audio_path, task_id)
+    if error:
+        return None, None, None, None, error
+    return detect_accent_from_waveform(waveform, task_id, details)
+
+# --- Function to detect accent from in-memory PCM ---
+def detect_accent_from_waveform(waveform, task_id, details=None):
+    """
+    Analyzes the speaker's accent from already decoded 16 kHz mono PCM
+    (a numpy array or tensor, e.g. from video_processing.acquire_audio).
+    Returns the classified accent, a confidence score, a summary and the per-class probabilities.
+    A `details` dict, if given, receives the clip's embedding, timeline and speakers (see _classify_waveform).
+    """
+    import torch
+    if accent_classifier is None or inference_engine is None:
+        return None, None, None, None, "Accent classification model not loaded. Please ensure the model loads correctly at startup."
+
     try:
-        # The audio_path passed here from video_processing.py should already be an absolute path.
-        # Removing os.path.abspath() to prevent potential double-concatenation issues
-        # if SpeechBrain's internal file handling implicitly prepends CWD to an already absolute path.
-        # processed_audio_path = os.path.abspath(audio_path) # Removed this line
-        processed_audio_path = audio_path # Use the path directly as it should be absolute
+        waveform = torch.as_tensor(waveform, dtype=torch.float32).reshape(-1)
+        if waveform.numel() == 0:
+            return None, None, None, None, "Decoded audio is empty."
+        print(f"Task {task_id}: Analyzing accent from {waveform.numel() / 16000:.1f}s of in-memory audio...")
+        return _classify_waveform(waveform, task_id, details)
+
+    except Exception as e:
+        error_message = f"An error occurred during accent detection: {e}"
+        print(f"Task {task_id}: {error_message}")
+        return None, None, None, None, error_message
 
-        print(f"Task {task_id}: Final audio path for SpeechBrain: {processed_audio_path}")
 
-        # Add checks for file existence and size
-        if not os.path.exists(processed_audio_path):
-            return None, None, None, f"Audio file not found at: {processed_audio_path}"
-        if os.path.getsize(processed_audio_path) == 0:
-            return None, None, None, f"Audio file is empty at: {processed_audio_path}"
 
-        out_prob, score, index, text_lab = accent_classifier.classify_file(processed_audio_path)
+# --- Progressive classification of audio that is still arriving ---
+class ProgressiveClassifier:
+    """
+    Classifies a stream of 16 kHz PCM chunks incrementally.
+    Decoded audio is buffered into blocks; each block is segmented with the VAD and its speech
+    windows are classified through the inference engine, keeping a running aggregate of the
+    per-window softmax outputs. should_stop() turns True once the aggregate is confident enough
+    (or MAX_SPEECH_SECONDS of speech have been analyzed).
+    """
 
-        # Print raw outputs for debugging/understanding
-        print(f"out_prob: {out_prob}, score: {score}, index: {index}, text_lab: {text_lab}")
+    def __init__(self, task_id, margin=EARLY_EXIT_MARGIN, min_speech_seconds=EARLY_EXIT_MIN_SPEECH_SECONDS,
+                 block_seconds=PROGRESSIVE_BLOCK_SECONDS):
+        self.task_id = task_id
+        self.margin = margin
+        self.min_speech_seconds = min_speech_seconds
+        self.block_samples = int(block_seconds * 16000)
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+        self._pending = []
+        self._pending_samples = 0
+        self._pending_start = 0 # Sample offset of the pending audio in the stream
+        self._windows = [] # (start, end) sample offsets in the stream of the classified windows
+        self._out_probs = []
+        self._embeddings = []
+        self._prediction = None
+        self._fallback_block = None
+        self._fallback_start = 0
 
-        # Apply softmax to convert logits (out_prob) into probabilities.
-        probabilities = F.softmax(out_prob, dim=-1)
+    def feed(self, chunk):
+        """Adds decoded samples, classifying every complete block. Returns should_stop()."""
+        self._pending.append(chunk)
+        self._pending_samples += len(chunk)
+        self.audio_seconds += len(chunk) / 16000
+        if self._pending_samples >= self.block_samples:
+            self._classify_pending(final=False)
+        return self.should_stop()
 
-        # Get the confidence for the predicted accent
-        confidence = probabilities[0, index.item()] * 100
+    def finish(self):
+        """Classifies the audio left over at the end of the stream."""
+        if self._pending_samples:
+            self._classify_pending(final=True)
 
-        accent = text_lab[0]
-        summary = "Analysis complete. The detected accent is based on the dominant English accent identified in the audio segment provided."
+    def _classify_pending(self, final):
+        import torch
+        block = numpy.concatenate(self._pending)
+        self._pending, self._pending_samples = [], 0
+        # Maps a position in `block` to its sample offset in the stream
+        block_start = self._pending_start
+        to_stream = lambda position: block_start + position
+        self._pending_start += len(block)
 
-        print(f"Task {task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
-        return accent, confidence, summary, None
+        windows = make_windows(detect_speech_regions(block), max_speech_seconds=0)
+        if not windows and not self._out_probs:
+            if not final:
+                # Keep the first speechless block in case the whole stream turns out to have no speech
+                if self._fallback_block is None:
+                    self._fallback_block, self._fallback_start = block, block_start
+                return
+            # No speech found anywhere: classify the audio as-is rather than return nothing
+            if self._fallback_block is not None:
+                fallback_start, fallback_len = self._fallback_start, len(self._fallback_block)
+                block = numpy.concatenate([self._fallback_block, block])
+                to_stream = lambda position: (fallback_start + position if position <= fallback_len
+                                              else block_start + position - fallback_len)
+            windows = window_whole_clip(len(block))
+        if not windows:
+            return
+        self._fallback_block = None
+
+        waveform = torch.from_numpy(block)
+        futures = [inference_engine.submit(waveform[start:end]) for start, end in windows]
+        outputs = wait_results(futures)
+        self._out_probs.extend(output[0] for output in outputs)
+        self._embeddings.extend(output[4] for output in outputs)
+        self._windows.extend((to_stream(start), to_stream(end)) for start, end in windows)
+        self.speech_seconds += sum(end - start for start, end in windows) / 16000
+
+        probabilities, confidence, agreement = aggregate_predictions(torch.cat(self._out_probs))
+        top2 = torch.topk(probabilities, 2).values
+        self._prediction = {
+            "probabilities": probabilities,
+            "index": int(torch.argmax(probabilities)),
+            "confidence": confidence,
+            "margin": float(top2[0] - top2[1]) * 100,
+            "agreement": agreement,
+        }
+
+    def stop_reason(self):
+        """Why the stream can stop now: 'speech_cap' (MAX_SPEECH_SECONDS reached), 'confident' or None."""
+        if MAX_SPEECH_SECONDS > 0 and self.speech_seconds >= MAX_SPEECH_SECONDS:
+            return "speech_cap"
+        if self._prediction is None or self.speech_seconds < self.min_speech_seconds:
+            return None
+        return "confident" if self._prediction["margin"] >= self.margin else None
+
+    def should_stop(self):
+        return self.stop_reason() is not None
+
+    def progress(self):
+        """Interim state for status reporting."""
+        progress = {
+            "audio_seconds_consumed": round(self.audio_seconds, 1),
+            "speech_seconds_analyzed": round(self.speech_seconds, 1),
+            "windows_classified": len(self._out_probs),
+        }
+        if self._prediction is not None:
+            progress["interim_accent"] = accent_classifier.hparams.label_encoder.ind2lab[self._prediction["index"]]
+            progress["interim_confidence"] = round(self._prediction["confidence"], 2)
+            progress["interim_margin"] = round(self._prediction["margin"], 2)
+        return progress
+
+    def embedding(self):
+        """Embedding of the audio classified so far (see clip_embedding)."""
+        import torch
+        return clip_embedding(torch.cat(self._embeddings)) if self._embeddings else None
+
+    def breakdown(self):
+        """(timeline, speakers) of the audio classified so far (see segment_breakdown)."""
+        import torch
+        if not self._windows:
+            return [], []
+        return segment_breakdown(self._windows, torch.cat(self._out_probs), torch.cat(self._embeddings))
+
+    def result(self, stop_reason=None):
+        """Final prediction in the detect_accent return shape; stop_reason is why the stream was cut short, if it was."""
+        if self._prediction is None:
+            return None, None, None, None, "No audio could be classified."
+        ind2lab = accent_classifier.hparams.label_encoder.ind2lab
+        probabilities = self._prediction["probabilities"]
+        accent = ind2lab[self._prediction["index"]]
+        confidence = self._prediction["confidence"]
+        if stop_reason == "speech_cap":
+            reason = (f"stopped after {self.audio_seconds:.0f}s of audio on reaching the "
+                      f"{MAX_SPEECH_SECONDS:.0f}s speech limit")
+        elif stop_reason == "confident":
+            reason = f"stopped early after {self.audio_seconds:.0f}s of audio once the prediction was stable"
+        else:
+            reason = f"analyzed all {self.audio_seconds:.0f}s of audio"
+        summary = ("Analysis complete. The detected accent is based on the dominant English accent identified "
+                   f"across {len(self._out_probs)} speech segment(s) ({self.speech_seconds:.0f}s of speech); "
+                   f"{self._prediction['agreement'] * 100:.0f}% of the segments agree ({reason}).")
+        class_probabilities = {ind2lab[i]: round(prob, 6) for i, prob in enumerate(probabilities.tolist())}
+        print(f"Task {self.task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
+        return accent, confidence, summary, class_probabilities, None
+
+def detect_accent_progressive(chunks, task_id, on_progress=None, details=None):
+    """
+    Classifies audio chunks as they arrive (e.g. from video_processing.stream_audio_chunks)
+    and stops consuming them as soon as the running prediction is confident enough.
+    on_progress, if given, is called with ProgressiveClassifier.progress() after every chunk.
+    The caller owns the chunk iterator and should close it to stop the download early.
+    Returns the classified accent, a confidence score, a summary and the per-class probabilities.
+    A `details` dict, if given, receives the embedding, timeline and speakers of the classified audio.
+    """
+    if accent_classifier is None or inference_engine is None:
+        return None, None, None, None, "Accent classification model not loaded. Please ensure the model loads correctly at startup."
+
+    try:
+        classifier = ProgressiveClassifier(task_id)
+        stop_reason = None
+        for chunk in chunks:
+            classifier.feed(chunk)
+            stop_reason = classifier.stop_reason()
+            if on_progress is not None:
+                on_progress(classifier.progress())
+            if stop_reason:
+                print(f"Task {task_id}: Early exit ({stop_reason}) after {classifier.audio_seconds:.1f}s of audio")
+                break
+        else:
+            classifier.finish()
+        if details is not None:
+            details["embedding"] = classifier.embedding()
+            details["timeline"], details["speakers"] = classifier.breakdown()
+        return classifier.result(stop_reason)
 
     except Exception as e:
         error_message = f"An error occurred during accent detection: {e}"
         print(f"Task {task_id}: {error_message}")
-        return None, None, None, error_message
+        return None, None, None, None, error_message
 
 
 
-# Example of how you would integrate this (not runnable on its own, requires an audio file)
 if __name__ == '__main__':
-    # This part is for demonstration and would be integrated into your Flask app.
-    # You would need an actual audio file (e.g., a .wav file) to test this.
-    # For example:
-    HF_CACHE_DIR = os.path.join(os.getcwd(), '.hf_cache')
-    os.makedirs(HF_CACHE_DIR, exist_ok=True) # Create the directory if it doesn't exist
-    print(f"Hugging Face cache directory created/ensured at: {HF_CACHE_DIR}")
-    input_file = input("Enter audio: ")
-    dummy_audio_path = f"temp_files/{input_file}"
-    test_task_id = "test_accent_detection_123"
-
-    # 1. Load the model first (typically done once at app startup)
+    # Classifies local files from the command line, e.g.
+    #   python accent_analysis.py temp_files/audio.m4a clip.mp4 --json
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Detects the English accent in local audio or video files.")
+    parser.add_argument('paths', nargs='+', help="Audio or video files (anything FFmpeg can decode)")
+    parser.add_argument('--json', action='store_true', help="Print each result as the JSON /status returns")
+    args = parser.parse_args()
+
     load_accent_model()
+    if accent_classifier is None:
+        raise SystemExit("Model could not be loaded, skipping accent detection.")
 
-    # 2. Then call detect_accent with a valid audio path
-    if accent_classifier:
-        accent, confidence, summary, error = detect_accent(dummy_audio_path, test_task_id)
-        if accent:
-            print(f"\n--- Detection Result ---")
-            print(f"Detected Accent: {accent}")
-            print(f"Confidence: {confidence:.2f}%")
-            print(f"Summary: {summary}")
+    failed = False
+    for path in args.paths:
+        details = {}
+        accent, confidence, summary, probabilities, error = detect_accent(path, f"cli:{os.path.basename(path)}", details)
+        if error:
+            failed = True
+            result = {"status": "error", "message": error}
         else:
-            print(f"\n--- Detection Error ---")
-            print(f"Error: {error}")
-    else:
-        print("Model could not be loaded, skipping accent detection example.")
+            result = format_result(accent, confidence, summary, probabilities, details)
+        if args.json:
+            print(json.dumps({"path": path, **result}, indent=2))
+        elif error:
+            print(f"\n--- {path}: Detection Error ---\nError: {error}")
+        else:
+            print(f"\n--- {path}: Detection Result ---")
+            print(f"Detected Accent: {result['accent']}")
+            print(f"Confidence: {result['confidence']}")
+            print(f"Summary: {summary}")
+    raise SystemExit(1 if failed else 0)
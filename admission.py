@@ -0,0 +1,103 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# --- Admission control configuration (overridable through environment variables) ---
+# Submissions are refused with 503 once this many tasks are queued or running
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', 20))
+# Per-client token bucket: sustained submissions per minute and burst size
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 10))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 5))
+# Processes taking tasks from the shared task store (gunicorn workers, on every host). The queue
+# depth is global, so it drains through all of their executor workers. Defaults to WEB_CONCURRENCY.
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.environ.get('WEB_CONCURRENCY', 1)))
+# Assumed task duration until real durations have been observed
+DEFAULT_TASK_SECONDS = float(os.environ.get('DEFAULT_TASK_SECONDS', 30))
+MAX_TRACKED_CLIENTS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second refill up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self):
+        """Takes one token. Returns (allowed, seconds until a token is available)."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """
+    Decides whether /analyze accepts a new task: per-client token-bucket rate limiting
+    plus a global queue depth limit. Wait estimates come from the average duration
+    of recently finished tasks and the number of concurrent executor workers: `workers`
+    per process, times the `processes` that share the queue.
+    """
+
+    def __init__(self, workers, max_queue_depth=MAX_QUEUE_DEPTH, rate_per_minute=RATE_LIMIT_PER_MINUTE,
+                 burst=RATE_LIMIT_BURST, history=50, processes=WORKER_PROCESSES):
+        self.workers = max(workers, 1) * max(processes, 1)
+        self.max_queue_depth = max_queue_depth
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}
+        self._durations = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    # --- Rate limiting ---
+    def check_rate(self, client_id):
+        """Returns (allowed, retry_after_seconds) for one submission from client_id."""
+        if self.rate <= 0:
+            return True, 0
+        with self._lock:
+            bucket = self._buckets.get(client_id)
+            if bucket is None:
+                if len(self._buckets) >= MAX_TRACKED_CLIENTS:
+                    # Forget clients whose buckets have refilled completely; they lose nothing
+                    self._buckets = {key: b for key, b in self._buckets.items() if not b.is_full()}
+                bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst)
+            allowed, wait = bucket.consume()
+        return allowed, math.ceil(wait)
+
+    # --- Queue depth and wait estimates ---
+    def record_duration(self, seconds):
+        with self._lock:
+            self._durations.append(seconds)
+
+    def average_duration(self):
+        with self._lock:
+            if not self._durations:
+                return DEFAULT_TASK_SECONDS
+            return sum(self._durations) / len(self._durations)
+
+    def estimated_wait(self, queue_depth):
+        """Seconds until a task submitted now should be finished, given queue_depth tasks ahead of it."""
+        return math.ceil((queue_depth // self.workers + 1) * self.average_duration())
+
+    def check_capacity(self, queue_depth):
+        """
+        Returns (allowed, retry_after_seconds). Retry-After estimates when enough of the
+        queue will have drained for a new submission to be accepted.
+        """
+        if self.max_queue_depth <= 0 or queue_depth < self.max_queue_depth:
+            return True, 0
+        excess = queue_depth - self.max_queue_depth + 1
+        return False, max(math.ceil(excess * self.average_duration() / self.workers), 1)
@@ -1,13 +1,37 @@
 import os
+import hmac
+import json
 import subprocess
+import threading
+import time
 import uuid
 import shutil
-from flask import Flask, request, jsonify, render_template
+from contextlib import closing
+from itertools import chain
+from urllib.parse import urlsplit
+from flask import Flask, Response, request, jsonify, render_template
 from flask_executor import Executor
 
+import metrics
+
 # Import modular functions
-from video_processing import download_video, extract_audio
-from accent_analysis import load_accent_model, detect_accent, HF_CACHE_DIR
+from video_processing import (download_video, decode_audio, acquire_audio, stream_audio_chunks,
+                              download_and_decode_audio, AudioStreamError)
+from download_manager import get_download_manager, DownloadLimitError
+from accent_analysis import (start_model_loading, is_model_ready, model_status,
+                             detect_accent_from_waveform, detect_accent_progressive, format_result,
+                             accent_display_name, ProgressiveClassifier, HF_CACHE_DIR)
+from audio_ingest import (MultipartUpload, UploadError, UploadTooLargeError, decode_upload, pcm_chunks,
+                          PCM_FORMATS, UPLOAD_MAX_BYTES, INGEST_MAX_STREAMS, INGEST_BLOCK_SECONDS)
+from result_cache import ResultCache, audio_fingerprint
+from embedding_store import EmbeddingStore, EMBEDDING_DUPLICATE_SIMILARITY
+from task_store import create_task_store, QUEUED, DOWNLOADING, EXTRACTING, CLASSIFYING, TERMINAL_STATES
+from task_events import (TaskEventHub, EventStreamServer, stream_task_events, already_delivered,
+                         EVENTS_MAX_STREAMS, EVENTS_PORT, EVENTS_PUBLIC_URL)
+from webhooks import WebhookDispatcher, validate_callback_url
+from inference_workers import INFERENCE_WORKERS
+from admission import AdmissionController
+from batch_pipeline import BatchPipeline, BatchJobRunningError, parse_url_lines, BATCH_MAX_URLS, JOB_ID_PATTERN
 
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -23,6 +47,93 @@ executor = Executor(app)
 TEMP_DIR = os.path.join(os.getcwd(), 'temp_files')
 os.makedirs(TEMP_DIR, exist_ok=True) # Create the directory if it doesn't exist
 print(f"Temporary directory for media created/ensured at: {TEMP_DIR}")
+# Per-host download caps, byte/duration limits and a disk quota for TEMP_DIR; the janitor
+# removes files orphaned by crashed tasks (at startup and every TEMP_JANITOR_INTERVAL_SECONDS)
+download_manager = get_download_manager(TEMP_DIR)
+download_manager.start_janitor()
+
+# --- Audio Acquisition Mode ---
+# 'stream': pipe audio-only formats from yt-dlp into FFmpeg and decode in memory
+#           (falls back to a file download for sources that cannot be streamed).
+# 'progressive': like 'stream', but classify chunks as they arrive and stop the download
+#           as soon as the prediction is confident (see EARLY_EXIT_MARGIN).
+# 'file':   download the full video to TEMP_DIR and decode its audio in memory.
+AUDIO_ACQUISITION_MODE = os.environ.get('AUDIO_ACQUISITION_MODE', 'stream')
+
+# --- Persistent Task Store ---
+# Task states, interim progress and results live here (not in executor.futures), so results
+# survive restarts, can be read more than once until they expire, and are visible to every
+# gunicorn worker.
+task_store = create_task_store()
+task_store.start_eviction()
+
+# --- Result Push ---
+# Clients can follow a task as server-sent events (events_url: the asyncio listener on EVENTS_PORT,
+# or the /events/<task_id> fallback route) or pass a callback_url to have the result POSTed to
+# them, instead of polling /status.
+task_events = TaskEventHub(task_store)
+event_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+webhooks = WebhookDispatcher()
+
+# --- Audio in the Request Body ---
+# /analyze/upload decodes uploaded files while they arrive; /ingest/<task_id> classifies a live
+# raw PCM stream, and every open stream holds a thread (at most INGEST_MAX_STREAMS per process).
+ingest_stream_slots = threading.BoundedSemaphore(INGEST_MAX_STREAMS)
+
+# --- Admission Control ---
+# Queue depth limit and per-client rate limiting for /analyze, so bursts get a quick
+# 429/503 with Retry-After instead of piling up behind the executor threads. The queue is shared
+# by WORKER_PROCESSES processes, so its wait estimates count all of their executor threads.
+admission = AdmissionController(workers=app.config['EXECUTOR_MAX_WORKERS'])
+
+# --- Persistent Result Cache ---
+# Lets resubmitted URLs (or the same audio behind a different URL) skip the pipeline.
+result_cache = ResultCache()
+print(f"Result cache opened at: {result_cache.db_path}")
+
+# --- Embedding Store ---
+# Every classified clip's embedding is kept, so /similar can find reuploads, the same speaker
+# and similar accents among earlier clips without running the model again.
+embedding_store = EmbeddingStore()
+print(f"Embedding store opened at: {embedding_store.store_dir}")
+
+# --- Batch Jobs ---
+# /analyze/batch runs its own download/decode/inference stages, shared by all jobs of this worker;
+# each job's results are kept in BATCH_JOBS_DIR/<job_id>.jsonl so a resubmitted job resumes where
+# it stopped. Items in the pipeline are recorded in the task store, so they count toward the queue depth.
+batch_pipeline = BatchPipeline(TEMP_DIR, result_cache, embedding_store, task_store=task_store)
+# Outside TEMP_DIR, so job results neither count toward its download quota nor get swept with media files
+BATCH_JOBS_DIR = os.environ.get('BATCH_JOBS_DIR', os.path.join(os.getcwd(), 'batch_jobs'))
+_LEGACY_BATCH_JOBS_DIR = os.path.join(TEMP_DIR, 'batch_jobs')
+if os.path.isdir(_LEGACY_BATCH_JOBS_DIR) and not os.path.exists(BATCH_JOBS_DIR):
+    os.replace(_LEGACY_BATCH_JOBS_DIR, BATCH_JOBS_DIR) # Earlier versions kept the jobs in TEMP_DIR
+
+# Shared secret for the /admin endpoints (sent as the X-Admin-Token header); unset = they are disabled
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# --- Scrape-time metrics (see /metrics) ---
+def _cache_lookups():
+    return [({"kind": kind, "result": "hit"}, count) for kind, count in result_cache.hits.items()] + \
+           [({"kind": kind, "result": "miss"}, count) for kind, count in result_cache.misses.items()]
+
+def _cache_hit_ratio():
+    hits, misses = sum(result_cache.hits.values()), sum(result_cache.misses.values())
+    return [({}, hits / (hits + misses) if hits + misses else 0.0)]
+
+metrics.register_callback("accent_cache_lookups_total", "Result cache lookups by key kind and outcome.",
+                          "counter", _cache_lookups)
+metrics.register_callback("accent_cache_hit_ratio", "Result cache hits over all lookups since startup.",
+                          "gauge", _cache_hit_ratio)
+metrics.register_callback("accent_embedding_store_clips", "Clip embeddings in the embedding store.",
+                          "gauge", lambda: [({}, len(embedding_store))])
+metrics.register_callback("accent_temp_dir_bytes", "Bytes held in the temporary media directory.",
+                          "gauge", lambda: [({}, download_manager.usage())])
+metrics.register_callback("accent_event_listeners", "Open task event streams (both listeners).",
+                          "gauge", lambda: [({}, task_events.listener_count())])
+metrics.register_callback("accent_webhooks_pending", "Webhook deliveries waiting for a first attempt or a retry.",
+                          "gauge", lambda: [({}, webhooks.pending())])
+metrics.register_callback("accent_queue_depth", "Tasks queued or running (shared task store).",
+                          "gauge", lambda: [({}, task_store.count_active())])
 
 # Ensure Hugging Face cache directory is created (this is handled by accent_analysis.py too, but good to ensure)
 os.makedirs(HF_CACHE_DIR, exist_ok=True)
@@ -30,28 +141,17 @@ print(f"Hugging Face cache directory created/ensured at: {HF_CACHE_DIR}")
 
 # --- Load the Accent Classification Model on App Startup ---
 # This is crucial to load the model once and avoid repeated loading for each request.
-with app.app_context():
-    load_accent_model()
-
-
-ACCENT_MAP = {
-    "australia": "Australian",
-    "canada": "Canadian",
-    "england": "British",
-    "us": "American",
-    "philippines": "Filipino",
-    "africa": "South African",
-    "newzealand": "New Zealand",
-    "ireland": "Irish",
-    "scotland": "Scottish",
-    "wales": "Welsh",
-    "malaysia": "Malaysian",
-    "singapore": "Singaporean",
-    "bermuda": "Bermudian",
-    "hongkong": "Hong Kong",
-    "india": "Indian",
-    "southatlandtic": "South Atlantic"
-}
+# It loads on a background thread, so the app serves the index page and /healthz right away;
+# /readyz turns 200 (and /analyze starts accepting work) once the model is ready.
+start_model_loading()
+
+def _model_unavailable_response():
+    """503 for work submitted before the model is ready (or after it failed to load)."""
+    if model_status["state"] == "failed":
+        return jsonify({"status": "error", "message": f"The accent model failed to load: {model_status['error']}"}), 503
+    response = jsonify({"status": "error", "message": "The accent model is still loading. Please retry shortly.",
+                        "retry_after": 5})
+    return response, 503, {"Retry-After": "5"}
 
 # --- Helper Function to Clean Up Temporary Files ---
 def cleanup_temp_files(file_path):
@@ -76,53 +176,148 @@ def cleanup_temp_files(file_path):
         except Exception as e:
             app.logger.error(f"Error cleaning up {file_path}: {e}")
 
-# --- Core Logic for Video Processing and Accent Analysis (Background Task) ---
-def process_video_and_analyze_accent(video_url, task_id):
+# --- Progressive acquisition path (AUDIO_ACQUISITION_MODE='progressive') ---
+def _analyze_progressively(video_url, task_id, timings, details):
     """
-    Downloads a video, extracts its audio, and classifies the English accent.
-    This function runs in a background thread managed by Flask-Executor.
+    Streams the audio and classifies it chunk by chunk, publishing the interim best guess
+    to the task store. Leaving the with-block closes the stream, so an early exit stops
+    yt-dlp and FFmpeg immediately. Sources that cannot be streamed fall back to a download.
+    Returns the detect_accent results with a ready-to-report error message.
     """
-    video_path = None
-    audio_path = None
-    try:
-        # 1. Download Video
-        app.logger.info(f"Task {task_id}: Starting video download for {video_url}")
+    def on_progress(progress):
+        task_store.set_progress(task_id, progress)
+
+    task_store.set_state(task_id, DOWNLOADING)
+    with closing(stream_audio_chunks(video_url, task_id)) as chunks:
+        try:
+            first_chunk = next(chunks)
+        except DownloadLimitError as limit_error:
+            return None, None, None, None, f"Audio acquisition failed: {limit_error}"
+        except AudioStreamError as stream_error:
+            app.logger.info(f"Task {task_id}: Streaming unavailable ({stream_error}), falling back to file download.")
+            with metrics.stage('acquire', timings):
+                waveform, fallback_error = download_and_decode_audio(video_url, task_id, TEMP_DIR)
+            if fallback_error:
+                return None, None, None, None, f"Audio acquisition failed: {fallback_error}"
+            task_store.set_state(task_id, CLASSIFYING)
+            with metrics.stage('classify', timings):
+                accent, confidence, summary, probabilities, accent_error = detect_accent_from_waveform(
+                    waveform, task_id, details)
+        else:
+            app.logger.info(f"Task {task_id}: Classifying audio progressively...")
+            # Download, decoding and classification overlap from here on, so they are timed as one stage
+            task_store.set_state(task_id, CLASSIFYING)
+            with metrics.stage('progressive', timings):
+                accent, confidence, summary, probabilities, accent_error = detect_accent_progressive(
+                    chain([first_chunk], chunks), task_id, on_progress=on_progress, details=details)
+
+    if accent_error:
+        return None, None, None, None, f"Accent analysis failed: {accent_error}"
+    return accent, confidence, summary, probabilities, None
+
+# --- File-based acquisition path (AUDIO_ACQUISITION_MODE='file') ---
+def _acquire_from_file(video_url, task_id, timings):
+    """
+    Downloads the full video and decodes its audio track straight to 16 kHz PCM in memory
+    (no intermediate WAV file is written or read back).
+    Returns the waveform, a ready-to-report error message and the downloaded video path,
+    which the caller is responsible for cleaning up.
+    """
+    # 1. Download Video
+    app.logger.info(f"Task {task_id}: Starting video download for {video_url}")
+    task_store.set_state(task_id, DOWNLOADING)
+    with metrics.stage('download', timings):
         video_path, download_error = download_video(video_url, task_id, TEMP_DIR)
-        if download_error:
-            return {"status": "error", "message": f"Video download failed: {download_error}"}
-        app.logger.info(f"Task {task_id}: Video downloaded to {video_path}")
+    if download_error:
+        return None, f"Video download failed: {download_error}", None
+    app.logger.info(f"Task {task_id}: Video downloaded to {video_path}")
 
-        # 2. Extract Audio
-        app.logger.info(f"Task {task_id}: Extracting audio from video...")
-        audio_path, extract_error = extract_audio(video_path, task_id, TEMP_DIR)
-        if extract_error:
-            return {"status": "error", "message": f"Audio extraction failed: {extract_error}"}
-        app.logger.info(f"Task {task_id}: Audio extracted to {audio_path}")
+    # 2. Decode Audio
+    app.logger.info(f"Task {task_id}: Extracting audio from video...")
+    task_store.set_state(task_id, EXTRACTING)
+    with metrics.stage('extract', timings):
+        waveform, extract_error = decode_audio(video_path, task_id)
+    if extract_error:
+        return None, f"Audio extraction failed: {extract_error}", video_path
+    return waveform, None, video_path
 
-        # --- IMPORTANT CHANGE: Convert absolute audio_path to relative path ---
-        # This is to work around potential issues where SpeechBrain might
-        # implicitly prepend the current working directory to the path.
-        relative_audio_path = os.path.relpath(audio_path, os.getcwd())
-        app.logger.info(f"Task {task_id}: Relative audio path for SpeechBrain: {relative_audio_path}")
+# --- Classification of decoded audio (URL and upload tasks) ---
+def _classify_and_store(waveform, task_id, timings=None, video_url=None):
+    """
+    Classifies a decoded waveform, unless the same audio was analyzed before (result cache by
+    audio fingerprint), and stores the result and embedding. Returns the client-facing result.
+    """
+    # Same audio behind a different URL (or uploaded again): reuse the stored result
+    fingerprint = audio_fingerprint(waveform)
+    cached_result = result_cache.get_by_audio(fingerprint)
+    if cached_result is not None:
+        app.logger.info(f"Task {task_id}: Cache hit for audio fingerprint {fingerprint[:12]}")
+        if video_url:
+            result_cache.put(cached_result, video_url=video_url) # Remember this URL too
+        return dict(cached_result, cached=True)
 
+    app.logger.info(f"Task {task_id}: Analyzing accent...")
+    task_store.set_state(task_id, CLASSIFYING)
+    details = {}
+    with metrics.stage('classify', timings):
+        accent, confidence, summary, probabilities, accent_error = detect_accent_from_waveform(
+            waveform, task_id, details)
+    if accent_error:
+        return {"status": "error", "message": f"Accent analysis failed: {accent_error}"}
 
-        # 3. Classify Accent
-        app.logger.info(f"Task {task_id}: Analyzing accent...")
-        # Pass the relative_audio_path to the detect_accent function
-        accent, confidence, summary, accent_error = detect_accent(relative_audio_path, task_id)
-        if accent_error:
-            return {"status": "error", "message": f"Accent analysis failed: {accent_error}"}
+    app.logger.info(f"Task {task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
+    result = format_result(accent, confidence, summary, probabilities, details)
+    _store_result(result, details, accent, confidence, video_url=video_url, fingerprint=fingerprint)
+    return result
+
+def _store_result(result, details, accent, confidence, video_url=None, fingerprint=None):
+    """Keeps a fresh result in the result cache and the clip's embedding in the embedding store."""
+    result_cache.put(result, video_url=video_url, fingerprint=fingerprint)
+    if details.get("embedding") is not None:
+        embedding_store.add(details["embedding"], video_url=video_url, fingerprint=fingerprint,
+                            accent=accent, confidence=round(confidence, 2))
+
+# --- Core Logic for Video Processing and Accent Analysis (Background Task) ---
+def process_video_and_analyze_accent(video_url, task_id, timings=None):
+    """
+    Acquires the audio of a video (streamed or via a file download) and classifies the English accent.
+    This function runs in a background thread managed by Flask-Executor.
+    Stage durations are recorded into `timings` (stage name -> seconds) when a dict is given.
+    """
+    video_path = None
+    try:
+        # 0. Result cache lookup by normalized URL (a hit skips the download entirely)
+        cached_result = result_cache.get_by_url(video_url)
+        if cached_result is not None:
+            app.logger.info(f"Task {task_id}: Cache hit for {video_url}")
+            return dict(cached_result, cached=True)
 
-        app.logger.info(f"Task {task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
+        if AUDIO_ACQUISITION_MODE == 'progressive':
+            details = {}
+            accent, confidence, summary, probabilities, error = _analyze_progressively(
+                video_url, task_id, timings, details)
+            if error:
+                return {"status": "error", "message": error}
+            app.logger.info(f"Task {task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
+            result = format_result(accent, confidence, summary, probabilities, details)
+            _store_result(result, details, accent, confidence, video_url=video_url)
+            return result
 
-        predicted_accent = ACCENT_MAP.get(accent)
+        if AUDIO_ACQUISITION_MODE == 'stream':
+            # 1+2. Stream and decode audio in memory (no media files in TEMP_DIR)
+            app.logger.info(f"Task {task_id}: Streaming audio for {video_url}")
+            task_store.set_state(task_id, DOWNLOADING) # Download and decoding run as one pipe
+            with metrics.stage('acquire', timings):
+                waveform, acquire_error = acquire_audio(video_url, task_id, TEMP_DIR)
+            if acquire_error:
+                return {"status": "error", "message": f"Audio acquisition failed: {acquire_error}"}
+        else:
+            waveform, acquire_error, video_path = _acquire_from_file(video_url, task_id, timings)
+            if acquire_error:
+                return {"status": "error", "message": acquire_error}
 
-        return {
-            "status": "completed",
-            "accent": predicted_accent,
-            "confidence": f"{confidence:.2f}%",
-            "summary": summary
-        }
+        # 3. Classify Accent
+        return _classify_and_store(waveform, task_id, timings, video_url)
 
     except Exception as e:
         error_message = f"An unexpected error occurred during processing: {e}"
@@ -131,7 +326,107 @@ def process_video_and_analyze_accent(video_url, task_id):
     finally:
         # Clean up temporary files regardless of success or failure
         cleanup_temp_files(video_path)
-        cleanup_temp_files(audio_path)
+
+# --- Uploaded audio (/analyze/upload, decoded while the request was received) ---
+def process_uploaded_audio(waveform, task_id, timings=None):
+    """Classifies the decoded audio of an upload; runs in a background thread like the URL pipeline."""
+    try:
+        return _classify_and_store(waveform, task_id, timings)
+    except Exception as e:
+        error_message = f"An unexpected error occurred during processing: {e}"
+        app.logger.error(f"Task {task_id}: {error_message}", exc_info=True)
+        return {"status": "error", "message": error_message}
+
+def run_analysis_task(video_url, task_id, submitted_at=None, callback_url=None, waveform=None, timings=None):
+    """
+    Executor entry point: runs the pipeline and records the final result in the task store,
+    together with the per-stage timings (kept out of the result cache). With a callback_url,
+    the result is also POSTed there (see webhooks.py). For an upload, the already decoded
+    `waveform` is classified instead of a video_url, and `timings` has its decoding time.
+    """
+    timings = dict(timings or {})
+    if submitted_at is not None:
+        timings['queue_wait'] = round(time.time() - submitted_at, 4)
+        metrics.STAGE_SECONDS.observe(timings['queue_wait'], stage='queue_wait')
+    start = time.perf_counter()
+    with metrics.stage('total', timings):
+        if waveform is None:
+            result = process_video_and_analyze_accent(video_url, task_id, timings)
+        else:
+            result = process_uploaded_audio(waveform, task_id, timings)
+    _finish_task(task_id, result, timings, callback_url)
+    admission.record_duration(time.perf_counter() - start)
+    return result
+
+def _finish_task(task_id, result, timings, callback_url=None):
+    """Records a task's final result and stage timings, and POSTs the result to the callback_url if there is one."""
+    outcome = 'cached' if result.get('cached') else result['status']
+    metrics.TASKS.inc(outcome=outcome)
+    task_store.complete(task_id, dict(result, timings=timings))
+    if callback_url:
+        webhooks.submit(callback_url, dict(result, task_id=task_id), task_id)
+
+# --- Live raw PCM (/ingest/<task_id>) ---
+def _classify_pcm_stream(task_id, chunks, early_exit=False, callback_url=None):
+    """
+    Generator behind /ingest/<task_id>: feeds the PCM chunks to a ProgressiveClassifier as they
+    arrive and yields a JSON line with the rolling estimate whenever it changes (also published
+    to the task store), then the final result, which is recorded like any other task's. If the
+    client goes away, the audio received until then is still classified and recorded.
+    """
+    timings = {}
+    classifier = ProgressiveClassifier(task_id, block_seconds=INGEST_BLOCK_SECONDS)
+    windows_classified, stop_reason, client_gone, error = 0, None, False, None
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            received_at = time.perf_counter()
+            classifier.feed(chunk)
+            progress = classifier.progress()
+            if progress["windows_classified"] != windows_classified:
+                windows_classified = progress["windows_classified"]
+                latency = time.perf_counter() - received_at
+                metrics.INGEST_ESTIMATE_SECONDS.observe(latency)
+                progress["estimate_latency_ms"] = round(latency * 1000, 1)
+                task_store.set_progress(task_id, progress)
+                yield json.dumps(_progress_payload(CLASSIFYING, progress)) + "\n"
+            # The speech cap always ends the analysis (as on the file and stream paths); early_exit
+            # only decides whether a confident prediction does too
+            reason = classifier.stop_reason()
+            if reason == "speech_cap" or (early_exit and reason == "confident"):
+                stop_reason = reason
+                app.logger.info(f"Task {task_id}: Early exit ({stop_reason}) after {classifier.audio_seconds:.1f}s of audio")
+                break
+        if stop_reason is None:
+            classifier.finish()
+    except GeneratorExit:
+        client_gone = True
+    except Exception as e:
+        error = f"An error occurred during accent detection: {e}"
+        app.logger.error(f"Task {task_id}: {error}", exc_info=True)
+    timings['ingest'] = round(time.perf_counter() - start, 4)
+    metrics.STAGE_SECONDS.observe(timings['ingest'], stage='ingest')
+
+    # Whatever fails from here on, the task must still end as completed or error
+    try:
+        if error is None:
+            if client_gone:
+                classifier.finish()
+            details = {"embedding": classifier.embedding()}
+            details["timeline"], details["speakers"] = classifier.breakdown()
+            accent, confidence, summary, probabilities, error = classifier.result(stop_reason)
+        if error:
+            result = {"status": "error", "message": f"Accent analysis failed: {error}"}
+        else:
+            app.logger.info(f"Task {task_id}: Accent: {accent}, Confidence: {confidence:.2f}%")
+            result = format_result(accent, confidence, summary, probabilities, details)
+            _store_result(result, details, accent, confidence)
+    except Exception as e:
+        app.logger.error(f"Task {task_id}: An error occurred during accent detection: {e}", exc_info=True)
+        result = {"status": "error", "message": f"Accent analysis failed: {e}"}
+    _finish_task(task_id, result, timings, callback_url)
+    if not client_gone:
+        yield json.dumps(result) + "\n"
 
 # --- Flask Routes ---
 
@@ -140,6 +435,31 @@ def index():
     """Renders the main HTML page."""
     return render_template('index.html')
 
+def _admission_check(task_id=None, claim=True, **fields):
+    """
+    Admission control: per-client rate limit first, then the global queue depth.
+    Returns a 429/503 response (or None if the submission is accepted) and the queue depth.
+    With a task_id, an accepted task is recorded in the task store in the same transaction as
+    the depth check (see TaskStore.create_if_below), so concurrent submissions cannot overshoot it.
+    """
+    allowed, retry_after = admission.check_rate(request.remote_addr)
+    if not allowed:
+        response = jsonify({"status": "error", "message": "Too many submissions. Please retry later.",
+                            "retry_after": retry_after})
+        return (response, 429, {"Retry-After": str(retry_after)}), None
+
+    if task_id is None:
+        queue_depth = task_store.count_active()
+        allowed, retry_after = admission.check_capacity(queue_depth)
+    else:
+        allowed, queue_depth = task_store.create_if_below(task_id, admission.max_queue_depth, claim, **fields)
+        retry_after = 0 if allowed else admission.check_capacity(queue_depth)[1]
+    if not allowed:
+        response = jsonify({"status": "error", "message": "The server is busy. Please retry later.",
+                            "queue_depth": queue_depth, "retry_after": retry_after})
+        return (response, 503, {"Retry-After": str(retry_after)}), queue_depth
+    return None, queue_depth
+
 @app.route('/analyze', methods=['POST'])
 def analyze_video():
     """
@@ -148,38 +468,383 @@ def analyze_video():
     """
     data = request.get_json()
     video_url = data.get('video_url')
+    callback_url = data.get('callback_url')
     app.logger.info(f"video url received: {video_url}")
 
 
     if not video_url:
         return jsonify({"status": "error", "message": "No video URL provided."}), 400
 
+    callback_error = validate_callback_url(callback_url) if callback_url is not None else None
+    if callback_error:
+        return jsonify({"status": "error", "message": callback_error}), 400
+
+    if not is_model_ready():
+        return _model_unavailable_response()
+
     # Generate a unique task ID
     task_id = str(uuid.uuid4())
 
+    # Records the task before submitting it, so /status can see it from any worker right away
+    rejection, queue_depth = _admission_check(task_id, video_url=video_url, callback_url=callback_url)
+    if rejection:
+        return rejection
+
     # Submit the long-running task to the executor
-    executor.submit_stored(task_id, process_video_and_analyze_accent, video_url, task_id)
+    executor.submit(run_analysis_task, video_url, task_id, submitted_at=time.time(), callback_url=callback_url)
 
-    return jsonify({"status": "processing", "task_id": task_id, "message": "Analysis started."}), 202
+    return jsonify({
+        "status": "processing",
+        "task_id": task_id,
+        "events_url": _events_url(task_id),
+        "message": "Analysis started.",
+        "queue_depth": queue_depth,
+        "estimated_wait_seconds": admission.estimated_wait(queue_depth)
+    }), 202
+
+@app.route('/analyze/upload', methods=['POST'])
+def analyze_upload():
+    """
+    Endpoint for local audio or video files: a multipart/form-data body with the file in a
+    `file` part and an optional `callback_url` field. The file is decoded while it is received
+    (it is never held in memory as a whole); classification then runs in the background like
+    /analyze. Returns a task ID to the client.
+    """
+    if UPLOAD_MAX_BYTES > 0 and (request.content_length or 0) > UPLOAD_MAX_BYTES:
+        return jsonify({"status": "error", "message": f"Uploads are limited to {UPLOAD_MAX_BYTES} bytes."}), 413
+
+    if not is_model_ready():
+        return _model_unavailable_response()
+
+    task_id = str(uuid.uuid4())
+    # The task holds its place in the queue while the upload is received and decoded
+    rejection, queue_depth = _admission_check(task_id, source='upload')
+    if rejection:
+        return rejection
+
+    def _refuse(message, status_code):
+        task_store.complete(task_id, {"status": "error", "message": message})
+        return jsonify({"status": "error", "message": message}), status_code
+
+    timings = {}
+    try:
+        upload = MultipartUpload(request.stream, request.content_type)
+        with metrics.stage('upload', timings):
+            waveform, decode_error = decode_upload(upload, task_id, TEMP_DIR)
+    except UploadTooLargeError as e:
+        return _refuse(str(e), 413)
+    except UploadError as e:
+        return _refuse(str(e), 400)
+    if decode_error:
+        return _refuse(f"Audio decoding failed: {decode_error}", 400)
+    app.logger.info(f"Task {task_id}: Upload {upload.filename} decoded ({upload.bytes_received} bytes received)")
+
+    callback_url = upload.fields.get('callback_url')
+    callback_error = validate_callback_url(callback_url) if callback_url is not None else None
+    if callback_error:
+        return _refuse(callback_error, 400)
+
+    executor.submit(run_analysis_task, None, task_id, submitted_at=time.time(), callback_url=callback_url,
+                    waveform=waveform, timings=timings)
+
+    return jsonify({
+        "status": "processing",
+        "task_id": task_id,
+        "events_url": _events_url(task_id),
+        "message": "Upload received. Analysis started.",
+        "audio_seconds": round(len(waveform) / 16000, 1),
+        "queue_depth": queue_depth,
+        "estimated_wait_seconds": admission.estimated_wait(queue_depth)
+    }), 202
+
+@app.route('/ingest', methods=['POST'])
+def start_ingest():
+    """
+    Opens a live-audio task. Its raw PCM is then POSTed to the returned ingest_url (see
+    ingest_pcm); the rolling estimates can also be followed on events_url or /status.
+    Optional JSON body: {"callback_url": "..."} to have the final result POSTed there.
+    """
+    data = request.get_json(silent=True) or {}
+    callback_url = data.get('callback_url')
+    callback_error = validate_callback_url(callback_url) if callback_url is not None else None
+    if callback_error:
+        return jsonify({"status": "error", "message": callback_error}), 400
+
+    if not is_model_ready():
+        return _model_unavailable_response()
+
+    task_id = str(uuid.uuid4())
+    # Not claimed (heartbeated) until its stream starts: an unstarted session is orphaned after
+    # TASK_ORPHAN_SECONDS, so it stops counting toward the queue depth and is failed
+    rejection, _ = _admission_check(task_id, claim=False, source='pcm', callback_url=callback_url)
+    if rejection:
+        return rejection
+    return jsonify({
+        "status": "ready",
+        "task_id": task_id,
+        "ingest_url": f"/ingest/{task_id}",
+        "events_url": _events_url(task_id),
+        "sample_rate": 16000,
+        "formats": sorted(PCM_FORMATS),
+        "expires_in_seconds": task_store.orphan_seconds,
+    }), 201
+
+@app.route('/ingest/<task_id>', methods=['POST'])
+def ingest_pcm(task_id):
+    """
+    Classifies raw 16 kHz mono PCM while it is being sent, e.g. as a chunked request body from
+    a microphone or an RTP receiver (query parameter `format`: s16le, the default, or f32le).
+    Responds with JSON lines: the rolling estimate (as /status reports it) after every
+    INGEST_BLOCK_SECONDS of audio, also published to /status and /events/<task_id>, and the
+    final result once the body ends or MAX_SPEECH_SECONDS of speech have been analyzed. With
+    `early_exit=1` the stream is also cut off as soon as the prediction is confident (see EARLY_EXIT_MARGIN).
+    """
+    sample_format = request.args.get('format', 's16le')
+    if sample_format not in PCM_FORMATS:
+        return jsonify({"status": "error", "message": f"format must be one of: {', '.join(sorted(PCM_FORMATS))}."}), 400
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({"status": "error", "message": "Unknown or expired task ID."}), 404
+    if task["fields"].get("source") != 'pcm' or task["state"] != QUEUED:
+        return jsonify({"status": "error", "message": "This task is not waiting for a PCM stream."}), 409
+    if time.time() - task["updated_at"] > task_store.orphan_seconds:
+        return jsonify({"status": "error", "message": "This live-audio session has expired. Please open a new one."}), 410
+    if not ingest_stream_slots.acquire(blocking=False):
+        response = jsonify({"status": "error", "message": "Too many live audio streams. Please retry later.",
+                            "retry_after": 5})
+        return response, 503, {"Retry-After": "5"}
+
+    task_store.set_state(task_id, CLASSIFYING)
+    task_store.claim(task_id)
+    app.logger.info(f"Task {task_id}: Receiving {sample_format} PCM")
+    results = _classify_pcm_stream(task_id, pcm_chunks(request.stream, sample_format),
+                                   early_exit=bool(request.args.get('early_exit')),
+                                   callback_url=task["fields"].get("callback_url"))
+    response = Response(results, mimetype='application/x-ndjson',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(ingest_stream_slots.release)
+    return response
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Classifies many URLs in one request and streams one JSON line per URL as each finishes
+    (application/x-ndjson, in completion order; every line has the URL's index and url).
+    The body is either JSON {"urls": [...], "job_id": "...", "retry_errors": false} or a JSONL/text
+    list of URLs (job_id and retry_errors as query parameters). Resubmitting the same job_id
+    replays the results already produced and only processes the remaining URLs.
+    """
+    try:
+        if request.is_json:
+            data = request.get_json()
+            urls = data.get('urls') or []
+            job_id = data.get('job_id')
+            retry_errors = bool(data.get('retry_errors'))
+        else:
+            urls = parse_url_lines(request.get_data(as_text=True).splitlines())
+            job_id = request.args.get('job_id')
+            retry_errors = bool(request.args.get('retry_errors'))
+    except (ValueError, AttributeError):
+        return jsonify({"status": "error", "message": "Could not parse the URL list."}), 400
+
+    if not urls or not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({"status": "error", "message": "No video URLs provided."}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({"status": "error", "message": f"At most {BATCH_MAX_URLS} URLs per batch."}), 413
+    job_id = job_id or uuid.uuid4().hex
+    if not JOB_ID_PATTERN.match(job_id):
+        return jsonify({"status": "error", "message": "job_id may only contain letters, digits, '-' and '_'."}), 400
+
+    if not is_model_ready():
+        return _model_unavailable_response()
+
+    # A job is refused while the queue is full; once accepted, its items enter the pipeline a few
+    # at a time and each counts toward the queue depth while it is there
+    rejection, _ = _admission_check()
+    if rejection:
+        return rejection
+
+    output_path = os.path.join(BATCH_JOBS_DIR, f"{job_id}.jsonl")
+    try:
+        # Locks the job's output file, so a job_id runs once at a time across all workers
+        results = batch_pipeline.run_job(urls, output_path, retry_errors=retry_errors, replay=True)
+    except BatchJobRunningError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    app.logger.info(f"Batch job {job_id}: {len(urls)} URL(s) received")
+
+    response = Response((json.dumps(result) + "\n" for result in results), mimetype='application/x-ndjson',
+                        headers={"X-Batch-Job-Id": job_id})
+    # Stops the pipeline if the client disconnected early, and releases the job's lock
+    response.call_on_close(results.close)
+    return response
+
+@app.route('/similar', methods=['GET'])
+def similar_clips():
+    """
+    Nearest previously analyzed clips to an analyzed video, by embedding cosine similarity:
+    ?video_url=...&k=10. Neighbours above EMBEDDING_DUPLICATE_SIMILARITY are flagged as duplicates
+    (reuploads or the same recording); accent_votes counts the neighbours' accents.
+    """
+    video_url = request.args.get('video_url')
+    if not video_url:
+        return jsonify({"error": "Missing 'video_url' query parameter."}), 400
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "'k' must be an integer."}), 400
+
+    rows = embedding_store.find(video_url=video_url)
+    if not rows:
+        return jsonify({"error": "No embedding stored for this video. Analyze it first."}), 404
+    query = embedding_store.metadata(rows[-1:])[0]
+    neighbours = embedding_store.search(embedding_store.vector(rows[-1]), k=k, exclude_rows=rows)
+    accent_votes = {}
+    for neighbour in neighbours:
+        neighbour["duplicate"] = neighbour["similarity"] >= EMBEDDING_DUPLICATE_SIMILARITY
+        accent_votes[neighbour.get("accent")] = accent_votes.get(neighbour.get("accent"), 0) + 1
+    return jsonify({
+        "video_url": video_url,
+        "accent": query.get("accent"),
+        "neighbours": neighbours,
+        "accent_votes": accent_votes,
+    }), 200
 
 @app.route('/status/<task_id>', methods=['GET'])
 def task_status(task_id):
     """
     Endpoint to check the status of a submitted task.
-    Returns progress or final results.
+    Returns progress or final results. Final results can be read repeatedly until they expire.
+    With `timings=1` a finished task also reports how long each pipeline stage took.
     """
-    if not executor.futures.done(task_id):
-        # Task is still running or pending
-        return jsonify({"status": "processing", "message": "Still processing..."}), 200
-    else:
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({"status": "error", "message": "Unknown or expired task ID."}), 404
+    return jsonify(_status_payload(task, include_timings=bool(request.args.get('timings')))), 200
+
+def _status_payload(task, include_timings=False):
+    """The /status (and task event) JSON for a task record: the final result, or its stage and progress."""
+    if task["state"] in TERMINAL_STATES:
         # Task is completed (successfully or with error)
-        future = executor.futures.pop(task_id) # Get and remove the future from storage
-        try:
-            result = future.result() # Get the result of the task
-            return jsonify(result), 200
-        except Exception as e:
-            app.logger.error(f"Error retrieving result for task {task_id}: {e}", exc_info=True)
-            return jsonify({"status": "error", "message": f"Failed to retrieve task result: {e}"}), 500
+        result = task["result"]
+        if not include_timings:
+            result = {key: value for key, value in result.items() if key != 'timings'}
+        return result
+
+    # Task is still queued or running; report the stage (and the interim guess in progressive mode)
+    return _progress_payload(task["state"], task["progress"])
+
+def _progress_payload(stage, progress):
+    """The /status JSON of an unfinished task: its stage and, once there is one, its progress and interim guess."""
+    response = {"status": "processing", "stage": stage, "message": f"Still processing ({stage})..."}
+    if progress:
+        message = f"Still processing... {progress['audio_seconds_consumed']:.0f}s of audio consumed"
+        if 'interim_accent' in progress:
+            progress = dict(progress, interim_accent=accent_display_name(progress['interim_accent']))
+            message += f", current best guess: {progress['interim_accent']} ({progress['interim_confidence']:.2f}%)"
+        response.update(message=message, progress=progress)
+    return response
+
+@app.route('/events/<task_id>', methods=['GET'])
+def task_event_stream(task_id):
+    """
+    Server-sent events for a task: a 'stage' event whenever its stage or progress changes and a
+    final 'result' event (the same JSON as /status), after which the stream ends. Every open
+    stream holds a thread, so beyond EVENTS_MAX_STREAMS per process this returns 503 and
+    clients fall back to polling /status (or use the EVENTS_PORT listener).
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({"status": "error", "message": "Unknown or expired task ID."}), 404
+    last_event_id = request.headers.get('Last-Event-ID')
+    if already_delivered(task, last_event_id):
+        return '', 204 # Tells EventSource to stop reconnecting
+    if not event_stream_slots.acquire(blocking=False):
+        response = jsonify({"status": "error", "message": "Too many open event streams. Poll /status instead.",
+                            "retry_after": 5})
+        return response, 503, {"Retry-After": "5"}
+
+    response = Response(stream_task_events(task_events, task_id, _status_payload, last_event_id),
+                        mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+# The asyncio event stream listener, for thousands of idle clients (EVENTS_PORT; 0 = only the route above)
+event_stream_server = None
+if EVENTS_PORT:
+    try:
+        event_stream_server = EventStreamServer(task_events, _status_payload).start()
+        print(f"Task event streams served at http://0.0.0.0:{event_stream_server.port}/events/<task_id>")
+    except OSError as e:
+        print(f"Event stream listener could not bind port {EVENTS_PORT} ({e}); events_url uses /events instead.")
+
+def _events_url(task_id):
+    """Where a client follows a task: the asyncio listener when it runs, else the Flask /events route."""
+    if event_stream_server is None:
+        return f"/events/{task_id}"
+    if EVENTS_PUBLIC_URL:
+        return f"{EVENTS_PUBLIC_URL.rstrip('/')}/events/{task_id}"
+    host = urlsplit(f"//{request.host}").hostname
+    host = f"[{host}]" if ':' in host else host
+    return f"http://{host}:{event_stream_server.port}/events/{task_id}"
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness probe: the process is up and serving, whatever the state of the model."""
+    return jsonify({"status": "ok", "model": model_status}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness probe: 200 once the model is loaded and analyses can be accepted, 503 until then."""
+    if is_model_ready():
+        return jsonify({"status": "ready", "model": model_status}), 200
+    return jsonify({"status": model_status["state"], "model": model_status}), 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (metrics of the worker process that serves the request)."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# --- Admin Routes ---
+
+def _admin_rejection():
+    """
+    Admin routes are disabled (404) unless ADMIN_TOKEN is set, and then need a matching
+    X-Admin-Token header (401). Returns the rejection, or None for an authorized request.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "Not found."}), 404
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"status": "error", "message": "Unauthorized."}), 401
+    return None
+
+@app.route('/admin/cache', methods=['GET'])
+def cache_inspect():
+    """
+    Returns result cache statistics (entries, hit/miss counters) and the most recently used entries.
+    Query parameter `limit` caps the number of entries listed (default 100).
+    """
+    rejection = _admin_rejection()
+    if rejection:
+        return rejection
+    limit = request.args.get('limit', default=100, type=int)
+    return jsonify({"stats": result_cache.stats(), "entries": result_cache.entries(limit)}), 200
+
+@app.route('/admin/cache', methods=['DELETE'])
+def cache_purge():
+    """
+    Purges the result cache. With a `key` query parameter only that entry is removed
+    (e.g. key=url:youtube:dQw4w9WgXcQ); with `expired=1` only expired/overflow entries are evicted.
+    """
+    rejection = _admin_rejection()
+    if rejection:
+        return rejection
+    if request.args.get('expired'):
+        removed = result_cache.evict()
+    else:
+        removed = result_cache.purge(request.args.get('key'))
+    return jsonify({"status": "ok", "removed": removed}), 200
 
 # --- Application Shutdown Hook (Optional but Recommended for Cleanup) ---
 # @app.teardown_appcontext
@@ -193,6 +858,10 @@ def task_status(task_id):
 
 # --- Main entry point for running the Flask app ---
 if __name__ == '__main__':
-    # When running locally, use debug=True for development.
+    # Set FLASK_DEBUG=1 for development. The debug reloader re-imports the app in a child
+    # process (loading the model twice), so it stays off by default.
+    if INFERENCE_WORKERS > 0:
+        # Worker processes re-run the main script on startup, and this one starts the whole app
+        raise SystemExit("INFERENCE_WORKERS needs the app to be served by gunicorn or `flask run`, not `python app.py`.")
     print(f"Starting Flask app from current working directory: {os.getcwd()}") # Added for debugging
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Audio sent in the request body rather than fetched from a video URL:
+
+- uploads (/analyze/upload): a multipart/form-data body is parsed as it is received and its
+  file part is passed on chunk by chunk to FFmpeg's stdin, so the upload is never held in
+  memory. MP4/MOV files whose index (moov atom) follows the media data cannot be decoded from
+  a pipe; those are written to a temporary file and decoded from there.
+- raw PCM (/ingest/<task_id>): 16 kHz mono samples in a chunked request body, turned into
+  float32 chunks as they arrive so they can be classified incrementally.
+"""
+import os
+import uuid
+from itertools import chain
+
+import numpy as np
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+import metrics
+from audio_segmentation import SEGMENT_WINDOW_SECONDS
+from task_events import WEB_THREADS
+from video_processing import decode_audio, decode_audio_stream, SAMPLE_RATE, MAX_AUDIO_SECONDS
+
+# --- Ingestion configuration (overridable through environment variables) ---
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 500 * 1024 * 1024))
+# Raw PCM streams classified at once per process (each holds a request thread); by default a
+# quarter of the server's threads (WEB_THREADS, see task_events.EVENTS_MAX_STREAMS)
+INGEST_MAX_STREAMS = int(os.environ.get('INGEST_MAX_STREAMS', max(WEB_THREADS // 4, 1)))
+# Audio per classification step of a PCM stream; the rolling estimate is updated after each
+INGEST_BLOCK_SECONDS = float(os.environ.get('INGEST_BLOCK_SECONDS', SEGMENT_WINDOW_SECONDS))
+# Audio read from the request body at a time (how long arrived audio can wait to be buffered)
+INGEST_READ_SECONDS = float(os.environ.get('INGEST_READ_SECONDS', 0.1))
+
+# Raw PCM sample formats: numpy dtype and the scale to [-1, 1] floats
+PCM_FORMATS = {'s16le': ('<i2', 1 / 32768), 'f32le': ('<f4', 1.0)}
+_READ_BYTES = 64 * 1024
+# The start of an upload inspected for the MP4 box order
+_SNIFF_BYTES = 64 * 1024
+
+
+class UploadError(ValueError):
+    """Raised for a malformed upload (HTTP 400)."""
+
+
+class UploadTooLargeError(UploadError):
+    """Raised once an upload exceeds UPLOAD_MAX_BYTES (HTTP 413)."""
+
+
+class MultipartUpload:
+    """
+    A multipart/form-data request body, read from the stream while it arrives. Iterating yields
+    the bytes of the first file part named `field`; the form fields end up in .fields (those
+    after the file only once the iteration has finished) and the file's name in .filename.
+    """
+
+    def __init__(self, stream, content_type, field='file', max_bytes=UPLOAD_MAX_BYTES):
+        mimetype, options = parse_options_header(content_type or '')
+        if mimetype != 'multipart/form-data' or not options.get('boundary'):
+            raise UploadError("Expected a multipart/form-data body.")
+        self.stream = stream
+        self.boundary = options['boundary'].encode('latin-1')
+        self.field = field
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.filename = None
+        self.bytes_received = 0
+
+    def __iter__(self):
+        decoder = MultipartDecoder(self.boundary)
+        part, value = None, bytearray()
+        try:
+            while True:
+                event = decoder.next_event()
+                if isinstance(event, NeedData):
+                    data = self.stream.read(_READ_BYTES)
+                    self.bytes_received += len(data)
+                    metrics.BYTES_RECEIVED.inc(len(data), source='upload')
+                    if self.max_bytes > 0 and self.bytes_received > self.max_bytes:
+                        raise UploadTooLargeError(f"Uploads are limited to {self.max_bytes} bytes.")
+                    decoder.receive_data(data or None)
+                elif isinstance(event, File):
+                    part = 'file' if event.name == self.field and self.filename is None else None
+                    if part:
+                        self.filename = event.filename or 'upload'
+                elif isinstance(event, Field):
+                    part, value = event.name, bytearray()
+                elif isinstance(event, Data):
+                    if part == 'file':
+                        if event.data:
+                            yield bytes(event.data)
+                    elif part is not None:
+                        value += event.data
+                        if len(value) > _READ_BYTES:
+                            raise UploadError(f"Form field '{part}' is too large.")
+                        if not event.more_data:
+                            self.fields[part] = value.decode(errors='replace')
+                elif isinstance(event, Epilogue):
+                    return
+        except ValueError as e: # Includes the decoder's errors for truncated or malformed bodies
+            if isinstance(e, UploadError):
+                raise
+            raise UploadError(f"Malformed multipart body: {e}")
+
+
+def _moov_after_mdat(head):
+    """True for an MP4/MOV whose index (moov box) follows the media data (mdat), judging by its first bytes."""
+    if head[4:8] != b'ftyp':
+        return False
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        kind = head[offset + 4:offset + 8]
+        if kind == b'moov':
+            return False
+        if kind == b'mdat':
+            return True
+        if size == 1 and offset + 16 <= len(head): # 64-bit box size
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+def decode_upload(upload, task_id, temp_dir):
+    """
+    Decodes the file of a MultipartUpload to 16 kHz mono PCM while it is being received: piped
+    into FFmpeg, or for an MP4 with its moov atom at the end, through a file in temp_dir.
+    Returns (PCM samples as a float32 numpy array, None), or (None, error message) if an error occurs.
+    Raises UploadError for a malformed upload or one without a file.
+    """
+    chunks = iter(upload)
+    head = bytearray()
+    for data in chunks:
+        head += data
+        if len(head) >= _SNIFF_BYTES:
+            break
+    if upload.filename is None:
+        raise UploadError(f"No file uploaded (expected a part named '{upload.field}').")
+    print(f"Task {task_id}: Receiving upload {upload.filename}")
+    chunks = chain([bytes(head)], chunks)
+    if not _moov_after_mdat(head):
+        return decode_audio_stream(chunks, task_id)
+
+    print(f"Task {task_id}: {upload.filename} cannot be decoded from a pipe (moov atom at the end); "
+          "writing it to a temporary file")
+    upload_path = os.path.join(temp_dir, f"upload_{uuid.uuid4()}.media")
+    try:
+        with open(upload_path, 'wb') as f:
+            for data in chunks:
+                f.write(data)
+        return decode_audio(upload_path, task_id)
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def pcm_chunks(stream, sample_format='s16le', read_seconds=INGEST_READ_SECONDS, max_seconds=MAX_AUDIO_SECONDS):
+    """
+    Yields float32 chunks of the raw 16 kHz mono PCM in a request body (sample_format is a
+    PCM_FORMATS key) as it arrives, about read_seconds of audio at a time. Ends with the body,
+    or after max_seconds of audio (0 = no limit), or when the sender disconnects.
+    """
+    dtype, scale = PCM_FORMATS[sample_format]
+    width = np.dtype(dtype).itemsize
+    read_bytes = max(int(read_seconds * SAMPLE_RATE), 1) * width
+    remainder = b''
+    total_samples = 0
+    while True:
+        try:
+            data = stream.read(read_bytes)
+        except (ClientDisconnected, OSError): # The sender went away: what arrived is all there is
+            return
+        if not data:
+            return
+        metrics.BYTES_RECEIVED.inc(len(data), source='pcm')
+        data = remainder + data
+        usable = len(data) - len(data) % width # A sample can be split across reads
+        remainder = data[usable:]
+        if not usable:
+            continue
+        chunk = np.frombuffer(data[:usable], dtype=dtype).astype(np.float32) * np.float32(scale)
+        total_samples += chunk.size
+        yield chunk
+        if max_seconds > 0 and total_samples >= max_seconds * SAMPLE_RATE:
+            return
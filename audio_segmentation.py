@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+
+# --- Segmentation configuration (overridable through environment variables) ---
+SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+# A frame is speech when its energy is this many dB above the estimated noise floor
+VAD_THRESHOLD_DB = float(os.environ.get('VAD_THRESHOLD_DB', 12))
+VAD_MIN_SPEECH_MS = 250 # Shorter bursts (clicks, pops) are ignored
+VAD_MIN_SILENCE_MS = 300 # Shorter pauses don't split a speech region
+SEGMENT_WINDOW_SECONDS = float(os.environ.get('SEGMENT_WINDOW_SECONDS', 6))
+SEGMENT_MIN_SECONDS = float(os.environ.get('SEGMENT_MIN_SECONDS', 1.5))
+# Upper bound on the speech sent to the model, whatever the length of the video
+MAX_SPEECH_SECONDS = float(os.environ.get('MAX_SPEECH_SECONDS', 120))
+# 'mean_logprob' (average log-probabilities) or 'majority' (vote of per-window top classes)
+SEGMENT_AGGREGATION = os.environ.get('SEGMENT_AGGREGATION', 'mean_logprob')
+# Windows (groups of windows) whose embeddings are at least this cosine-similar are one speaker
+SPEAKER_SIMILARITY_THRESHOLD = float(os.environ.get('SPEAKER_SIMILARITY_THRESHOLD', 0.6))
+# Speaker clusters with fewer windows than this are folded into the most similar larger one
+SPEAKER_MIN_SEGMENTS = int(os.environ.get('SPEAKER_MIN_SEGMENTS', 2))
+
+
+def _runs(mask):
+    """Returns [start, end) index pairs of the True runs in a boolean array."""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def detect_speech_regions(pcm, sample_rate=SAMPLE_RATE, threshold_db=VAD_THRESHOLD_DB):
+    """
+    Energy-based voice activity detection.
+    Frame energies are compared against a noise floor estimated from the quietest
+    frames; short pauses are bridged and short bursts dropped.
+    Returns a list of (start_sample, end_sample) speech regions.
+    """
+    frame_len = int(sample_rate * VAD_FRAME_MS / 1000)
+    n_frames = len(pcm) // frame_len
+    if n_frames == 0:
+        return []
+
+    frames = np.asarray(pcm[:n_frames * frame_len], dtype=np.float32).reshape(n_frames, frame_len)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    noise_floor = np.percentile(energy_db, 10)
+    # Never treat digital silence / very quiet hiss as speech, even in an all-quiet clip
+    speech = energy_db > max(noise_floor + threshold_db, -60.0)
+
+    # Bridge pauses shorter than VAD_MIN_SILENCE_MS
+    min_silence = max(VAD_MIN_SILENCE_MS // VAD_FRAME_MS, 1)
+    for start, end in _runs(~speech):
+        if start > 0 and end < n_frames and end - start < min_silence:
+            speech[start:end] = True
+
+    min_speech = max(VAD_MIN_SPEECH_MS // VAD_FRAME_MS, 1)
+    return [
+        (int(start * frame_len), int(end * frame_len))
+        for start, end in _runs(speech) if end - start >= min_speech
+    ]
+
+
+def make_windows(regions, window_seconds=SEGMENT_WINDOW_SECONDS, min_seconds=SEGMENT_MIN_SECONDS,
+                 max_speech_seconds=MAX_SPEECH_SECONDS, sample_rate=SAMPLE_RATE):
+    """
+    Cuts speech regions into fixed-length windows (remainders shorter than min_seconds are dropped).
+    If the windows add up to more than max_speech_seconds, an evenly spaced subset is kept
+    so that the analyzed speech still spans the whole recording.
+    Returns a list of (start_sample, end_sample) windows.
+    """
+    window_len = int(window_seconds * sample_rate)
+    min_len = int(min_seconds * sample_rate)
+    windows = []
+    for start, end in regions:
+        for window_start in range(start, end, window_len):
+            window_end = min(window_start + window_len, end)
+            if window_end - window_start >= min_len:
+                windows.append((window_start, window_end))
+
+    if max_speech_seconds and max_speech_seconds > 0:
+        max_windows = max(int(max_speech_seconds // window_seconds), 1)
+        if len(windows) > max_windows:
+            keep = np.linspace(0, len(windows) - 1, max_windows).round().astype(int)
+            windows = [windows[i] for i in keep]
+    return windows
+
+
+def segment_speech(pcm, sample_rate=SAMPLE_RATE):
+    """
+    Returns the analysis windows for a clip: VAD speech regions cut into fixed-length windows.
+    Falls back to windowing the whole clip when no speech is detected (or the clip is
+    shorter than one minimum window), so every clip yields at least one window.
+    """
+    windows = make_windows(detect_speech_regions(pcm, sample_rate), sample_rate=sample_rate)
+    if not windows:
+        windows = window_whole_clip(len(pcm), sample_rate)
+    return windows
+
+
+def window_whole_clip(n_samples, sample_rate=SAMPLE_RATE):
+    """
+    Windows an entire clip regardless of VAD (still capped by MAX_SPEECH_SECONDS).
+    A clip shorter than SEGMENT_MIN_SECONDS becomes a single window instead of being dropped.
+    """
+    min_seconds = min(SEGMENT_MIN_SECONDS, n_samples / sample_rate)
+    return make_windows([(0, n_samples)], min_seconds=min_seconds, sample_rate=sample_rate)
+
+
+def aggregate_predictions(out_probs, method=SEGMENT_AGGREGATION):
+    """
+    Combines per-window classifier outputs ([windows, classes] scores, softmaxed per window
+    exactly like a single clip) into one prediction.
+    Returns (class probabilities [classes], confidence in %, agreement), where agreement is
+    the fraction of windows whose own top class matches the aggregated one.
+    """
+    import torch
+    import torch.nn.functional as F
+    log_probs = F.log_softmax(out_probs, dim=-1)
+    votes = log_probs.argmax(dim=-1)
+
+    if method == 'majority':
+        counts = torch.bincount(votes, minlength=log_probs.shape[-1]).float()
+        # Break ties between equally voted classes with the mean probability
+        probabilities = counts / counts.sum()
+        tie_break = log_probs.exp().mean(dim=0) * 1e-3
+        index = int(torch.argmax(probabilities + tie_break))
+    elif method == 'mean_logprob':
+        probabilities = F.softmax(log_probs.mean(dim=0), dim=-1)
+        index = int(torch.argmax(probabilities))
+    else:
+        raise ValueError(f"Unknown aggregation method: {method}")
+
+    agreement = float((votes == index).float().mean())
+    return probabilities, float(probabilities[index]) * 100, agreement
+
+
+def cluster_speakers(embeddings, threshold=SPEAKER_SIMILARITY_THRESHOLD, min_segments=SPEAKER_MIN_SEGMENTS):
+    """
+    Groups windows by speaker from their embeddings ([windows, dim]): average-linkage
+    agglomerative clustering on cosine similarity, merging until no two clusters are at least
+    `threshold` similar. Clusters smaller than min_segments are then folded into the most
+    similar larger cluster. Returns one speaker id per window, numbered by first appearance.
+    """
+    import torch
+    import torch.nn.functional as F
+    n = len(embeddings)
+    if n < 2:
+        return [0] * n
+    x = F.normalize(torch.as_tensor(embeddings).float(), dim=-1)
+    similarity = (x @ x.T).double().numpy()
+
+    # Cluster-to-cluster average similarities, updated in place as clusters merge (Lance-Williams)
+    linkage = similarity.copy()
+    np.fill_diagonal(linkage, -np.inf)
+    sizes = np.ones(n)
+    members = {i: [i] for i in range(n)}
+    while len(members) > 1:
+        i, j = np.unravel_index(np.argmax(linkage), linkage.shape)
+        if linkage[i, j] < threshold:
+            break
+        linkage[i] = (sizes[i] * linkage[i] + sizes[j] * linkage[j]) / (sizes[i] + sizes[j])
+        linkage[:, i] = linkage[i]
+        linkage[i, i] = -np.inf
+        linkage[j, :] = linkage[:, j] = -np.inf
+        sizes[i] += sizes[j]
+        members[i] += members.pop(j)
+
+    large = [c for c in members.values() if len(c) >= min_segments]
+    if large:
+        for cluster in [c for c in members.values() if len(c) < min_segments]:
+            closest = max(large, key=lambda c: similarity[np.ix_(cluster, c)].mean())
+            closest.extend(cluster)
+        clusters = large
+    else:
+        clusters = list(members.values())
+
+    labels = np.empty(n, dtype=int)
+    for speaker, cluster in enumerate(sorted(clusters, key=min)):
+        labels[cluster] = speaker
+    return labels.tolist()
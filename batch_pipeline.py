@@ -0,0 +1,380 @@
+"""
+Classifies many video URLs in one job. Download, audio decoding and inference run as
+separate pipelined stages, each with its own pool of threads (shared by all running jobs)
+and a bounded hand-off queue, so the network, FFmpeg and the model are all kept busy at
+the same time. Results are
+produced (and appended to a JSONL file) as each item finishes; rerunning a job with the
+same output file skips the URLs that already have a result. The output file is locked while
+a job runs, so the same job cannot run twice at once, in this process or any other.
+
+Command line usage (from the repository root):
+    python batch_pipeline.py urls.jsonl --output results.jsonl
+"""
+import argparse
+import fcntl
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+from contextlib import closing
+
+import accent_analysis
+import metrics
+from accent_analysis import detect_accent_from_waveform, format_result
+from task_store import DOWNLOADING, EXTRACTING, CLASSIFYING
+from result_cache import ResultCache, audio_fingerprint, normalize_video_url
+from embedding_store import EmbeddingStore
+from video_processing import download_audio, decode_audio
+
+# --- Batch pipeline configuration (overridable through environment variables) ---
+# Concurrent downloads (network bound)
+BATCH_DOWNLOAD_CONCURRENCY = int(os.environ.get('BATCH_DOWNLOAD_CONCURRENCY', 4))
+# Concurrent FFmpeg decodes (CPU bound)
+BATCH_DECODE_CONCURRENCY = int(os.environ.get('BATCH_DECODE_CONCURRENCY', 2))
+# Items classified concurrently; their windows are micro-batched together by the inference engine
+BATCH_INFERENCE_CONCURRENCY = int(os.environ.get('BATCH_INFERENCE_CONCURRENCY', 4))
+# Decoded audio held between the decode and inference stages, over all running jobs (16 kHz float32: ~230 MB per hour)
+BATCH_DECODED_MAX_BYTES = int(os.environ.get('BATCH_DECODED_MAX_BYTES', 256 * 1024 * 1024))
+# Largest number of URLs accepted by /analyze/batch in one request
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 10000))
+
+JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class BatchJobRunningError(RuntimeError):
+    """Raised when a job's output file is locked by another run of the same job."""
+
+
+def parse_url_lines(lines):
+    """
+    Reads URLs from JSONL or plain-text lines. Each line may be a JSON string,
+    a JSON object with a "url" (or "video_url") field, or a bare URL.
+    Blank lines and lines starting with '#' are skipped.
+    """
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line[0] in '{"':
+            item = json.loads(line)
+            url = item if isinstance(item, str) else item.get('url') or item.get('video_url')
+        else:
+            url = line
+        if url:
+            urls.append(url)
+    return urls
+
+
+def load_finished(output_path, retry_errors=False):
+    """
+    Results already written to a job's output file, keyed by normalized URL (later lines win).
+    With retry_errors, failed items are left out so they are attempted again.
+    """
+    finished = {}
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue # A line cut short by an interrupted run
+            finished[normalize_video_url(result['url'])] = result
+    if retry_errors:
+        finished = {url: result for url, result in finished.items() if result.get('status') != 'error'}
+    return finished
+
+
+def open_job_output(output_path):
+    """
+    Opens a job's output file for appending, with an exclusive flock that is held until the
+    file is closed. Raises BatchJobRunningError if another run of the job holds the lock.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    out = open(output_path, 'a')
+    try:
+        fcntl.flock(out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        out.close()
+        job_id = os.path.splitext(os.path.basename(output_path))[0]
+        raise BatchJobRunningError(f"Batch job {job_id} is already running.")
+    return out
+
+
+class _ByteBudget:
+    """
+    Counts the bytes held by decoded waveforms waiting for (or in) inference. acquire blocks while
+    taking n more bytes would exceed the limit; a single item larger than the limit is still let
+    through once nothing else is held, so it cannot stall the pipeline.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, n):
+        with self._condition:
+            while self.limit > 0 and self.used > 0 and self.used + n > self.limit:
+                self._condition.wait()
+            self.used += n
+
+    def release(self, n):
+        with self._condition:
+            self.used -= n
+            self._condition.notify_all()
+
+
+class _Job:
+    """What the shared stage threads need to know about one running job."""
+
+    def __init__(self):
+        self.results = queue.Queue()
+        self.stopped = threading.Event()
+
+
+class BatchPipeline:
+    """
+    Runs download -> decode -> inference over lists of URLs with per-stage concurrency limits.
+
+    The stage threads and their hand-off queues are started once and shared by every job run
+    through the pipeline, so concurrent jobs split the same download, decode and inference
+    workers instead of each starting their own. Decoded waveforms waiting for inference are
+    bounded by size (BATCH_DECODED_MAX_BYTES) rather than by count, since one can be anything
+    from a few hundred kilobytes to tens of megabytes.
+
+    Items that fail (or hit the result cache) leave the pipeline early; every item produces
+    exactly one result dict with its index, url, status and either the analysis or an error message.
+    With a task_store, every item in the pipeline is recorded there as a 'batch' task, so it
+    counts toward the queue depth that admission control checks.
+    """
+
+    def __init__(self, temp_dir, result_cache=None, embedding_store=None,
+                 download_concurrency=BATCH_DOWNLOAD_CONCURRENCY, decode_concurrency=BATCH_DECODE_CONCURRENCY,
+                 inference_concurrency=BATCH_INFERENCE_CONCURRENCY, decoded_max_bytes=BATCH_DECODED_MAX_BYTES,
+                 task_store=None):
+        self.temp_dir = temp_dir
+        self.result_cache = result_cache
+        self.embedding_store = embedding_store
+        self.task_store = task_store
+        self.download_concurrency = max(download_concurrency, 1)
+        self.decode_concurrency = max(decode_concurrency, 1)
+        self.inference_concurrency = max(inference_concurrency, 1)
+        # Bounded hand-offs keep queued URLs and finished downloads (files in temp_dir) from piling
+        # up in front of a slower stage; decoded waveforms (memory) are bounded by the byte budget.
+        self._downloads = queue.Queue(maxsize=self.download_concurrency)
+        self._decodes = queue.Queue(maxsize=2 * self.decode_concurrency)
+        self._inferences = queue.Queue()
+        self._decoded_bytes = _ByteBudget(decoded_max_bytes)
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    # --- Stages: each returns (item for the next stage, None) or (None, final result) ---
+    def _download(self, item):
+        if self.result_cache is not None:
+            cached_result = self.result_cache.get_by_url(item['url'])
+            if cached_result is not None:
+                return None, dict(cached_result, cached=True)
+        self._set_state(item, DOWNLOADING)
+        with metrics.stage('download', item['timings']):
+            media_path, error = download_audio(item['url'], item['task_id'], self.temp_dir)
+        if error:
+            return None, {"status": "error", "message": f"Audio download failed: {error}"}
+        return dict(item, media_path=media_path), None
+
+    def _decode(self, item):
+        self._set_state(item, EXTRACTING)
+        try:
+            with metrics.stage('decode', item['timings']):
+                waveform, error = decode_audio(item['media_path'], item['task_id'])
+        finally:
+            os.remove(item['media_path'])
+        if error:
+            return None, {"status": "error", "message": f"Audio decoding failed: {error}"}
+        fingerprint = audio_fingerprint(waveform) if self.result_cache is not None else None
+        if fingerprint is not None:
+            cached_result = self.result_cache.get_by_audio(fingerprint)
+            if cached_result is not None:
+                self.result_cache.put(cached_result, video_url=item['url'])
+                return None, dict(cached_result, cached=True)
+        # Waits here (holding this one waveform) while the ones ahead of it fill the budget
+        self._decoded_bytes.acquire(waveform.nbytes)
+        return dict(item, waveform=waveform, fingerprint=fingerprint), None
+
+    def _classify(self, item):
+        self._set_state(item, CLASSIFYING)
+        details = {}
+        try:
+            with metrics.stage('classify', item['timings']):
+                accent, confidence, summary, probabilities, error = detect_accent_from_waveform(
+                    item['waveform'], item['task_id'], details)
+        finally:
+            self._decoded_bytes.release(item['waveform'].nbytes)
+        if error:
+            return None, {"status": "error", "message": f"Accent analysis failed: {error}"}
+        result = format_result(accent, confidence, summary, probabilities, details)
+        if self.result_cache is not None:
+            self.result_cache.put(result, video_url=item['url'], fingerprint=item['fingerprint'])
+        if self.embedding_store is not None and details.get("embedding") is not None:
+            self.embedding_store.add(details["embedding"], video_url=item['url'], fingerprint=item['fingerprint'],
+                                     accent=accent, confidence=round(confidence, 2))
+        return None, result
+
+    def _set_state(self, item, state):
+        if self.task_store is not None:
+            self.task_store.set_state(item['task_id'], state)
+
+    def _discard(self, item):
+        """Frees what an item holds when its job is abandoned before it reaches the next stage."""
+        if item.get('media_path') and os.path.exists(item['media_path']):
+            os.remove(item['media_path'])
+        if item.get('waveform') is not None:
+            self._decoded_bytes.release(item['waveform'].nbytes)
+        if self.task_store is not None:
+            self.task_store.complete(item['task_id'], {"status": "error", "message": "The batch job was stopped."})
+
+    def _finish(self, item, result):
+        if self.task_store is not None:
+            self.task_store.complete(item['task_id'], result)
+        item['job'].results.put((item, result))
+
+    def _start_stage(self, name, fn, workers, inbox, outbox):
+        """Starts `workers` threads that move items from inbox to outbox through fn, for every job."""
+
+        def _worker():
+            while True:
+                item = inbox.get()
+                if item['job'].stopped.is_set():
+                    self._discard(item)
+                    continue
+                try:
+                    next_item, result = fn(item)
+                except Exception as e:
+                    next_item, result = None, {"status": "error", "message": f"An unexpected error occurred: {e}"}
+                    self._discard(dict(item, waveform=None)) # _classify gives the waveform's bytes back itself
+                if result is not None:
+                    self._finish(item, result)
+                else:
+                    outbox.put(next_item)
+
+        for i in range(workers):
+            threading.Thread(target=_worker, name=f"batch-{name}-{i}", daemon=True).start()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._start_stage('download', self._download, self.download_concurrency, self._downloads, self._decodes)
+            self._start_stage('decode', self._decode, self.decode_concurrency, self._decodes, self._inferences)
+            self._start_stage('inference', self._classify, self.inference_concurrency, self._inferences, None)
+            self._started = True
+
+    def run(self, urls, job_id=None):
+        """Classifies urls and yields one result dict per URL, in completion order."""
+        return self._run(list(enumerate(urls)), job_id or uuid.uuid4().hex[:12])
+
+    def _feed(self, indexed_urls, job_id, job):
+        # Blocks while the shared download queue is full, so a long job is admitted a few items at a time
+        for index, url in indexed_urls:
+            if job.stopped.is_set():
+                return
+            task_id = f"{job_id}-{index}"
+            if self.task_store is not None:
+                self.task_store.create(task_id, source='batch', video_url=url)
+            self._downloads.put({"index": index, "url": url, "task_id": task_id, "timings": {}, "job": job})
+
+    def _run(self, indexed_urls, job_id):
+        self._ensure_started()
+        job = _Job()
+        threading.Thread(target=self._feed, args=(indexed_urls, job_id, job),
+                         name=f"batch-feed-{job_id}", daemon=True).start()
+        try:
+            for _ in range(len(indexed_urls)):
+                item, result = job.results.get()
+                metrics.TASKS.inc(outcome='cached' if result.get('cached') else result['status'])
+                yield {"index": item['index'], "url": item['url'], **result, "timings": item['timings']}
+        finally:
+            # Consumer went away (e.g. the client disconnected): the stages drop this job's remaining items
+            job.stopped.set()
+
+    def run_job(self, urls, output_path, retry_errors=False, replay=False):
+        """
+        Resumable run: URLs that already have a result in output_path are skipped, and each new
+        result is appended (and flushed) to it as soon as it is ready. A URL listed more than once
+        (after normalization) is processed once, under the index of its first occurrence. With
+        replay, the earlier results are yielded first, so the caller sees the whole job.
+        output_path is locked right away (BatchJobRunningError if the job is already running);
+        the returned generator releases it when it is exhausted or closed.
+        """
+        return self._run_job(urls, open_job_output(output_path), retry_errors, replay)
+
+    def _run_job(self, urls, out, retry_errors, replay):
+        with out:
+            finished = load_finished(out.name, retry_errors)
+            first = {} # Normalized URL -> (index, url) of its first occurrence
+            for index, url in enumerate(urls):
+                first.setdefault(normalize_video_url(url), (index, url))
+            if replay:
+                for key in first:
+                    if key in finished:
+                        yield dict(finished[key], resumed=True)
+            pending = [item for key, item in first.items() if key not in finished]
+            if not pending:
+                return
+            job_id = os.path.splitext(os.path.basename(out.name))[0]
+            with closing(self._run(pending, job_id)) as results:
+                for result in results:
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                    yield result
+
+
+# --- Command line entry point ---
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="JSONL or text file with one URL per line ('-' for stdin)")
+    parser.add_argument('--output', '-o', required=True, help="JSONL results file; rerun with it to resume")
+    parser.add_argument('--retry-errors', action='store_true', help="Attempt previously failed URLs again")
+    parser.add_argument('--temp-dir', default=os.path.join(os.getcwd(), 'temp_files'))
+    parser.add_argument('--download-concurrency', type=int, default=BATCH_DOWNLOAD_CONCURRENCY)
+    parser.add_argument('--decode-concurrency', type=int, default=BATCH_DECODE_CONCURRENCY)
+    parser.add_argument('--inference-concurrency', type=int, default=BATCH_INFERENCE_CONCURRENCY)
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the result cache")
+    parser.add_argument('--no-embeddings', action='store_true', help="Do not add embeddings to the embedding store")
+    args = parser.parse_args()
+
+    if args.input == '-':
+        urls = parse_url_lines(sys.stdin)
+    else:
+        with open(args.input) as f:
+            urls = parse_url_lines(f)
+
+    skipped = len(load_finished(args.output, args.retry_errors).keys() & {normalize_video_url(url) for url in urls})
+    if skipped:
+        print(f"Resuming: {skipped} URL(s) already have results in {args.output}.")
+
+    accent_analysis.load_accent_model()
+    if accent_analysis.accent_classifier is None:
+        raise SystemExit("Model could not be loaded; aborting batch job.")
+
+    pipeline = BatchPipeline(args.temp_dir, None if args.no_cache else ResultCache(),
+                             None if args.no_embeddings else EmbeddingStore(), args.download_concurrency,
+                             args.decode_concurrency, args.inference_concurrency)
+    try:
+        results = pipeline.run_job(urls, args.output, retry_errors=args.retry_errors)
+    except BatchJobRunningError as e:
+        raise SystemExit(str(e))
+    done = errors = 0
+    for result in results:
+        done += 1
+        errors += result['status'] == 'error'
+        print(f"[{done}] {result['url']}: {result.get('accent') or result.get('message')}")
+    print(f"Finished {done} URL(s) ({errors} error(s)); results are in {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
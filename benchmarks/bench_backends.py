@@ -0,0 +1,96 @@
+"""
+Compares the inference backends (eager, int8, trace, compile, onnx) on a fixed test set:
+accuracy parity of the class scores against eager, per-batch latency and real-time factor.
+Backends built per batch size (trace, onnx) are also checked at every batch size from 1 to
+--batch-size, which the app's startup check leaves out (it only checks 1 and the largest).
+
+The test set is every audio/video file in --audio-dir (decoded and cut into the same speech
+windows the app classifies) or, without one, the synthetic speech of the startup parity check.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_backends --backends eager int8 trace onnx --audio-dir samples/
+"""
+import argparse
+import time
+
+import torch
+
+import accent_analysis
+from inference_backends import (build_backend, check_parity, load_speech_windows, synthetic_speech_clips, BACKENDS,
+                                BACKEND_PARITY_TOLERANCE)
+from inference_engine import pad_waveforms
+from benchmarks.common import percentile, print_report
+
+SAMPLE_RATE = 16000
+
+
+def run_backend(backend, batches, reference):
+    """Times every batch (after one warm-up) and compares its scores with the reference outputs."""
+    backend.classify_batch(*batches[0])
+    latencies, diffs, agreements = [], [], []
+    for (wavs, wav_lens), expected in zip(batches, reference):
+        start = time.perf_counter()
+        out_prob = backend.classify_batch(wavs, wav_lens)[0]
+        latencies.append(time.perf_counter() - start)
+        diffs.append((out_prob - expected).abs())
+        agreements.append(out_prob.argmax(-1) == expected.argmax(-1))
+    diff = torch.cat([d.reshape(-1) for d in diffs])
+    return latencies, {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "top1_agreement": float(torch.cat(agreements).float().mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['eager', 'int8', 'trace', 'onnx'], choices=list(BACKENDS))
+    parser.add_argument('--audio-dir', help="Directory of local audio/video files used as the test set")
+    parser.add_argument('--max-windows', type=int, default=64)
+    parser.add_argument('--clips', type=int, default=32, help="Synthetic clips when no --audio-dir is given")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--tolerance', type=float, default=BACKEND_PARITY_TOLERANCE)
+    args = parser.parse_args()
+
+    classifier = accent_analysis.load_classifier()
+    clips = (load_speech_windows(args.audio_dir, args.max_windows) if args.audio_dir
+             else synthetic_speech_clips(args.clips))
+    if not clips:
+        raise SystemExit("The test set is empty.")
+    batches = [pad_waveforms(clips[i:i + args.batch_size]) for i in range(0, len(clips), args.batch_size)]
+    audio_seconds = sum(int(clip.shape[-1]) for clip in clips) / SAMPLE_RATE
+
+    eager = build_backend('eager', classifier)
+    reference = [eager.classify_batch(wavs, wav_lens)[0] for wavs, wav_lens in batches]
+
+    runs = []
+    for name in args.backends:
+        start = time.perf_counter()
+        backend = build_backend(name, classifier, check=False)
+        build_seconds = time.perf_counter() - start
+        latencies, parity = run_backend(backend, batches, reference)
+        sweep = (check_parity(eager, backend, clips, range(1, args.batch_size + 1))
+                 if backend.per_batch_size else None)
+        runs.append({
+            "backend": backend.name,
+            "build_s": round(build_seconds, 2),
+            "batch_latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "batch_latency_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "real_time_factor": round(sum(latencies) / audio_seconds, 4),
+            **{key: round(value, 6) for key, value in parity.items()},
+            "batch_size_sweep_max_abs_diff": round(sweep["max_abs_diff"], 6) if sweep else None,
+            "parity_ok": max(parity["max_abs_diff"], sweep["max_abs_diff"] if sweep else 0) <= args.tolerance,
+        })
+
+    print_report({
+        "test_set": args.audio_dir or "synthetic",
+        "clips": len(clips),
+        "audio_seconds": round(audio_seconds, 1),
+        "batch_size": args.batch_size,
+        "torch_threads": torch.get_num_threads(),
+        "runs": runs,
+    })
+
+
+if __name__ == '__main__':
+    main()
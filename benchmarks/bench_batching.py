@@ -0,0 +1,87 @@
+"""
+Compares the per-clip inference path against the micro-batched inference engine on CPU.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_batching --clips 64 --concurrency 5
+    python -m benchmarks.bench_batching --audio-dir temp_files/samples --max-batch-size 16
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import accent_analysis
+from inference_engine import BatchInferenceEngine
+from benchmarks.common import summarize_latencies, synthetic_clips, print_report
+
+
+def load_clips(args):
+    if args.audio_dir:
+        paths = sorted(glob.glob(os.path.join(args.audio_dir, '*.wav')))[:args.clips]
+        return [accent_analysis.accent_classifier.load_audio(path) for path in paths]
+    return synthetic_clips(args.clips, args.min_seconds, args.max_seconds)
+
+
+def run_concurrently(classify_one, clips, concurrency):
+    """Mimics the Flask executor: `concurrency` threads each classifying one clip at a time."""
+    latencies = []
+
+    def task(clip):
+        start = time.perf_counter()
+        classify_one(clip)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(task, clips))
+    return summarize_latencies(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', type=int, default=64)
+    parser.add_argument('--min-seconds', type=float, default=4.0)
+    parser.add_argument('--max-seconds', type=float, default=12.0)
+    parser.add_argument('--audio-dir', help="Directory of 16 kHz WAV files to use instead of synthetic clips")
+    parser.add_argument('--concurrency', type=int, default=5, help="Concurrent callers (EXECUTOR_MAX_WORKERS)")
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=50)
+    parser.add_argument('--torch-threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+
+    accent_analysis.load_accent_model()
+    classifier = accent_analysis.accent_classifier
+    if classifier is None:
+        raise SystemExit("Model could not be loaded; aborting benchmark.")
+
+    clips = load_clips(args)
+    # Warm-up so neither path pays for lazy initialisation
+    classifier.classify_batch(clips[0].unsqueeze(0))
+
+    per_clip = run_concurrently(lambda clip: classifier.classify_batch(clip.unsqueeze(0)), clips, args.concurrency)
+
+    engine = BatchInferenceEngine(accent_analysis._classify_batch, args.max_batch_size, args.max_wait_ms).start()
+    try:
+        batched = run_concurrently(engine.classify, clips, args.concurrency)
+    finally:
+        engine.stop()
+
+    print_report({
+        "device": "cpu",
+        "torch_threads": torch.get_num_threads(),
+        "concurrency": args.concurrency,
+        "max_batch_size": args.max_batch_size,
+        "max_wait_ms": args.max_wait_ms,
+        "per_clip": per_clip,
+        "batched": batched,
+    })
+
+
+if __name__ == '__main__':
+    main()
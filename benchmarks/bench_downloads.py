@@ -0,0 +1,145 @@
+"""
+Exercises the download manager against a local HTTP server (benchmarks.media_server) serving
+sample media, and reports what the server saw:
+
+- full vs section: bytes served, file size and time for a whole download and for one limited
+                   to the first --section-seconds (yt-dlp --download-sections)
+- per-host cap:    --downloads concurrent downloads from one host, with the server's peak
+                   number of simultaneous requests (at most --max-per-host downloads run at once)
+- byte limit:      a download larger than the byte limit is refused up front (whole files)
+                   or stopped by the watchdog (sections) and leaves no files behind
+- disk quota:      downloads are refused while the temp dir is over quota, unless the janitor
+                   can free enough space by removing stale files
+- janitor:         stale files are removed, fresh files and subdirectories are kept
+
+Without --media-file, a few minutes of generated audio (FFmpeg lavfi) are used.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_downloads --downloads 6 --max-per-host 2 [--media-file sample.mp4]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from download_manager import DownloadManager, DownloadLimitError
+from video_processing import STREAM_AUDIO_FORMAT
+from benchmarks.common import print_report
+from benchmarks.fixtures import generate_fixture
+from benchmarks.media_server import serve_directory
+
+
+def run_download(manager, url, stats):
+    """One download_audio-style download; returns its report row (the file is removed afterwards)."""
+    output_path = os.path.join(manager.temp_dir, f"audio_{uuid.uuid4()}.media")
+    command = ['yt-dlp', '-f', STREAM_AUDIO_FORMAT, '-o', output_path, '--no-playlist',
+               '--no-part', '--quiet', '--no-warnings', url]
+    served_before = stats["bytes_sent"]
+    start = time.perf_counter()
+    try:
+        returncode, stderr = manager.download(url, command, output_path, "bench")
+        outcome = "ok" if returncode == 0 else f"yt-dlp failed: {stderr}"
+    except DownloadLimitError as e:
+        outcome = f"refused: {e}"
+    row = {
+        "outcome": outcome,
+        "seconds": round(time.perf_counter() - start, 2),
+        "file_bytes": os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+        "bytes_served": stats["bytes_sent"] - served_before,
+    }
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    row["files_left"] = len([name for name in os.listdir(manager.temp_dir) if name.startswith("audio_")])
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--media-file', help="Local audio/video file to serve (default: generated audio)")
+    parser.add_argument('--fixture-seconds', type=int, default=900, help="Length of the generated audio")
+    parser.add_argument('--section-seconds', type=int, default=60)
+    parser.add_argument('--downloads', type=int, default=6, help="Concurrent downloads in the per-host test")
+    parser.add_argument('--max-per-host', type=int, default=2)
+    args = parser.parse_args()
+
+    media_dir = tempfile.mkdtemp(prefix="bench_downloads_media_")
+    temp_dir = tempfile.mkdtemp(prefix="bench_downloads_temp_")
+    try:
+        if args.media_file:
+            filename = os.path.basename(args.media_file)
+            shutil.copy(args.media_file, os.path.join(media_dir, filename))
+        else:
+            filename = "fixture.m4a"
+            generate_fixture(os.path.join(media_dir, filename), args.fixture_seconds)
+        media_bytes = os.path.getsize(os.path.join(media_dir, filename))
+
+        stats = {}
+        with serve_directory(media_dir, stats=stats) as base_url:
+            url = f"{base_url}/{filename}"
+
+            full = run_download(DownloadManager(temp_dir, max_seconds=0), url, stats)
+            section = run_download(DownloadManager(temp_dir, max_seconds=args.section_seconds), url, stats)
+
+            manager = DownloadManager(temp_dir, max_seconds=args.section_seconds, max_per_host=args.max_per_host)
+            stats["peak_concurrency"] = 0
+            rows = []
+            start = time.perf_counter()
+            threads = [threading.Thread(target=lambda: rows.append(run_download(manager, url, stats)))
+                       for _ in range(args.downloads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            per_host = {
+                "downloads": args.downloads,
+                "max_per_host": args.max_per_host,
+                "wall_time_s": round(time.perf_counter() - start, 2),
+                "server_peak_concurrent_requests": stats["peak_concurrency"],
+                "succeeded": sum(row["outcome"] == "ok" for row in rows),
+            }
+
+            byte_limit = {
+                "whole_file": run_download(DownloadManager(temp_dir, max_seconds=0, max_bytes=media_bytes // 2),
+                                           url, stats),
+                "section": run_download(DownloadManager(temp_dir, max_seconds=args.section_seconds,
+                                                        max_bytes=max(section["file_bytes"] // 2, 1)), url, stats),
+            }
+
+            quota_manager = DownloadManager(temp_dir, max_seconds=args.section_seconds, quota_bytes=media_bytes)
+            filler = os.path.join(temp_dir, "orphaned.media")
+            with open(filler, 'wb') as f:
+                f.truncate(media_bytes)
+            quota = {"over_quota_fresh_files": run_download(quota_manager, url, stats)}
+            stale = time.time() - 2 * quota_manager.max_file_age
+            os.utime(filler, (stale, stale))
+            quota["over_quota_stale_files"] = run_download(quota_manager, url, stats)
+
+        os.makedirs(os.path.join(temp_dir, "batch_jobs"), exist_ok=True)
+        for name in ("stale_1.media", "stale_2.media.part", "fresh.media", os.path.join("batch_jobs", "old.jsonl")):
+            with open(os.path.join(temp_dir, name), 'wb') as f:
+                f.write(b"\0" * 1024)
+            if not name.startswith("fresh"):
+                os.utime(os.path.join(temp_dir, name), (stale, stale))
+        janitor = {"removed": quota_manager.sweep(), "left": sorted(
+            os.path.relpath(os.path.join(root, name), temp_dir)
+            for root, _, files in os.walk(temp_dir) for name in files)}
+
+        print_report({
+            "media": args.media_file or f"generated ({args.fixture_seconds}s)",
+            "media_bytes": media_bytes,
+            "full_vs_section": {"full": full, f"first_{args.section_seconds}s": section},
+            "per_host_cap": per_host,
+            "byte_limit": byte_limit,
+            "disk_quota": quota,
+            "janitor": janitor,
+        })
+    finally:
+        shutil.rmtree(media_dir, ignore_errors=True)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
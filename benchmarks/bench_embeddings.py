@@ -0,0 +1,75 @@
+"""
+Embedding store scaling: single-clip add latency, bulk insert rate, and nearest-neighbour
+search latency (p50/p99) as the store grows, on random unit vectors in a temporary store.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_embeddings --sizes 10000 100000 1000000 --queries 50
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, EMBEDDING_DIM
+from benchmarks.common import percentile, print_report
+
+_BLOCK_ROWS = 100000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--single-adds', type=int, default=200, help="Individual add() calls timed first")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    store_dir = tempfile.mkdtemp(prefix="bench_embeddings_")
+    store = EmbeddingStore(store_dir)
+    try:
+        add_latencies = []
+        for i in range(args.single_adds):
+            start = time.perf_counter()
+            store.add(rng.standard_normal(EMBEDDING_DIM), video_url=f"https://example.com/{i}", accent="us")
+            add_latencies.append(time.perf_counter() - start)
+
+        runs = []
+        insert_seconds = 0.0
+        for size in sorted(args.sizes):
+            while len(store) < size:
+                rows = min(_BLOCK_ROWS, size - len(store))
+                block = rng.standard_normal((rows, EMBEDDING_DIM)).astype(np.float32)
+                start = time.perf_counter()
+                store.add_many(block)
+                insert_seconds += time.perf_counter() - start
+
+            queries = rng.standard_normal((args.queries, EMBEDDING_DIM))
+            store.search(queries[0], k=args.k) # Warm the page cache
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                store.search(query, k=args.k)
+                latencies.append(time.perf_counter() - start)
+            runs.append({
+                "clips": len(store),
+                "vector_file_mb": round(len(store) * EMBEDDING_DIM * 2 / 1e6, 1),
+                "search_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "search_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            })
+
+        print_report({
+            "k": args.k,
+            "single_add_p50_ms": round(percentile(add_latencies, 50) * 1000, 2),
+            "bulk_insert_rows_per_s": round((len(store) - args.single_adds) / insert_seconds) if insert_seconds else None,
+            "runs": runs,
+        })
+    finally:
+        store.close()
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Idle clients waiting for task results over server-sent events (the asyncio EVENTS_PORT
+listener) on a temporary SQLite task store, without the model:
+
+- threads and resident memory of the process with --clients idle event streams open
+- task store reads per second made by the event watcher, next to what the same clients
+  would cause by polling /status every --poll-interval seconds
+- time from the final result being stored to every client having received it
+
+Usage (from the repository root):
+    python -m benchmarks.bench_events --clients 1000 2000 --tasks 10
+"""
+import argparse
+import os
+import selectors
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from task_events import TaskEventHub, EventStreamServer
+from task_store import SQLiteTaskStore, DOWNLOADING, COMPLETED
+from benchmarks.common import percentile, print_report, resident_mb
+
+
+class CountingStore(SQLiteTaskStore):
+    """Counts the reads the event watcher makes."""
+    reads = 0
+
+    def get(self, task_id):
+        self.reads += 1
+        return super().get(task_id)
+
+    def versions(self, task_ids):
+        self.reads += 1
+        return super().versions(task_ids)
+
+
+def run(clients, tasks, poll_interval, store_dir):
+    store = CountingStore(os.path.join(store_dir, f"tasks_{clients}.sqlite3"))
+    hub = TaskEventHub(store)
+    server = EventStreamServer(hub, lambda task: {"state": task["state"]}, host='127.0.0.1', port=0)
+    server.start()
+    task_ids = [str(uuid.uuid4()) for _ in range(tasks)]
+    for task_id in task_ids:
+        store.create(task_id)
+
+    threads_before, memory_before = threading.active_count(), resident_mb()
+    selector = selectors.DefaultSelector()
+    for i in range(clients):
+        sock = socket.create_connection(('127.0.0.1', server.port))
+        sock.sendall(f"GET /events/{task_ids[i % tasks]} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, data=bytearray())
+    while hub.listener_count() < clients:
+        time.sleep(0.05)
+
+    for task_id in task_ids:
+        store.set_state(task_id, DOWNLOADING)
+    reads_before, idle_start = store.reads, time.perf_counter()
+    time.sleep(3.0)
+    watcher_reads_per_s = (store.reads - reads_before) / (time.perf_counter() - idle_start)
+    idle = {"threads": threading.active_count(), "threads_added": threading.active_count() - threads_before,
+            "memory_added_mb": round(resident_mb() - memory_before, 1)}
+
+    completed_at = time.perf_counter()
+    for task_id in task_ids:
+        store.complete(task_id, {"status": COMPLETED})
+    latencies = []
+    while len(latencies) < clients and time.perf_counter() - completed_at < 60:
+        for key, _ in selector.select(timeout=1):
+            chunk = key.fileobj.recv(65536)
+            key.data.extend(chunk)
+            if not chunk or b"event: result" in key.data:
+                latencies.append(time.perf_counter() - completed_at)
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+    server.stop()
+    return {
+        "clients": clients,
+        **idle,
+        "watcher_store_reads_per_s": round(watcher_reads_per_s, 1),
+        "polling_requests_per_s": round(clients / poll_interval, 1),
+        "clients_with_result": len(latencies),
+        "result_latency_p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "result_latency_p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', nargs='+', type=int, default=[1000])
+    parser.add_argument('--tasks', type=int, default=10, help="Tasks the clients are spread over")
+    parser.add_argument('--poll-interval', type=float, default=3.0, help="The web page's /status polling interval")
+    args = parser.parse_args()
+
+    store_dir = tempfile.mkdtemp(prefix="bench_events_")
+    try:
+        runs = [run(clients, args.tasks, args.poll_interval, store_dir) for clients in args.clients]
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    print_report({"tasks": args.tasks, "runs": runs})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares the old file-based classification path with the in-memory one on the same clips:
+
+- file:   each clip is written as a 16 kHz WAV and passed to
+          classify_file, which links, reads and normalizes the file and runs a batch of one
+- memory: the 16 kHz PCM buffers are padded into batches of similar length; fbank features and
+          mean/variance normalization run once per batch, followed by the embedding model and classifier
+
+Reports time per clip (with the file I/O and feature share of each path) and how far
+the two paths' class scores differ.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_features --clips 32 --batch-size 8 [--audio-dir path/to/clips]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+import numpy as np
+import torch
+
+import accent_analysis
+from inference_backends import build_backend, load_speech_windows
+from inference_engine import pad_waveforms
+from benchmarks.bench_backends import SAMPLE_RATE
+from benchmarks.common import synthetic_clips, print_report
+
+
+def write_wav(path, clip):
+    """16-bit mono 16 kHz WAV, the format the old file-based path wrote."""
+    pcm = (np.clip(clip.numpy(), -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+
+def run_file_path(classifier, clips, temp_dir):
+    write_seconds = 0.0
+    out_probs = []
+    start = time.perf_counter()
+    for i, clip in enumerate(clips):
+        path = os.path.join(temp_dir, f"clip_{i}.wav")
+        write_start = time.perf_counter()
+        write_wav(path, clip)
+        write_seconds += time.perf_counter() - write_start
+        out_probs.append(classifier.classify_file(path, savedir=temp_dir)[0])
+    return time.perf_counter() - start, write_seconds, torch.cat(out_probs)
+
+
+def run_memory_path(backend, clips, batch_size):
+    """Clips are batched in order of length (as equal-length speech windows are in the app) to limit padding."""
+    order = sorted(range(len(clips)), key=lambda i: clips[i].shape[-1])
+    feature_seconds = 0.0
+    out_probs = []
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for i in range(0, len(order), batch_size):
+            wavs, wav_lens = pad_waveforms([clips[j] for j in order[i:i + batch_size]])
+            feature_start = time.perf_counter()
+            feats = backend.compute_features(wavs, wav_lens)
+            feature_seconds += time.perf_counter() - feature_start
+            out_probs.append(backend.mods.classifier(backend.embed(feats, wav_lens)).squeeze(1))
+    elapsed = time.perf_counter() - start
+    out_prob = torch.empty_like(torch.cat(out_probs))
+    out_prob[order] = torch.cat(out_probs)
+    return elapsed, feature_seconds, out_prob
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio-dir', help="Directory of local audio/video files used as the test set")
+    parser.add_argument('--max-windows', type=int, default=32)
+    parser.add_argument('--clips', type=int, default=32, help="Synthetic clips when no --audio-dir is given")
+    parser.add_argument('--batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    classifier = accent_analysis.load_classifier()
+    backend = build_backend('eager', classifier)
+    clips = (load_speech_windows(args.audio_dir, args.max_windows) if args.audio_dir
+             else synthetic_clips(args.clips, 3.0, 6.0))
+    if not clips:
+        raise SystemExit("The test set is empty.")
+    audio_seconds = sum(int(clip.shape[-1]) for clip in clips) / SAMPLE_RATE
+
+    # One warm-up forward pass so neither path pays for first-call allocations
+    backend.classify_batch(*pad_waveforms(clips[:1]))
+
+    temp_dir = tempfile.mkdtemp(prefix="bench_features_")
+    try:
+        file_total, file_write, file_probs = run_file_path(classifier, clips, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    memory_total, memory_features, memory_probs = run_memory_path(backend, clips, args.batch_size)
+
+    diff = (file_probs - memory_probs).abs()
+    print_report({
+        "test_set": args.audio_dir or "synthetic",
+        "clips": len(clips),
+        "audio_seconds": round(audio_seconds, 1),
+        "batch_size": args.batch_size,
+        "runs": [
+            {"path": "file", "total_s": round(file_total, 3), "per_clip_ms": round(file_total / len(clips) * 1000, 1),
+             "wav_write_s": round(file_write, 3), "real_time_factor": round(file_total / audio_seconds, 4)},
+            {"path": "memory", "total_s": round(memory_total, 3),
+             "per_clip_ms": round(memory_total / len(clips) * 1000, 1),
+             "batched_features_s": round(memory_features, 3),
+             "real_time_factor": round(memory_total / audio_seconds, 4)},
+        ],
+        "speedup": round(file_total / memory_total, 2),
+        "score_max_abs_diff": round(float(diff.max()), 6),
+        "top1_agreement": float((file_probs.argmax(-1) == memory_probs.argmax(-1)).float().mean()),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Request-body audio against the app running in this process on a local port:
+
+- upload: generated fixtures POSTed to /analyze/upload as chunked multipart bodies, with the
+          time until the 202 (the upload is decoded while it is received) and the process's
+          peak RSS growth next to the file size (uploads are not buffered)
+- ingest: --streams concurrent live PCM streams to /ingest/<task_id>, sent at --speed times
+          real time, with the delay from sending the audio that completes a block to receiving
+          its rolling estimate (client side, and as the server measured it)
+
+The stores go to a temporary directory, admission limits are lifted and the result cache
+is bypassed. The model is loaded as configured.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_ingest --streams 1 4 --seconds 60 --speed 1
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from benchmarks.common import percentile, print_report, ResourceMonitor, resident_mb
+from benchmarks.fixtures import generate_fixture
+
+_BOUNDARY = "bench-ingest-boundary"
+
+
+def upload(port, path):
+    """POSTs a file as a chunked multipart body; returns the response status and JSON."""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(("POST /analyze/upload HTTP/1.1\r\nHost: bench\r\nTransfer-Encoding: chunked\r\n"
+                  f"Content-Type: multipart/form-data; boundary={_BOUNDARY}\r\nConnection: close\r\n\r\n").encode())
+
+    def send(data):
+        sock.sendall(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    send((f'--{_BOUNDARY}\r\nContent-Disposition: form-data; name="file"; '
+          f'filename="{os.path.basename(path)}"\r\n\r\n').encode())
+    with open(path, 'rb') as f:
+        while data := f.read(256 * 1024):
+            send(data)
+    send(f"\r\n--{_BOUNDARY}--\r\n".encode())
+    sock.sendall(b"0\r\n\r\n")
+    with sock.makefile('rb') as response:
+        status = int(response.readline().split()[1])
+        while response.readline() not in (b'\r\n', b''):
+            pass
+        body = response.read()
+    sock.close()
+    return status, json.loads(body)
+
+
+def live_stream(port, task_id, pcm, speed, read_seconds=0.1):
+    """Sends s16le PCM in real time (times speed); returns (client latencies, server latencies, final result)."""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall((f"POST /ingest/{task_id} HTTP/1.1\r\nHost: bench\r\nTransfer-Encoding: chunked\r\n"
+                  "Content-Type: application/octet-stream\r\n\r\n").encode())
+    sent_at = {} # Seconds of audio sent -> when
+    step = int(read_seconds * 16000) * 2
+
+    def sender():
+        start = time.perf_counter()
+        for offset in range(0, len(pcm), step):
+            piece = pcm[offset:offset + step]
+            sock.sendall(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            sent_at[round((offset + len(piece)) / 32000, 1)] = time.perf_counter()
+            time.sleep(max(start + (offset + len(piece)) / 32000 / speed - time.perf_counter(), 0))
+        sock.sendall(b"0\r\n\r\n")
+
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    client, server, result = [], [], None
+    with sock.makefile('rb') as response:
+        for line in response:
+            if not line.startswith(b'{'):
+                continue # Status line, headers and chunk sizes
+            payload = json.loads(line)
+            if payload.get("status") != "processing":
+                result = payload
+                break
+            progress = payload["progress"]
+            sent = sent_at.get(round(progress["audio_seconds_consumed"], 1))
+            if sent is not None:
+                client.append(time.perf_counter() - sent)
+            server.append(progress["estimate_latency_ms"] / 1000)
+    thread.join()
+    sock.close()
+    return client, server, result
+
+
+def run_ingest(base_url, port, pcm, streams, speed):
+    rows = []
+
+    def one():
+        request = urllib.request.Request(f"{base_url}/ingest", data=b"{}", headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            task_id = json.load(response)["task_id"]
+        rows.append(live_stream(port, task_id, pcm, speed))
+
+    with ResourceMonitor() as monitor:
+        threads = [threading.Thread(target=one) for _ in range(streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    client = [latency for row in rows for latency in row[0]]
+    server = [latency for row in rows for latency in row[1]]
+    return {
+        "streams": streams,
+        "estimates": len(server),
+        "completed": sum(1 for row in rows if row[2] and row[2].get("status") == "completed"),
+        "client_latency_p50_ms": round(percentile(client, 50) * 1000, 1) if client else None,
+        "client_latency_p99_ms": round(percentile(client, 99) * 1000, 1) if client else None,
+        "server_latency_p50_ms": round(percentile(server, 50) * 1000, 1) if server else None,
+        "server_latency_p99_ms": round(percentile(server, 99) * 1000, 1) if server else None,
+        **monitor.report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--upload-seconds', type=int, default=600, help="Length of the generated upload fixtures")
+    parser.add_argument('--streams', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--seconds', type=int, default=60, help="Audio sent per live stream")
+    parser.add_argument('--speed', type=float, default=1.0, help="Live streams are sent at this multiple of real time")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_ingest_")
+    # Configured before app (and the modules it imports) read their settings
+    os.environ.update({
+        "TASK_STORE_URL": f"sqlite:///{os.path.join(work_dir, 'tasks.sqlite3')}",
+        "RESULT_CACHE_DB": os.path.join(work_dir, 'result_cache.sqlite3'),
+        "RESULT_CACHE_TTL_SECONDS": "0",
+        "EMBEDDING_STORE_DIR": os.path.join(work_dir, 'embedding_store'),
+        "MAX_QUEUE_DEPTH": "0",
+        "RATE_LIMIT_PER_MINUTE": "0",
+    })
+    report = {}
+    try:
+        # The app logs every step with print(); keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            fixtures = {"audio.m4a": os.path.join(work_dir, "audio.m4a"),
+                        "video_moov_end.mp4": os.path.join(work_dir, "video_moov_end.mp4")}
+            generate_fixture(fixtures["audio.m4a"], args.upload_seconds)
+            generate_fixture(fixtures["video_moov_end.mp4"], args.upload_seconds, video=True, faststart=False)
+
+            import app
+            from werkzeug.serving import make_server
+            while app.model_status["state"] in ("not_loaded", "loading"):
+                time.sleep(0.1)
+            if not app.is_model_ready():
+                raise SystemExit(f"Model failed to load: {app.model_status['error']}")
+            server = make_server('127.0.0.1', 0, app.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            port = server.server_port
+
+            report["upload"] = []
+            for name, path in fixtures.items():
+                memory_before = resident_mb()
+                with ResourceMonitor() as monitor:
+                    status, body = upload(port, path)
+                report["upload"].append({
+                    "file": name,
+                    "file_mb": round(os.path.getsize(path) / 1e6, 1),
+                    "status": status,
+                    "audio_seconds": body.get("audio_seconds"),
+                    "seconds_to_202": round(monitor.wall_time, 2),
+                    "peak_rss_growth_mb": round(monitor.peak_rss_mb - memory_before, 1),
+                    "cpu_utilization": monitor.report()["cpu_utilization"],
+                })
+
+            pcm = subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', fixtures["audio.m4a"],
+                                  '-t', str(args.seconds), '-ac', '1', '-ar', '16000', '-f', 's16le', 'pipe:1'],
+                                 capture_output=True, check=True).stdout
+            report["ingest"] = [run_ingest(f"http://127.0.0.1:{port}", port, pcm, streams, args.speed)
+                                for streams in args.streams]
+            server.shutdown()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report.update(seconds_per_stream=args.seconds, speed=args.speed)
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
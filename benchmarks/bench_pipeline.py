@@ -0,0 +1,298 @@
+"""
+End-to-end benchmark and load test of the analysis pipeline, offline: media fixtures are
+served from a local HTTP server (benchmarks.media_server) in place of YouTube, and the app
+runs in this process on a local port.
+
+- stages: each fixture --repeat times through download (yt-dlp), extract (FFmpeg decode to
+          16 kHz PCM), acquire (streamed download and decode, the default AUDIO_ACQUISITION_MODE)
+          and inference (segmentation and the model), one stage after the other
+- load:   the full POST /analyze -> GET /status loop with each --concurrency number of clients,
+          every client submitting --requests-per-client tasks and polling until they finish
+
+Every run reports throughput, latency percentiles, peak RSS and CPU utilization (of this
+process, which includes the polling clients, and its yt-dlp/FFmpeg children, over all cores)
+as JSON. With --baseline, the report is compared with an earlier one and the metrics that got
+worse by more than --tolerance are listed as regressions; the exit status is then 1.
+
+The result cache is bypassed unless --with-cache is given, admission limits are lifted, and
+the task store, result cache and embedding store are kept in a temporary directory. The model
+is loaded as configured (MODEL_SOURCE, INFERENCE_BACKEND, INFERENCE_WORKERS...).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_pipeline --concurrency 1 2 4 --output baseline.json
+    python -m benchmarks.bench_pipeline --concurrency 1 2 4 --baseline baseline.json [--media-dir samples/]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.common import percentile, print_report, ResourceMonitor
+from benchmarks.fixtures import generate_fixtures
+from benchmarks.media_server import serve_directory
+
+# Compared metrics (the last part of the flattened name) -> whether higher is better
+_DIRECTIONS = {
+    "throughput_per_s": True,
+    "audio_seconds_per_s": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+def summarize(latencies, monitor, errors, audio_seconds=None):
+    """Report row for one stage or load level."""
+    wall_time = monitor.wall_time
+    row = {
+        "runs": len(latencies),
+        "errors": len(errors),
+        "throughput_per_s": round(len(latencies) / wall_time, 3) if wall_time else None,
+    }
+    if audio_seconds is not None:
+        row["audio_seconds_per_s"] = round(audio_seconds / wall_time, 1) if wall_time else None
+    for pct in (50, 95, 99):
+        row[f"latency_p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 1) if latencies else None
+    row.update(monitor.report())
+    if errors:
+        row["first_error"] = errors[0]
+    return row
+
+
+def timed_runs(name, inputs, run):
+    """Calls run(item) for every input under a ResourceMonitor; run returns (output, error, audio seconds)."""
+    latencies, outputs, errors, audio_seconds = [], [], [], 0.0
+    with ResourceMonitor() as monitor:
+        for item in inputs:
+            start = time.perf_counter()
+            output, error, seconds = run(item)
+            if error:
+                errors.append(error)
+                continue
+            latencies.append(time.perf_counter() - start)
+            outputs.append(output)
+            audio_seconds += seconds
+    print(f"Stage {name}: {len(latencies)} run(s), {len(errors)} error(s)", file=sys.stderr)
+    return outputs, dict(stage=name, **summarize(latencies, monitor, errors, audio_seconds if audio_seconds else None))
+
+
+def run_stages(urls, repeat, temp_dir):
+    """Times each pipeline stage on its own, in the order the file-mode pipeline runs them."""
+    from accent_analysis import detect_accent_from_waveform
+    from video_processing import download_video, decode_audio, acquire_audio
+
+    jobs = [(f"bench-{i}", url) for i, url in enumerate(urls * repeat)]
+
+    def download(job):
+        path, error = download_video(job[1], job[0], temp_dir)
+        return (job[0], path), error, 0
+
+    def extract(job):
+        waveform, error = decode_audio(job[1], job[0])
+        os.remove(job[1])
+        return (job[0], waveform), error, len(waveform) / 16000 if waveform is not None else 0
+
+    def acquire(job):
+        waveform, error = acquire_audio(job[1], job[0], temp_dir)
+        return None, error, len(waveform) / 16000 if waveform is not None else 0
+
+    def inference(job):
+        error = detect_accent_from_waveform(job[1], job[0])[4]
+        return None, error, len(job[1]) / 16000
+
+    downloaded, download_row = timed_runs("download", jobs, download)
+    decoded, extract_row = timed_runs("extract", downloaded, extract)
+    _, acquire_row = timed_runs("acquire", jobs, acquire)
+    _, inference_row = timed_runs("inference", decoded, inference)
+    return [download_row, extract_row, acquire_row, inference_row]
+
+
+def _request(url, payload=None):
+    """GET (or POST payload as JSON); returns the status code and the decoded JSON body."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def run_load(base_url, urls, concurrency, requests_per_client, poll_interval, task_timeout):
+    """--concurrency clients each submitting tasks one after the other and polling /status until they finish."""
+    latencies, errors, timings = [], [], []
+
+    def client(index):
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            status, body = _request(f"{base_url}/analyze", {"video_url": urls[(index + i) % len(urls)]})
+            if status != 202:
+                errors.append(f"/analyze returned {status}: {body.get('message')}")
+                continue
+            task_id = body["task_id"]
+            while body.get("status") == "processing":
+                if time.perf_counter() - start > task_timeout:
+                    body = {"status": "error", "message": f"Task {task_id} timed out"}
+                    break
+                time.sleep(poll_interval)
+                _, body = _request(f"{base_url}/status/{task_id}?timings=1")
+            if body.get("status") == "completed":
+                latencies.append(time.perf_counter() - start)
+                timings.append(body.get("timings", {}))
+            else:
+                errors.append(body.get("message"))
+
+    with ResourceMonitor() as monitor:
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    print(f"Load with {concurrency} client(s): {len(latencies)} task(s), {len(errors)} error(s)", file=sys.stderr)
+
+    # Median of each pipeline stage as the app timed it (queue_wait, acquire, classify, total...)
+    stages = sorted({stage for task_timings in timings for stage in task_timings})
+    server_stages = {stage: round(percentile([t[stage] for t in timings if stage in t], 50) * 1000, 1)
+                     for stage in stages}
+    return dict(concurrency=concurrency, **summarize(latencies, monitor, errors), server_stage_p50_ms=server_stages)
+
+
+def flatten(report):
+    """The comparable metrics of a report, by name (e.g. 'load.c4.latency_p95_ms')."""
+    flat = {}
+    for prefix, rows, key in (("stages", report.get("stages", []), "stage"),
+                              ("load", report.get("load", []), "concurrency")):
+        for row in rows:
+            label = row[key] if prefix == "stages" else f"c{row[key]}"
+            for metric in _DIRECTIONS:
+                if row.get(metric) is not None:
+                    flat[f"{prefix}.{label}.{metric}"] = row[metric]
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """Metrics that changed by more than tolerance (a fraction) against the baseline report."""
+    current, previous = flatten(report), flatten(baseline)
+    regressions, improvements = [], []
+    for name, before in sorted(previous.items()):
+        after = current.get(name)
+        if after is None or not before:
+            continue
+        change = (after - before) / before
+        higher_is_better = _DIRECTIONS[name.rsplit('.', 1)[1]]
+        row = {"metric": name, "baseline": before, "current": after, "change_pct": round(change * 100, 1)}
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(row)
+        elif (change > tolerance) if higher_is_better else (change < -tolerance):
+            improvements.append(row)
+    environment = report.get("environment", {})
+    return {
+        "tolerance_pct": round(tolerance * 100, 1),
+        "metrics_compared": len(set(previous) & set(current)),
+        # Results from a different machine or configuration are not directly comparable
+        "environment_differences": sorted(key for key, value in baseline.get("environment", {}).items()
+                                          if environment.get(key) != value),
+        "regressions": regressions,
+        "improvements": improvements,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--media-dir', help="Serve the media files in this directory (default: generated fixtures)")
+    parser.add_argument('--repeat', type=int, default=2, help="Runs of every fixture per stage")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--requests-per-client', type=int, default=2)
+    parser.add_argument('--poll-interval', type=float, default=0.25, help="Seconds between /status polls")
+    parser.add_argument('--task-timeout', type=float, default=600)
+    parser.add_argument('--skip-stages', action='store_true')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--with-cache', action='store_true', help="Keep the result cache on (repeat URLs then hit it)")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--baseline', help="Earlier report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    # Configured before app (and the modules it imports) read their settings
+    os.environ.update({
+        "TASK_STORE_URL": f"sqlite:///{os.path.join(work_dir, 'tasks.sqlite3')}",
+        "RESULT_CACHE_DB": os.path.join(work_dir, 'result_cache.sqlite3'),
+        "EMBEDDING_STORE_DIR": os.path.join(work_dir, 'embedding_store'),
+        "MAX_QUEUE_DEPTH": "0",
+        "RATE_LIMIT_PER_MINUTE": "0",
+    })
+    if not args.with_cache:
+        os.environ["RESULT_CACHE_TTL_SECONDS"] = "0"
+
+    report = {}
+    try:
+        # The pipeline logs every step with print(); keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            media_dir = args.media_dir or os.path.join(work_dir, 'media')
+            names = (sorted(name for name in os.listdir(media_dir) if os.path.isfile(os.path.join(media_dir, name)))
+                     if args.media_dir else generate_fixtures(media_dir))
+
+            import app
+            from werkzeug.serving import make_server
+            while app.model_status["state"] in ("not_loaded", "loading"):
+                time.sleep(0.1)
+            if not app.is_model_ready():
+                raise SystemExit(f"Model failed to load: {app.model_status['error']}")
+
+            import torch
+            report["environment"] = {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "torch_threads": torch.get_num_threads(),
+                "model_source": app.model_status["source"],
+                "inference_backend": app.model_status["backend"],
+                "inference_workers": os.environ.get('INFERENCE_WORKERS', '0'),
+                "acquisition_mode": app.AUDIO_ACQUISITION_MODE,
+                "executor_workers": app.app.config['EXECUTOR_MAX_WORKERS'],
+                "result_cache": args.with_cache,
+            }
+            report["fixtures"] = {name: os.path.getsize(os.path.join(media_dir, name)) for name in names}
+
+            stats = {}
+            with serve_directory(media_dir, stats=stats) as media_url:
+                urls = [f"{media_url}/{name}" for name in names]
+                if not args.skip_stages:
+                    stage_dir = os.path.join(work_dir, 'stages')
+                    os.makedirs(stage_dir)
+                    report["stages"] = run_stages(urls, args.repeat, stage_dir)
+                if not args.skip_load:
+                    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+                    threading.Thread(target=server.serve_forever, daemon=True).start()
+                    base_url = f"http://127.0.0.1:{server.server_port}"
+                    report["load"] = [run_load(base_url, urls, concurrency, args.requests_per_client,
+                                               args.poll_interval, args.task_timeout)
+                                      for concurrency in args.concurrency]
+                    server.shutdown()
+            report["media_bytes_served"] = stats.get("bytes_sent")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures cold-start time in fresh interpreters: how long importing app.py takes, when the app
+first answers /healthz, and when /readyz reports the model loaded, for each model source.
+The time to import torch and SpeechBrain on their own is reported for reference.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup --sources hub snapshot --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import percentile, print_report
+
+# Runs in the child interpreter; prints one JSON line
+_APP_PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+client = app.app.test_client()
+client.get('/healthz')
+healthy = time.perf_counter() - start
+while client.get('/readyz').status_code != 200 and app.model_status['state'] != 'failed':
+    time.sleep(0.05)
+print(json.dumps({"import_s": imported, "healthz_s": healthy, "ready_s": time.perf_counter() - start,
+                  "state": app.model_status['state'], "load_s": app.model_status['load_seconds']}))
+"""
+
+_IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import_s": time.perf_counter() - start}}))
+"""
+
+
+def run_probe(code, env=None, timeout=900):
+    """Runs `code` in a new interpreter and returns the JSON object it printed last."""
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             env=dict(os.environ, **(env or {})), timeout=timeout)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith('{'):
+            return json.loads(line)
+    raise RuntimeError(f"Probe failed: {process.stderr.strip()[-2000:]}")
+
+
+def median(values):
+    return round(percentile(values, 50), 3) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', nargs='+', default=['hub', 'snapshot'], help="MODEL_SOURCE values to compare")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    imports = {}
+    for module in ('torch', 'speechbrain.inference.classifiers'):
+        times = [run_probe(_IMPORT_PROBE.format(module=module))["import_s"] for _ in range(args.repeat)]
+        imports[module] = median(times)
+
+    runs = []
+    for source in args.sources:
+        samples = [run_probe(_APP_PROBE, env={'MODEL_SOURCE': source}) for _ in range(args.repeat)]
+        runs.append({
+            "model_source": source,
+            "states": sorted({sample["state"] for sample in samples}),
+            "app_import_s": median([sample["import_s"] for sample in samples]),
+            "healthz_s": median([sample["healthz_s"] for sample in samples]),
+            "ready_s": median([sample["ready_s"] for sample in samples]),
+            "model_load_s": median([sample["load_s"] for sample in samples if sample["load_s"] is not None]),
+        })
+
+    print_report({"repeat": args.repeat, "module_import_s": imports, "runs": runs})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures clips/sec of the inference engine against the number of inference worker processes.
+Worker count 0 is the in-process engine. For every run the proportional set size (PSS) of
+the workers is reported too, which shows the memory-mapped snapshot weights being shared
+(create the snapshot first with `python model_snapshot.py`).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_workers --workers 0 1 2 4 --clips 64 --concurrency 8
+"""
+import argparse
+import os
+
+import torch
+
+import accent_analysis
+from inference_engine import BatchInferenceEngine
+from inference_workers import InferenceProcessPool
+from benchmarks.bench_batching import run_concurrently
+from benchmarks.common import synthetic_clips, print_report
+
+
+def pss_mb(pid):
+    """Proportional set size of a process in MB (shared pages are split between sharers); Linux only."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--threads-per-worker', type=int, default=0, help="0 = split cores evenly")
+    parser.add_argument('--clips', type=int, default=64)
+    parser.add_argument('--min-seconds', type=float, default=4.0)
+    parser.add_argument('--max-seconds', type=float, default=12.0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    if not os.path.exists(accent_analysis.MODEL_SNAPSHOT_PATH):
+        raise SystemExit("Inference workers load the model snapshot; create it with `python model_snapshot.py`.")
+    accent_analysis.load_accent_model()
+    if accent_analysis.accent_classifier is None:
+        raise SystemExit("Model could not be loaded; aborting benchmark.")
+    clips = synthetic_clips(args.clips, args.min_seconds, args.max_seconds)
+
+    runs = []
+    for workers in args.workers:
+        pool = InferenceProcessPool(workers, args.threads_per_worker, setup=accent_analysis._load_worker_model,
+                                    setup_args=(accent_analysis.inference_backend.name,)).start() if workers > 0 else None
+        engine = BatchInferenceEngine(
+            accent_analysis._classify_batch, args.max_batch_size, args.max_wait_ms,
+            executor=pool, max_in_flight=workers or 1,
+        ).start()
+        try:
+            engine.classify(clips[0]) # Warm-up
+            run = run_concurrently(engine.classify, clips, args.concurrency)
+            run["workers"] = workers
+            run["torch_threads_per_worker"] = pool.threads_per_worker if pool else torch.get_num_threads()
+            run["parent_pss_mb"] = pss_mb(os.getpid())
+            run["worker_pss_mb"] = [pss_mb(pid) for pid in pool.worker_pids()] if pool else []
+            runs.append(run)
+        finally:
+            engine.stop()
+            if pool is not None:
+                pool.shutdown()
+
+    print_report({"cpu_count": os.cpu_count(), "concurrency": args.concurrency, "runs": runs})
+
+
+if __name__ == '__main__':
+    main()
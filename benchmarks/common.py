@@ -0,0 +1,95 @@
+import json
+import math
+import os
+import resource
+import threading
+import time
+
+import torch
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (pct in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize_latencies(latencies, wall_time):
+    """Throughput and latency percentiles (in milliseconds) for one benchmark run."""
+    return {
+        "clips": len(latencies),
+        "wall_time_s": round(wall_time, 3),
+        "throughput_clips_per_s": round(len(latencies) / wall_time, 3) if wall_time > 0 else None,
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+def synthetic_clips(count, min_seconds, max_seconds, sample_rate=16000, seed=0):
+    """
+    Deterministic noise clips of varying length, used when no real audio is supplied.
+    Accuracy is meaningless on these; they only exercise the model's compute path.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    clips = []
+    for _ in range(count):
+        seconds = min_seconds + (max_seconds - min_seconds) * torch.rand(1, generator=generator).item()
+        clips.append(0.1 * torch.randn(int(seconds * sample_rate), generator=generator))
+    return clips
+
+
+def resident_mb():
+    """Current resident memory of this process in MB (Linux)."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+class ResourceMonitor:
+    """
+    Wall time, CPU utilization and peak resident memory while a with-block runs. CPU time
+    includes finished child processes (yt-dlp, FFmpeg) and utilization is over all cores
+    (1.0 = every core busy). Resident memory is sampled every `interval` seconds.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _cpu_seconds():
+        own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss_mb = max(self.peak_rss_mb, resident_mb())
+
+    def __enter__(self):
+        self.peak_rss_mb = resident_mb()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, name="resource-monitor", daemon=True)
+        self._sampler.start()
+        self._wall, self._cpu = time.perf_counter(), self._cpu_seconds()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = time.perf_counter() - self._wall
+        self.cpu_time = self._cpu_seconds() - self._cpu
+        self._stop.set()
+        self._sampler.join()
+        self.peak_rss_mb = max(self.peak_rss_mb, resident_mb())
+
+    def report(self):
+        return {
+            "wall_time_s": round(self.wall_time, 3),
+            "cpu_seconds": round(self.cpu_time, 3),
+            "cpu_utilization": round(self.cpu_time / (self.wall_time * os.cpu_count()), 3) if self.wall_time else None,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+
+def print_report(report):
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,41 @@
+"""
+Deterministic media fixtures generated with FFmpeg's lavfi sources, for benchmarks that need
+real containers without downloading anything. The audio is a frequency-modulated tone with a
+one-second pause every four seconds, so the energy VAD finds speech-like segments in it.
+"""
+import os
+import subprocess
+
+# name -> (seconds, with video, moov atom at the front)
+DEFAULT_FIXTURES = {
+    "audio_30s.m4a": (30, False, True),
+    "audio_120s.m4a": (120, False, True),
+    "video_60s.mp4": (60, True, True),
+    "video_60s_moov_end.mp4": (60, True, False), # Not streamable: exercises the file fallback
+}
+
+_SPEECHY = "0.3*sin(2*PI*(180+60*sin(2*PI*0.7*t))*t)*lt(mod(t,4),3)"
+
+
+def generate_fixture(path, seconds, video=False, faststart=True):
+    """Writes one AAC (and, with video, H.264 test pattern) MP4 file of the given length."""
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+               '-f', 'lavfi', '-i', f"aevalsrc='{_SPEECHY}':s=44100:d={seconds}"]
+    if video:
+        command += ['-f', 'lavfi', '-i', f"testsrc=size=320x240:rate=15:duration={seconds}",
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p']
+    command += ['-ac', '1', '-c:a', 'aac', '-b:a', '64k']
+    if faststart:
+        command += ['-movflags', '+faststart']
+    subprocess.run(command + [path], check=True)
+
+
+def generate_fixtures(directory, fixtures=None):
+    """Generates the fixtures (DEFAULT_FIXTURES by default) missing from directory; returns their names."""
+    fixtures = fixtures or DEFAULT_FIXTURES
+    os.makedirs(directory, exist_ok=True)
+    for name, (seconds, video, faststart) in fixtures.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            generate_fixture(path, seconds, video, faststart)
+    return sorted(fixtures)
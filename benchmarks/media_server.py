@@ -0,0 +1,138 @@
+"""
+Serves local media files over HTTP so the acquisition pipeline can be exercised
+without YouTube or any network access.
+
+Usage (from the repository root):
+    python -m benchmarks.media_server path/to/sample.mp4
+"""
+import argparse
+import contextlib
+import functools
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from video_processing import SAMPLE_RATE, acquire_audio, stream_audio
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """
+    Static files with single-range requests (Range: bytes=start-end) answered with 206, so
+    clients can seek (e.g. FFmpeg reading a moov atom at the end) and fetch partial files.
+    Requests, bytes sent and peak concurrent requests are counted in server.stats.
+    """
+    _range_remaining = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_one_request(self):
+        stats = self.server.stats
+        with self.server.stats_lock:
+            stats["active"] += 1
+            stats["peak_concurrency"] = max(stats["peak_concurrency"], stats["active"])
+        try:
+            super().handle_one_request()
+        finally:
+            with self.server.stats_lock:
+                stats["active"] -= 1
+
+    def send_head(self):
+        self._range_remaining = None
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+        path = self.translate_path(self.path)
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if not match or not (match[1] or match[2]) or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        if match[1]:
+            start, end = int(match[1]), min(int(match[2]) if match[2] else size - 1, size - 1)
+        else: # Suffix range: the last N bytes
+            start, end = max(size - int(match[2]), 0), size - 1
+        if start > end:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self._range_remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = self._range_remaining
+        while remaining is None or remaining > 0:
+            data = source.read(65536 if remaining is None else min(65536, remaining))
+            if not data:
+                break
+            try:
+                outputfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                return # The client stopped reading (e.g. yt-dlp probing the file or FFmpeg seeking)
+            with self.server.stats_lock:
+                self.server.stats["bytes_sent"] += len(data)
+            if remaining is not None:
+                remaining -= len(data)
+
+
+@contextlib.contextmanager
+def serve_directory(directory, host='127.0.0.1', port=0, stats=None):
+    """
+    Serves `directory` on a background thread for the duration of the with-block.
+    Yields the base URL (port 0 picks a free port). If a `stats` dict is given, it is kept
+    up to date with "requests", "bytes_sent", "active" and "peak_concurrency".
+    """
+    handler = functools.partial(_QuietHandler, directory=os.path.abspath(directory))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.stats = stats if stats is not None else {}
+    server.stats.update(requests=0, bytes_sent=0, active=0, peak_concurrency=0)
+    server.stats_lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('media_file', help="Local audio/video file to serve")
+    args = parser.parse_args()
+
+    directory, filename = os.path.split(os.path.abspath(args.media_file))
+    with serve_directory(directory) as base_url, tempfile.TemporaryDirectory() as temp_dir:
+        url = f"{base_url}/{filename}"
+
+        start = time.perf_counter()
+        pcm, error = stream_audio(url, "media-server-stream")
+        elapsed = time.perf_counter() - start
+        if error:
+            print(f"Streaming: not streamable ({error})")
+        else:
+            print(f"Streaming: {pcm.size / SAMPLE_RATE:.1f}s of audio decoded in {elapsed:.2f}s")
+
+        start = time.perf_counter()
+        pcm, error = acquire_audio(url, "media-server-acquire", temp_dir)
+        elapsed = time.perf_counter() - start
+        if error:
+            print(f"acquire_audio failed: {error}")
+        else:
+            print(f"acquire_audio: {pcm.size / SAMPLE_RATE:.1f}s of audio in {elapsed:.2f}s")
+        print(f"Files left in temp dir: {os.listdir(temp_dir)}")
+
+
+if __name__ == '__main__':
+    main()
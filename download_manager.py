@@ -0,0 +1,290 @@
+"""
+Limits on media downloads into TEMP_DIR: concurrent downloads per host, bytes and media
+duration per download, a disk quota for the whole directory, and a janitor that removes
+files left behind by crashed or killed tasks.
+
+Every yt-dlp invocation is a separate process, so connections cannot be pooled between
+downloads; capping downloads per host is what keeps a burst of tasks from opening dozens
+of connections to one site. The caps are per process (each gunicorn worker has its own).
+"""
+import contextlib
+import glob
+import os
+import subprocess
+import threading
+import time
+from urllib.parse import urlparse
+
+import metrics
+
+# --- Download limits (overridable through environment variables) ---
+# Concurrent downloads (and streams) from one host; further ones wait for a free slot
+DOWNLOAD_MAX_PER_HOST = int(os.environ.get('DOWNLOAD_MAX_PER_HOST', 2))
+DOWNLOAD_SLOT_TIMEOUT_SECONDS = float(os.environ.get('DOWNLOAD_SLOT_TIMEOUT_SECONDS', 120))
+# A download that grows past this many bytes is stopped and removed. 0 disables the limit.
+DOWNLOAD_MAX_BYTES = int(os.environ.get('DOWNLOAD_MAX_BYTES', 500 * 1024 * 1024))
+# Only the first N seconds of the media are fetched (yt-dlp --download-sections), since
+# no more than MAX_AUDIO_SECONDS is ever decoded. 0 downloads whole files.
+DOWNLOAD_MAX_SECONDS = float(os.environ.get('DOWNLOAD_MAX_SECONDS', os.environ.get('MAX_AUDIO_SECONDS', 1200)))
+
+# --- TEMP_DIR housekeeping ---
+# Downloads are refused (and running ones stopped) while TEMP_DIR holds more than this. 0 disables it.
+TEMP_DIR_QUOTA_BYTES = int(os.environ.get('TEMP_DIR_QUOTA_BYTES', 2 * 1024 * 1024 * 1024))
+# Files in TEMP_DIR not modified for this long, and not being downloaded, are removed by the janitor
+TEMP_FILE_MAX_AGE_SECONDS = int(os.environ.get('TEMP_FILE_MAX_AGE_SECONDS', 3600))
+TEMP_JANITOR_INTERVAL_SECONDS = int(os.environ.get('TEMP_JANITOR_INTERVAL_SECONDS', 300))
+# The quota is checked against a walk of TEMP_DIR redone at most this often, plus the growth of
+# this process's running downloads since then (which their watchdogs measure anyway)
+TEMP_USAGE_REFRESH_SECONDS = float(os.environ.get('TEMP_USAGE_REFRESH_SECONDS', 5))
+
+# A section download smaller than this did not get any media (e.g. the server ignores
+# Range requests and the container index sits at the end), so the whole file is fetched instead
+_MIN_SECTION_BYTES = 4096
+_WATCHDOG_INTERVAL_SECONDS = 0.25
+
+
+class DownloadLimitError(RuntimeError):
+    """Raised when a download is refused or stopped by one of the limits above."""
+
+
+# --- Per-host download slots ---
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+_held_slots = threading.local()
+
+
+def _host_of(url):
+    return (urlparse(url).hostname or url).lower()
+
+
+@contextlib.contextmanager
+def host_slot(url, max_per_host=DOWNLOAD_MAX_PER_HOST, timeout=DOWNLOAD_SLOT_TIMEOUT_SECONDS):
+    """
+    Holds one of the max_per_host download slots of the URL's host for the with-block, waiting
+    up to `timeout` seconds for one. A thread that already holds a slot for the host (e.g. a
+    file fallback after a failed stream) reuses it. Raises DownloadLimitError on timeout.
+    """
+    host = _host_of(url)
+    held = _held_slots.__dict__.setdefault('hosts', set())
+    if max_per_host <= 0 or host in held:
+        yield
+        return
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.setdefault((host, max_per_host), threading.BoundedSemaphore(max_per_host))
+    if not semaphore.acquire(timeout=timeout):
+        metrics.DOWNLOADS_REJECTED.inc(reason='host_busy')
+        raise DownloadLimitError(f"No download slot for {host} became free within {timeout:.0f}s.")
+    held.add(host)
+    try:
+        yield
+    finally:
+        held.discard(host)
+        semaphore.release()
+
+
+class DownloadManager:
+    """Runs yt-dlp downloads into one temp directory under the byte and disk limits."""
+
+    def __init__(self, temp_dir, max_bytes=DOWNLOAD_MAX_BYTES, max_seconds=DOWNLOAD_MAX_SECONDS,
+                 quota_bytes=TEMP_DIR_QUOTA_BYTES, max_file_age=TEMP_FILE_MAX_AGE_SECONDS,
+                 max_per_host=DOWNLOAD_MAX_PER_HOST, usage_refresh_seconds=TEMP_USAGE_REFRESH_SECONDS):
+        self.temp_dir = os.path.abspath(temp_dir)
+        self.max_per_host = max_per_host
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.quota_bytes = quota_bytes
+        self.max_file_age = max_file_age
+        self.usage_refresh_seconds = usage_refresh_seconds
+        self._active = {} # Output path of each running download -> bytes it has written so far
+        self._lock = threading.Lock()
+        self._walk_lock = threading.Lock()
+        self._walked_bytes = 0
+        self._walked_at = None
+        self._active_at_walk = {} # _active as it was when the directory was last walked
+        self._janitor_thread = None
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    # --- Disk usage ---
+    def _walk(self):
+        """Bytes currently held in the temp directory (including subdirectories)."""
+        total = 0
+        for root, _, files in os.walk(self.temp_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass # Removed while walking
+        return total
+
+    def refresh_usage(self):
+        """Walks the temp directory again; usage() counts from this walk until the next one."""
+        with self._walk_lock:
+            with self._lock:
+                active = dict(self._active)
+            total = self._walk()
+            with self._lock:
+                self._walked_bytes, self._walked_at, self._active_at_walk = total, time.monotonic(), active
+
+    def usage(self):
+        """
+        Bytes held in the temp directory: the last walk (redone by whichever caller first finds it
+        older than usage_refresh_seconds, while the others keep using it) plus what this process's
+        running downloads have written since.
+        """
+        with self._lock:
+            stale = self._walked_at is None or time.monotonic() - self._walked_at >= self.usage_refresh_seconds
+        if stale and (self._walked_at is None or not self._walk_lock.locked()):
+            self.refresh_usage()
+        with self._lock:
+            return self._walked_bytes + sum(size - self._active_at_walk.get(path, 0)
+                                            for path, size in self._active.items())
+
+    def _download_size(self, output_path):
+        """Bytes written so far by a download: the output file and yt-dlp's .part/format files next to it."""
+        total = 0
+        for path in glob.glob(glob.escape(output_path) + '*'):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _remove_download(self, output_path):
+        for path in glob.glob(glob.escape(output_path) + '*'):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def _check_quota(self):
+        if self.quota_bytes <= 0 or self.usage() < self.quota_bytes:
+            return
+        self.sweep()
+        self.refresh_usage()
+        if self.usage() >= self.quota_bytes:
+            metrics.DOWNLOADS_REJECTED.inc(reason='quota')
+            raise DownloadLimitError(f"The temporary media directory is full ({self.quota_bytes} byte quota).")
+
+    # --- Downloads ---
+    def limit_args(self, sections=True):
+        """yt-dlp arguments enforcing the duration limit (sections=True) or, otherwise, the size limit up front."""
+        if sections and self.max_seconds > 0:
+            # --max-filesize would reject long media by the size of the whole file, of which
+            # only a section is fetched; the watchdog still enforces max_bytes
+            return ['--download-sections', f'*0-{int(self.max_seconds)}']
+        return ['--max-filesize', str(self.max_bytes)] if self.max_bytes > 0 else []
+
+    def download(self, video_url, command, output_path, task_id):
+        """
+        Runs a yt-dlp command that writes to output_path, holding a host slot, with the limit
+        arguments appended. A running download is killed (and its files removed) once it grows
+        past max_bytes or pushes the directory past the quota.
+        Returns the yt-dlp (returncode, stderr); raises DownloadLimitError when a limit is hit.
+        """
+        with host_slot(video_url, self.max_per_host):
+            self._check_quota()
+            returncode, stderr = self._run(command + self.limit_args(sections=True), output_path, task_id)
+            if self.max_seconds > 0 and returncode == 0 and self._download_size(output_path) < _MIN_SECTION_BYTES:
+                print(f"Task {task_id}: Section download got no media, downloading the whole file.")
+                self._remove_download(output_path)
+                returncode, stderr = self._run(command + self.limit_args(sections=False), output_path, task_id)
+            if returncode == 0 and not os.path.exists(output_path) and self.max_bytes > 0:
+                # yt-dlp skips files over --max-filesize without failing (the message is hidden by --quiet)
+                metrics.DOWNLOADS_REJECTED.inc(reason='max_bytes')
+                raise DownloadLimitError(f"The media may be larger than the {self.max_bytes} byte download limit.")
+            return returncode, stderr
+
+    def _run(self, command, output_path, task_id):
+        print(f"Task {task_id}: yt-dlp command: {' '.join(command)}")
+        with self._lock:
+            self._active[output_path] = 0
+        stderr = []
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        drain = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        drain.start()
+        try:
+            while True:
+                try:
+                    process.wait(timeout=_WATCHDOG_INTERVAL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                reason = None
+                size = self._download_size(output_path)
+                with self._lock:
+                    self._active[output_path] = size
+                if self.max_bytes > 0 and size > self.max_bytes:
+                    reason, message = 'max_bytes', f"The download exceeded the {self.max_bytes} byte limit."
+                elif self.quota_bytes > 0 and self.usage() > self.quota_bytes:
+                    reason, message = 'quota', f"The temporary media directory is full ({self.quota_bytes} byte quota)."
+                if reason:
+                    process.kill()
+                    process.wait()
+                    self._remove_download(output_path)
+                    metrics.DOWNLOADS_REJECTED.inc(reason=reason)
+                    raise DownloadLimitError(message)
+            drain.join()
+            return process.returncode, b''.join(stderr).decode(errors='replace').strip()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            size = self._download_size(output_path)
+            with self._lock:
+                # Whatever the download left behind stays counted until the next walk sees it
+                self._walked_bytes += size - self._active_at_walk.pop(output_path, 0)
+                del self._active[output_path]
+
+    # --- Janitor ---
+    def sweep(self, max_age=None):
+        """
+        Removes files directly in the temp directory that have not been modified for max_age
+        seconds (default: max_file_age) and do not belong to a running download.
+        Subdirectories (e.g. batch job results) are left alone. Returns the number removed.
+        """
+        max_age = self.max_file_age if max_age is None else max_age
+        cutoff = time.time() - max_age
+        with self._lock:
+            active = tuple(self._active)
+        removed = 0
+        with os.scandir(self.temp_dir) as entries:
+            for entry in entries:
+                try:
+                    if (not entry.is_file(follow_symlinks=False) or entry.stat().st_mtime > cutoff
+                            or entry.path.startswith(active)):
+                        continue
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass # Removed or replaced meanwhile
+        return removed
+
+    def start_janitor(self, interval=TEMP_JANITOR_INTERVAL_SECONDS):
+        """Sweeps stale files now and then every `interval` seconds on a daemon thread."""
+        if self._janitor_thread is not None:
+            return
+
+        def _loop():
+            while True:
+                try:
+                    removed = self.sweep()
+                    if removed:
+                        print(f"Temp janitor: removed {removed} stale file(s) from {self.temp_dir}")
+                    self.refresh_usage()
+                except Exception as e:
+                    print(f"Temp janitor: sweep failed: {e}")
+                time.sleep(interval)
+
+        self._janitor_thread = threading.Thread(target=_loop, name="temp-janitor", daemon=True)
+        self._janitor_thread.start()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_download_manager(temp_dir):
+    """The process-wide DownloadManager of a temp directory (so its active downloads are known to its janitor)."""
+    key = os.path.abspath(temp_dir)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = DownloadManager(key)
+        return _managers[key]
@@ -0,0 +1,192 @@
+"""
+Persistent store of the ECAPA embedding of every analyzed clip, for nearest-neighbour lookups
+(reuploads, the same speaker, similar accents) without running the model again.
+
+Vectors are unit length and kept as float16 rows of one memory-mapped file, so a million clips
+take ~384 MB on disk and only the pages a search touches are read. Row metadata (URL, audio
+fingerprint, accent) lives in a SQLite index next to it. Cosine similarity is then a dot
+product, and a search scores every row with one float16 matrix-vector product.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from result_cache import normalize_video_url
+
+# --- Embedding store configuration (overridable through environment variables) ---
+EMBEDDING_STORE_DIR = os.environ.get('EMBEDDING_STORE_DIR', os.path.join(os.getcwd(), 'embedding_store'))
+EMBEDDING_DIM = 192 # ECAPA-TDNN output size
+# Neighbours at least this similar are reported as duplicates (reuploads or the same recording)
+EMBEDDING_DUPLICATE_SIMILARITY = float(os.environ.get('EMBEDDING_DUPLICATE_SIMILARITY', 0.97))
+
+_MIN_CAPACITY = 1024
+
+
+class EmbeddingStore:
+    """
+    Append-only float16 vector file plus SQLite metadata index.
+
+    Row numbers are allocated by the SQLite index, and each vector is written inside the
+    transaction that inserts its metadata, so several processes (e.g. gunicorn workers) can
+    share one store: whoever sees a row also sees its vector.
+    """
+
+    def __init__(self, store_dir=EMBEDDING_STORE_DIR, dim=EMBEDDING_DIM):
+        self.store_dir = store_dir
+        self.dim = dim
+        os.makedirs(store_dir, exist_ok=True)
+        self.vectors_path = os.path.join(store_dir, 'vectors.f16')
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._capacity = 0
+        self._conn = sqlite3.connect(os.path.join(store_dir, 'index.sqlite3'), check_same_thread=False,
+                                     timeout=30, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS clips ("
+                " row INTEGER PRIMARY KEY,"
+                " source TEXT,"
+                " video_url TEXT,"
+                " fingerprint TEXT,"
+                " accent TEXT,"
+                " confidence REAL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS clips_source ON clips (source)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS clips_fingerprint ON clips (fingerprint)")
+            self._remap()
+
+    def _remap(self, min_rows=0):
+        """(Re)maps the vector file, growing it (doubling) first if it holds fewer than min_rows rows."""
+        row_bytes = self.dim * 2
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size < min_rows * row_bytes:
+            size = max(min_rows, 2 * (size // row_bytes), _MIN_CAPACITY) * row_bytes
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(size)
+        # Writes through the old map are flushed, and the map is released here; a search still
+        # reading it keeps its own reference, and the mapping is closed once that search is done
+        old, self._vectors = self._vectors, None
+        if old is not None:
+            old.flush()
+            del old
+        self._capacity = size // row_bytes
+        self._vectors = (np.memmap(self.vectors_path, dtype=np.float16, mode='r+', shape=(self._capacity, self.dim))
+                         if self._capacity else None)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM clips").fetchone()[0]
+
+    # --- Writes ---
+    def add(self, embedding, video_url=None, fingerprint=None, accent=None, confidence=None):
+        """Stores one clip's embedding (normalized to unit length) and returns its row number."""
+        return self.add_many([embedding], [{"video_url": video_url, "fingerprint": fingerprint,
+                                            "accent": accent, "confidence": confidence}])[0]
+
+    def add_many(self, embeddings, metadata=None):
+        """
+        Stores several embeddings in one transaction and returns their row numbers.
+        metadata, if given, holds one dict per embedding with any of the add() keyword arguments.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}.")
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        metadata = metadata or [{}] * len(vectors)
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes SQLite's write lock, which also serializes file growth across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM clips").fetchone()[0]
+                if first + len(vectors) > self._capacity:
+                    self._remap(first + len(vectors))
+                self._vectors[first:first + len(vectors)] = vectors.astype(np.float16)
+                self._conn.executemany(
+                    "INSERT INTO clips (row, source, video_url, fingerprint, accent, confidence, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(first + i, normalize_video_url(meta["video_url"]) if meta.get("video_url") else None,
+                      meta.get("video_url"), meta.get("fingerprint"), meta.get("accent"), meta.get("confidence"), now)
+                     for i, meta in enumerate(metadata)],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return list(range(first, first + len(vectors)))
+
+    # --- Lookups ---
+    def find(self, video_url=None, fingerprint=None):
+        """Rows stored for a video URL (normalized) or an audio fingerprint, oldest first."""
+        if video_url:
+            column, value = 'source', normalize_video_url(video_url)
+        else:
+            column, value = 'fingerprint', fingerprint
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT row FROM clips WHERE {column} = ? ORDER BY row", (value,)).fetchall()
+        return [row for row, in found]
+
+    def vector(self, row):
+        """The stored (unit-length) embedding of a row, as float32."""
+        with self._lock:
+            if row >= self._capacity:
+                self._remap()
+            return np.asarray(self._vectors[row], dtype=np.float32)
+
+    def metadata(self, rows):
+        """Metadata dicts for the given rows, in the same order."""
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT row, video_url, fingerprint, accent, confidence, created_at FROM clips"
+                f" WHERE row IN ({','.join('?' * len(rows))})", rows).fetchall()
+        by_row = {
+            r[0]: {"row": r[0], "video_url": r[1], "fingerprint": r[2], "accent": r[3],
+                   "confidence": r[4], "created_at": r[5]}
+            for r in found
+        }
+        return [by_row.get(row, {"row": row}) for row in rows]
+
+    def search(self, query, k=10, exclude_rows=()):
+        """
+        The k stored clips most similar to `query` (cosine similarity), best first, as metadata
+        dicts with a "similarity" field. Rows in exclude_rows (e.g. the query clip) are skipped.
+        """
+        import torch
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            count = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM clips").fetchone()[0]
+            if count > self._capacity:
+                self._remap()
+            # The whole search uses this map and this count, even if an add() remaps the file meanwhile
+            vectors = self._vectors
+        if count == 0 or k <= 0:
+            return []
+
+        # A float16 matrix-vector product straight over the mapped rows: no float32 copy of the
+        # store is made, so the cost is reading the rows once (~0.1 s per million on one core)
+        scores = (torch.from_numpy(vectors[:count]) @ torch.from_numpy(query).half()).float()
+        exclude = [row for row in exclude_rows if row < count]
+        if exclude:
+            scores[exclude] = -float('inf')
+        top_scores, top_rows = torch.topk(scores, min(k, count))
+        valid = torch.isfinite(top_scores)
+        neighbours = self.metadata(top_rows[valid].tolist())
+        for neighbour, score in zip(neighbours, top_scores[valid].tolist()):
+            neighbour["similarity"] = round(score, 4)
+        return neighbours
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._conn.close()
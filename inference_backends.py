@@ -0,0 +1,357 @@
+import copy
+import math
+import os
+import tempfile
+
+import torch
+
+try:
+    import onnxruntime
+except ImportError: # Only needed for INFERENCE_BACKEND=onnx
+    onnxruntime = None
+
+# --- Inference backend configuration (overridable through environment variables) ---
+# eager:   fp32 PyTorch under torch.inference_mode (reference)
+# int8:    dynamic int8 quantization of the embedding model's pointwise (kernel-size-1) convolutions
+# trace:   TorchScript-traced and frozen embedding model
+# compile: torch.compile'd embedding model (needs a C++ compiler; the first batches are slow)
+# onnx:    embedding model exported to ONNX and run by onnxruntime (pip install onnx onnxruntime)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'eager')
+# A backend whose class scores differ from eager by more than this on the startup parity check
+# is rejected and eager is used instead
+BACKEND_PARITY_TOLERANCE = float(os.environ.get('BACKEND_PARITY_TOLERANCE', 0.05))
+# Speech recordings (any format FFmpeg reads) for the parity check; their speech windows are
+# used instead of the bundled synthetic speech when the directory has any
+PARITY_SAMPLES_DIR = os.environ.get('PARITY_SAMPLES_DIR', os.path.join(
+    'pretrained_models', 'accent-id-commonaccent_ecapa', 'parity_samples'))
+# Exported ONNX models (one per batch size); delete them after changing the model weights
+ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR', os.path.join(
+    'pretrained_models', 'accent-id-commonaccent_ecapa', 'onnx'))
+
+
+# (F1, F2, F3) in Hz of a few English vowels, for the synthetic parity speech
+_VOWEL_FORMANTS = ((730, 1090, 2440), (270, 2290, 3010), (300, 870, 2240),
+                   (530, 1840, 2480), (570, 840, 2410), (660, 1720, 2410), (440, 1020, 2240))
+
+
+def synthetic_speech_clips(count=8, seconds=(6.0, 6.0, 4.5, 6.0, 2.5, 6.0, 3.5, 6.0), sample_rate=16000, seed=1234):
+    """
+    Deterministic voiced speech: a harmonic glottal source shaped by vowel formants, in syllables
+    with pitch movement and pauses, for speakers of different pitch and vocal tract length.
+    Clip lengths follow the analysis windows (and shorter leftovers, to exercise padding).
+    """
+    generator = torch.Generator().manual_seed(seed)
+
+    def uniform(low, high):
+        return low + (high - low) * torch.rand(1, generator=generator).item()
+
+    harmonics = torch.arange(1, 41, dtype=torch.float32)
+    clips = []
+    for i in range(count):
+        n = int(seconds[i % len(seconds)] * sample_rate)
+        base_f0, tract = uniform(95, 230), uniform(0.9, 1.15)
+        f0, envelope, formants = torch.full((n,), base_f0), torch.zeros(n), torch.empty(n, 3)
+        position, vowel = 0, torch.tensor(_VOWEL_FORMANTS[0], dtype=torch.float32)
+        while position < n:
+            length = min(int(uniform(0.12, 0.35) * sample_rate), n - position)
+            vowel = tract * torch.tensor(_VOWEL_FORMANTS[int(uniform(0, len(_VOWEL_FORMANTS)))], dtype=torch.float32)
+            ramp = torch.linspace(0, 1, length)
+            f0[position:position + length] = base_f0 * (1 + uniform(-0.15, 0.15) * ramp)
+            envelope[position:position + length] = torch.sin(math.pi * ramp).clamp(min=0).sqrt()
+            formants[position:position + length] = vowel
+            position += length
+            pause = min(int(uniform(0.05, 0.3) * sample_rate) if uniform(0, 1) < 0.3 else 0, n - position)
+            formants[position:position + pause] = vowel
+            position += pause
+
+        frequencies = f0[:, None] * harmonics # [samples, harmonics]
+        gain = sum(1 / (1 + ((frequencies - formants[:, k, None]) / 90) ** 2) for k in range(3))
+        gain = gain * (frequencies < 0.45 * sample_rate) / harmonics # -6 dB/octave source tilt
+        phase = 2 * math.pi * torch.cumsum(f0, 0) / sample_rate
+        wave = (gain * torch.sin(phase[:, None] * harmonics)).sum(-1) * envelope
+        wave = wave + 0.003 * torch.randn(n, generator=generator) # Breath and room noise
+        clips.append(0.3 * wave / wave.abs().max())
+    return clips
+
+
+def load_speech_windows(audio_dir, max_windows):
+    """Speech windows (as the app cuts them) from every file in audio_dir, in a fixed (sorted) order."""
+    from audio_segmentation import segment_speech
+    from video_processing import decode_audio
+    windows = []
+    for name in sorted(os.listdir(audio_dir)):
+        pcm, error = decode_audio(os.path.join(audio_dir, name), f"parity-{name}")
+        if error:
+            print(f"Skipping {name}: {error}")
+            continue
+        windows.extend(torch.from_numpy(pcm[start:end].copy()) for start, end in segment_speech(pcm))
+    return windows[:max_windows]
+
+
+def parity_clips(count=8, samples_dir=PARITY_SAMPLES_DIR):
+    """
+    The clips of the startup parity check: speech windows of the recordings in samples_dir if
+    there are any, otherwise the bundled synthetic speech (synthetic_speech_clips).
+    """
+    if samples_dir and os.path.isdir(samples_dir):
+        windows = load_speech_windows(samples_dir, count)
+        if windows:
+            return windows
+    return synthetic_speech_clips(count)
+
+
+def check_parity(reference, candidate, clips, batch_sizes=None):
+    """
+    Compares the class scores of two backends on the same clips, as one padded batch of each
+    size in batch_sizes (default: all clips at once; clips are reused for larger batches).
+    Returns the largest and mean absolute score difference and the top-1 agreement over all of them.
+    """
+    from inference_engine import pad_waveforms
+    diffs, agreements = [], []
+    for batch_size in batch_sizes or [len(clips)]:
+        wavs, wav_lens = pad_waveforms([clips[i % len(clips)] for i in range(batch_size)])
+        expected = reference.classify_batch(wavs, wav_lens)[0]
+        actual = candidate.classify_batch(wavs, wav_lens)[0]
+        diffs.append((expected - actual).abs().reshape(-1))
+        agreements.append(expected.argmax(-1) == actual.argmax(-1))
+    diff = torch.cat(diffs)
+    return {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "top1_agreement": float(torch.cat(agreements).float().mean()),
+    }
+
+
+class EagerBackend:
+    """
+    The EncoderClassifier forward pass (features, normalization, embedding model, cosine
+    classifier) with the embedding model as the swappable part; subclasses replace embed().
+    """
+    name = 'eager'
+    # Builds a separate model per batch size (on first use; the smallest and largest are parity-checked at startup)
+    per_batch_size = False
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.mods = classifier.mods
+        self.label_encoder = classifier.hparams.label_encoder
+
+    def embed(self, feats, wav_lens):
+        return self.mods.embedding_model(feats, wav_lens)
+
+    def compute_features(self, wavs, wav_lens):
+        """Fbank features with per-clip mean/variance normalization, for a whole padded batch at once."""
+        feats = self.mods.compute_features(wavs.float())
+        return self.mods.mean_var_norm(feats, wav_lens)
+
+    def classify_batch(self, wavs, wav_lens):
+        """
+        Same outputs as EncoderClassifier.classify_batch, (out_prob, score, index, text_lab),
+        followed by the ECAPA embeddings (batch x 192) the scores were computed from.
+        """
+        with torch.inference_mode():
+            feats = self.compute_features(wavs, wav_lens)
+            embeddings = self.embed(feats, wav_lens)
+            out_prob = self.mods.classifier(embeddings).squeeze(1)
+            score, index = torch.max(out_prob, dim=-1)
+        return out_prob, score, index, self.label_encoder.decode_torch(index), embeddings.reshape(len(index), -1)
+
+
+class PointwiseLinear(torch.nn.Module):
+    """A kernel-size-1 Conv1d expressed as a Linear over channels, so dynamic quantization applies."""
+
+    def __init__(self, conv):
+        super().__init__()
+        self.linear = torch.nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        self.linear.weight.data.copy_(conv.weight.data[:, :, 0])
+        if conv.bias is not None:
+            self.linear.bias.data.copy_(conv.bias.data)
+
+    def forward(self, x):
+        return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+def _replace_pointwise_convs(module):
+    """Swaps every plain kernel-size-1 Conv1d under module for a PointwiseLinear; returns the count."""
+    replaced = 0
+    for name, child in module.named_children():
+        if (isinstance(child, torch.nn.Conv1d) and child.kernel_size == (1,) and child.stride == (1,)
+                and child.groups == 1 and child.padding in ((0,), 'valid')):
+            setattr(module, name, PointwiseLinear(child))
+            replaced += 1
+        else:
+            replaced += _replace_pointwise_convs(child)
+    return replaced
+
+
+class Int8Backend(EagerBackend):
+    """
+    Dynamic int8 quantization. PyTorch only quantizes Linear layers dynamically, so the pointwise
+    convolutions (most of ECAPA's weights) are first rewritten as Linear; the wider-kernel
+    convolutions stay fp32.
+    """
+    name = 'int8'
+
+    def __init__(self, classifier):
+        super().__init__(classifier)
+        model = copy.deepcopy(self.mods.embedding_model).eval()
+        self.replaced = _replace_pointwise_convs(model)
+        self.embedding_model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def embed(self, feats, wav_lens):
+        return self.embedding_model(feats, wav_lens)
+
+
+class TracedBackend(EagerBackend):
+    """
+    TorchScript traces of the embedding model, frozen and optimized for inference. ECAPA's
+    pooling bakes the batch size into a trace (the number of frames stays dynamic), so one
+    trace is made per batch size, on first use; build_backend makes and checks the ones for
+    1 and INFERENCE_MAX_BATCH_SIZE at startup (benchmarks/bench_backends.py checks every size).
+    """
+    name = 'trace'
+    per_batch_size = True
+
+    def __init__(self, classifier):
+        super().__init__(classifier)
+        self._traces = {}
+
+    def embed(self, feats, wav_lens):
+        batch_size = feats.shape[0]
+        if batch_size not in self._traces:
+            with torch.no_grad():
+                traced = torch.jit.trace(self.mods.embedding_model.eval(), (feats, wav_lens), check_trace=False)
+                self._traces[batch_size] = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+        return self._traces[batch_size](feats, wav_lens)
+
+
+class CompiledBackend(EagerBackend):
+    """torch.compile'd embedding model with dynamic shapes, warmed up once at build time."""
+    name = 'compile'
+
+    def __init__(self, classifier):
+        super().__init__(classifier)
+        self.embedding_model = torch.compile(self.mods.embedding_model.eval(), dynamic=True)
+        with torch.inference_mode():
+            self.embedding_model(*_example_inputs(classifier))
+
+    def embed(self, feats, wav_lens):
+        return self.embedding_model(feats, wav_lens)
+
+
+class OnnxBackend(EagerBackend):
+    """
+    Embedding model exported to ONNX and run by onnxruntime. As with tracing, the export fixes
+    the batch size, so one model per batch size is exported (once, into ONNX_MODEL_DIR) on first
+    use; the ones for 1 and INFERENCE_MAX_BATCH_SIZE are loaded and checked at startup. Sessions
+    are created per process, so forked inference workers get their own.
+    """
+    name = 'onnx'
+    per_batch_size = True
+
+    def __init__(self, classifier, model_dir=ONNX_MODEL_DIR):
+        super().__init__(classifier)
+        if onnxruntime is None:
+            raise RuntimeError("INFERENCE_BACKEND=onnx but the 'onnxruntime' package is not installed.")
+        self.model_dir = model_dir
+        self._sessions = {}
+        self._sessions_pid = os.getpid()
+
+    def _get_session(self, batch_size):
+        if self._sessions_pid != os.getpid():
+            self._sessions, self._sessions_pid = {}, os.getpid()
+        if batch_size not in self._sessions:
+            model_path = os.path.join(self.model_dir, f"embedding_model.bs{batch_size}.onnx")
+            if not os.path.exists(model_path):
+                export_onnx(self.classifier, model_path, batch_size)
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._sessions[batch_size] = onnxruntime.InferenceSession(
+                model_path, options, providers=['CPUExecutionProvider'])
+        return self._sessions[batch_size]
+
+    def embed(self, feats, wav_lens):
+        outputs = self._get_session(feats.shape[0]).run(None, {
+            "feats": feats.contiguous().numpy(),
+            "wav_lens": wav_lens.contiguous().numpy(),
+        })
+        return torch.from_numpy(outputs[0])
+
+
+def _example_inputs(classifier, batch=2, seconds=4.0, sample_rate=16000):
+    """Normalized features and relative lengths shaped like a real batch, for tracing and export."""
+    wavs = 0.1 * torch.randn(batch, int(seconds * sample_rate), generator=torch.Generator().manual_seed(0))
+    wav_lens = torch.tensor([1.0] + [0.75] * (batch - 1))
+    with torch.no_grad():
+        feats = classifier.mods.compute_features(wavs)
+        feats = classifier.mods.mean_var_norm(feats, wav_lens)
+    return feats, wav_lens
+
+
+def export_onnx(classifier, model_path, batch_size):
+    """
+    Exports the embedding model to ONNX for one batch size, with a dynamic number of frames.
+    Every export writes its own temporary file and renames it into place, so processes
+    exporting the same model at once do not clobber each other.
+    """
+    model_dir = os.path.dirname(os.path.abspath(model_path))
+    os.makedirs(model_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=model_dir, prefix=os.path.basename(model_path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                classifier.mods.embedding_model.eval(), _example_inputs(classifier, batch=batch_size),
+                temp_path, input_names=["feats", "wav_lens"], output_names=["embeddings"],
+                dynamic_axes={"feats": {1: "frames"}}, opset_version=17, dynamo=False,
+            )
+        os.replace(temp_path, model_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    print(f"Exported the embedding model to ONNX: {model_path}")
+
+
+BACKENDS = {
+    'eager': EagerBackend,
+    'int8': Int8Backend,
+    'trace': TracedBackend,
+    'compile': CompiledBackend,
+    'onnx': OnnxBackend,
+}
+
+
+def build_backend(name, classifier, tolerance=BACKEND_PARITY_TOLERANCE, check=True):
+    """
+    Builds the named inference backend for a loaded EncoderClassifier. Unless check=False,
+    non-eager backends must match eager on the parity clips within `tolerance`; backends built
+    per batch size are checked at the two representative sizes, 1 and INFERENCE_MAX_BATCH_SIZE
+    (checking every size would hold up readiness by one trace or export each). A backend that
+    fails to build or to match falls back to eager (with a message saying why).
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unsupported INFERENCE_BACKEND: {name} (choose from {', '.join(BACKENDS)})")
+    eager = EagerBackend(classifier)
+    if name == 'eager':
+        return eager
+    try:
+        backend = BACKENDS[name](classifier)
+    except Exception as e:
+        print(f"Inference backend '{name}' could not be built ({e}); using eager.")
+        return eager
+    if check:
+        from inference_engine import MAX_BATCH_SIZE
+        clips = parity_clips(MAX_BATCH_SIZE)
+        batch_sizes = sorted({1, MAX_BATCH_SIZE}) if backend.per_batch_size else [len(clips)]
+        try:
+            parity = check_parity(eager, backend, clips, batch_sizes)
+        except Exception as e:
+            print(f"Inference backend '{name}' failed the parity check ({e}); using eager.")
+            return eager
+        print(f"Inference backend '{name}' parity vs eager ({len(clips)} clip(s), "
+              f"batch sizes {', '.join(map(str, batch_sizes))}): {parity}")
+        if not parity["max_abs_diff"] <= tolerance: # Also rejects NaN scores
+            print(f"Inference backend '{name}' exceeds the parity tolerance ({tolerance}); using eager.")
+            return eager
+    return backend
@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+
+# --- Batching configuration (overridable through environment variables) ---
+MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 50))
+# Longest wait for all of one caller's clips (e.g. a recording's windows) to be classified
+INFERENCE_RESULT_TIMEOUT_SECONDS = float(os.environ.get('INFERENCE_RESULT_TIMEOUT_SECONDS', 300))
+# Sample rate of submitted waveforms, used to report the real-time factor
+SAMPLE_RATE = 16000
+
+
+def wait_results(futures, timeout=INFERENCE_RESULT_TIMEOUT_SECONDS):
+    """
+    Results of submitted clips, in order, waiting at most `timeout` seconds for all of them.
+    On timeout the clips still queued are cancelled and a TimeoutError is raised.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        return [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+    except FutureTimeoutError:
+        for future in futures:
+            future.cancel()
+        raise TimeoutError(f"Inference did not finish within {timeout:.0f}s.")
+
+
+def pad_waveforms(waveforms):
+    """
+    Pads a list of 1-D waveforms into a single [batch, time] tensor.
+    Returns the padded batch and the relative lengths (1.0 for the longest clip),
+    which is the format EncoderClassifier.classify_batch expects for wav_lens.
+    """
+    import torch
+    lengths = [int(w.shape[-1]) for w in waveforms]
+    max_len = max(lengths)
+    wavs = torch.zeros(len(waveforms), max_len, dtype=torch.float32)
+    for i, w in enumerate(waveforms):
+        wavs[i, :lengths[i]] = w.reshape(-1)
+    wav_lens = torch.tensor([length / max_len for length in lengths], dtype=torch.float32)
+    return wavs, wav_lens
+
+
+class BatchInferenceEngine:
+    """
+    Dedicated inference worker that collects pending clips from a queue,
+    pads them into a micro-batch and runs a single forward pass for all of them.
+
+    batch_fn(wavs, wav_lens) must return one result per row of the batch;
+    each result is routed back to the Future of the clip that produced it.
+    A batch is dispatched as soon as it holds max_batch_size clips or the
+    oldest clip has waited max_wait_ms, whichever comes first.
+    If an executor is given, batch_fn is submitted to it instead of being called inline.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 executor=None, max_in_flight=1):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        # With an executor (e.g. a process pool) batches run there, up to max_in_flight at a time,
+        # while this thread keeps collecting the next batch.
+        self.executor = executor
+        self._in_flight = threading.BoundedSemaphore(max(max_in_flight, 1))
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts the background worker thread (idempotent)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="inference-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the worker thread after the clips already queued have been processed."""
+        self._stopped.set()
+        self._queue.put(None) # Wake the worker up if it is idle
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, waveform):
+        """
+        Queues a 1-D waveform (16 kHz) for classification.
+        Returns a Future that resolves to the result batch_fn produced for this clip.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("Inference engine has been stopped.")
+        future = Future()
+        self._queue.put((waveform, future, time.perf_counter()))
+        return future
+
+    def classify(self, waveform, timeout=None):
+        """Blocking helper: submits a clip and waits for its result."""
+        return self.submit(waveform).result(timeout=timeout)
+
+    # --- Worker loop ---
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                if self._stopped.is_set() and self._queue.empty():
+                    return
+                continue
+
+            # Wait for a free slot first, so clips keep queueing (and batches fill up) while busy
+            self._in_flight.acquire()
+            batch = [item]
+            deadline = item[2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None) # Keep the stop signal for the outer loop
+                    break
+                batch.append(nxt)
+
+            self._process(batch)
+
+    def _process(self, batch):
+        # Drop clips whose caller cancelled the Future while it was queued
+        pending = [(waveform, future) for waveform, future, _ in batch if future.set_running_or_notify_cancel()]
+        if not pending:
+            self._in_flight.release()
+            return
+        waveforms = [waveform for waveform, _ in pending]
+        futures = [future for _, future in pending]
+
+        audio_seconds = sum(int(w.shape[-1]) for w in waveforms) / SAMPLE_RATE
+        started = time.perf_counter()
+        try:
+            wavs, wav_lens = pad_waveforms(waveforms)
+            if self.executor is None:
+                self._complete(futures, self.batch_fn(wavs, wav_lens), None, started, audio_seconds)
+            else:
+                batch_future = self.executor.submit(self.batch_fn, wavs, wav_lens)
+                batch_future.add_done_callback(
+                    lambda f: self._complete(futures, None if f.exception() else f.result(), f.exception(),
+                                             started, audio_seconds)
+                )
+        except Exception as e:
+            self._complete(futures, None, e, started, audio_seconds)
+
+    def _complete(self, futures, results, error, started=None, audio_seconds=0.0):
+        """Routes each row of a finished batch back to its clip's Future and frees the in-flight slot."""
+        self._in_flight.release()
+        if error is None and len(results) != len(futures):
+            error = RuntimeError(f"Batch function returned {len(results)} result(s) for {len(futures)} clip(s).")
+        if error is None and started is not None:
+            metrics.INFERENCE_BATCH_SIZE.observe(len(futures))
+            if audio_seconds > 0:
+                metrics.INFERENCE_RTF.observe((time.perf_counter() - started) / audio_seconds)
+        if error is not None:
+            for future in futures:
+                future.set_exception(error)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+# --- Process-pool configuration (overridable through environment variables) ---
+# Number of inference worker processes; 0 runs inference inside the web process.
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+# torch intra-op threads per worker; 0 splits the machine's cores evenly between workers.
+INFERENCE_WORKER_THREADS = int(os.environ.get('INFERENCE_WORKER_THREADS', 0))
+
+
+def _to_numpy(value):
+    """Recursively converts tensors to numpy arrays so results cross the process boundary as plain pickles."""
+    import torch
+    if isinstance(value, torch.Tensor):
+        return value.detach().cpu().numpy()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_numpy(v) for v in value)
+    return value
+
+
+def _to_torch(value):
+    import torch
+    if isinstance(value, np.ndarray):
+        return torch.from_numpy(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_torch(v) for v in value)
+    return value
+
+
+def _init_worker(num_threads, setup, setup_args):
+    """Runs once in every worker process: gives it its own torch thread budget, then loads its model."""
+    import torch
+    torch.set_num_threads(num_threads)
+    if setup is not None:
+        setup(*setup_args)
+
+
+def _call_in_worker(batch_fn, wavs, wav_lens):
+    """Executes batch_fn inside a worker process, on the model its setup function loaded."""
+    import torch
+    with torch.inference_mode():
+        results = batch_fn(torch.from_numpy(wavs), torch.from_numpy(wav_lens))
+    return _to_numpy(results)
+
+
+class InferenceProcessPool:
+    """
+    Pool of inference worker processes, started through a fork server.
+
+    The fork server is a fresh, single-threaded interpreter, so workers never inherit the web
+    process's threads (and the locks they may hold) or torch's OpenMP/MKL thread pools, which
+    do not survive a fork. Each worker loads the model itself by calling setup(*setup_args);
+    with MODEL_SOURCE=snapshot the weights are memory-mapped, so all workers share them
+    through the page cache. If a worker dies, the pool is replaced on the next submission.
+    submit() has the Executor signature expected by BatchInferenceEngine and returns results
+    as tensors again.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, threads_per_worker=INFERENCE_WORKER_THREADS,
+                 setup=None, setup_args=()):
+        self.workers = max(workers, 1)
+        self.threads_per_worker = threads_per_worker or max((os.cpu_count() or 1) // self.workers, 1)
+        self.setup = setup
+        self.setup_args = setup_args
+        self.restarts = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _new_pool(self):
+        context = multiprocessing.get_context('forkserver')
+        # Imported once in the fork server, so every worker starts with them already loaded
+        context.set_forkserver_preload(['torch'] + ([self.setup.__module__] if self.setup else []))
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, self.setup, self.setup_args),
+        )
+
+    def start(self):
+        """Starts all workers now (rather than on the first request) and waits until they have loaded their model."""
+        self._pool = self._new_pool()
+        # One process is started per submission while none is idle, so this starts them all
+        for future in [self._pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        return self
+
+    def _submit(self, fn, *args):
+        pool = self._pool
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._pool is pool:
+                    print("Inference worker pool is broken (a worker died); starting new workers.")
+                    pool.shutdown(wait=False)
+                    self._pool = self._new_pool()
+                    self.restarts += 1
+            return self._pool.submit(fn, *args)
+
+    def submit(self, batch_fn, wavs, wav_lens):
+        result = Future()
+        worker_future = self._submit(_call_in_worker, batch_fn, wavs.numpy(), wav_lens.numpy())
+
+        def _done(f):
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                result.set_result(_to_torch(f.result()))
+
+        worker_future.add_done_callback(_done)
+        return result
+
+    def worker_pids(self):
+        return list(self._pool._processes) if self._pool is not None else []
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (seconds) shared by the stage histograms
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(dict(key))} {_format_value(v)}" for key, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._series.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Metric whose samples are computed at scrape time: fn() returns [(labels dict, value), ...]."""
+
+    def __init__(self, name, documentation, type_name, fn):
+        super().__init__(name, documentation)
+        self.type_name = type_name
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            samples = self.fn()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+                for labels, value in samples if value is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def _process_memory():
+    """Resident set size of this process in bytes (Linux /proc)."""
+    with open("/proc/self/statm") as f:
+        return [({}, int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))]
+
+
+# --- Application metrics (one registry per process) ---
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "accent_stage_duration_seconds",
+    "Duration of each pipeline stage (queue_wait, download, extract, decode, acquire, upload, classify, progressive,"
+    " ingest, model_load, total)."))
+BYTES_DOWNLOADED = REGISTRY.register(Counter(
+    "accent_downloaded_bytes_total", "Media bytes downloaded (streamed or to disk)."))
+DOWNLOADS_REJECTED = REGISTRY.register(Counter(
+    "accent_downloads_rejected_total", "Downloads refused or stopped by a limit (host_busy, max_bytes, quota)."))
+AUDIO_SECONDS_DECODED = REGISTRY.register(Counter(
+    "accent_audio_decoded_seconds_total", "Seconds of audio decoded to PCM."))
+INFERENCE_RTF = REGISTRY.register(Histogram(
+    "accent_inference_real_time_factor",
+    "Inference time divided by the duration of the audio in the batch (lower is faster).",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)))
+INFERENCE_BATCH_SIZE = REGISTRY.register(Histogram(
+    "accent_inference_batch_size", "Number of clips per inference forward pass.",
+    buckets=(1, 2, 4, 8, 16, 32, 64)))
+TASKS = REGISTRY.register(Counter(
+    "accent_tasks_total", "Finished analysis tasks by outcome (completed, error, cached)."))
+BYTES_RECEIVED = REGISTRY.register(Counter(
+    "accent_received_bytes_total", "Media and PCM bytes received in request bodies (upload, pcm)."))
+INGEST_ESTIMATE_SECONDS = REGISTRY.register(Histogram(
+    "accent_ingest_estimate_latency_seconds",
+    "Time from the last audio of a block arriving on /ingest to its rolling estimate being published.",
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)))
+WEBHOOK_DELIVERIES = REGISTRY.register(Counter(
+    "accent_webhook_deliveries_total", "Webhook delivery attempts by outcome (delivered, retried, failed)."))
+REGISTRY.register(CallbackMetric(
+    "process_resident_memory_bytes", "Resident memory size of this process.", "gauge", _process_memory))
+
+
+def register_callback(name, documentation, type_name, fn):
+    """Registers a metric computed at scrape time (e.g. cache counters, queue depth)."""
+    return REGISTRY.register(CallbackMetric(name, documentation, type_name, fn))
+
+
+def render():
+    return REGISTRY.render()
+
+
+@contextmanager
+def stage(name, timings=None):
+    """
+    Times a pipeline stage into accent_stage_duration_seconds and, when a dict is given,
+    also records it there (used for the per-task timing breakdown).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0) + elapsed, 4)
@@ -0,0 +1,60 @@
+"""
+Single-file snapshot of the accent model for fast, offline startup (MODEL_SOURCE=snapshot).
+
+The architecture is built from MODEL_DIR/hyperparams.yaml with the hub pretrainer disabled,
+and the weights come from one state_dict file that is memory-mapped rather than read and
+copied, so loading touches neither the Hugging Face Hub nor its cache. Forked inference
+workers share the mapped pages too.
+
+Create (or refresh) the snapshot once, with hub access, from the repository root:
+    python model_snapshot.py
+"""
+import os
+import tempfile
+
+import torch
+from hyperpyyaml import load_hyperpyyaml
+from speechbrain.inference.classifiers import EncoderClassifier
+
+
+def save_snapshot(classifier, path):
+    """Writes the classifier's weights and label order to `path` (atomically)."""
+    label_encoder = classifier.hparams.label_encoder
+    labels = [label_encoder.ind2lab[i] for i in range(len(label_encoder))]
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # A unique temporary file, so processes creating the snapshot at the same time do not clash
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        torch.save({"state_dict": classifier.mods.state_dict(), "labels": labels}, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_snapshot(path, model_dir):
+    """Builds an EncoderClassifier from model_dir/hyperparams.yaml and the snapshot at `path`."""
+    with open(os.path.join(model_dir, "hyperparams.yaml")) as f:
+        hparams = load_hyperpyyaml(f, overrides={"pretrainer": None})
+    snapshot = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+    label_encoder = hparams["label_encoder"]
+    label_encoder.update_from_iterable(snapshot["labels"])
+    label_encoder.expect_len(len(snapshot["labels"]))
+
+    classifier = EncoderClassifier(modules=hparams["modules"], hparams=hparams)
+    # assign=True keeps the memory-mapped tensors instead of copying them into fresh parameters
+    classifier.mods.load_state_dict(snapshot["state_dict"], assign=True)
+    classifier.mods.eval()
+    return classifier
+
+
+if __name__ == '__main__':
+    import accent_analysis
+
+    classifier = accent_analysis.load_classifier('hub')
+    save_snapshot(classifier, accent_analysis.MODEL_SNAPSHOT_PATH)
+    print(f"Model snapshot written to {accent_analysis.MODEL_SNAPSHOT_PATH} "
+          f"({os.path.getsize(accent_analysis.MODEL_SNAPSHOT_PATH) / 1e6:.1f} MB).")
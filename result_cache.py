@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+# --- Cache configuration (overridable through environment variables) ---
+RESULT_CACHE_DB = os.environ.get('RESULT_CACHE_DB', os.path.join(os.getcwd(), 'result_cache.sqlite3'))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 10000))
+
+# Query parameters that never change which media a URL points to
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid',
+    'si', 'feature', 'ref', 'ref_src', 'ref_url', 'pp', 'ab_channel',
+}
+YOUTUBE_HOSTS = {
+    'youtube.com', 'm.youtube.com', 'music.youtube.com',
+    'youtube-nocookie.com', 'youtu.be',
+}
+
+
+def _youtube_video_id(host, path, query):
+    """Extracts the canonical video ID from any of the common YouTube URL shapes."""
+    if host == 'youtu.be':
+        return path.strip('/').split('/')[0] or None
+    if path == '/watch':
+        return dict(query).get('v')
+    for prefix in ('/shorts/', '/embed/', '/live/', '/v/'):
+        if path.startswith(prefix):
+            return path[len(prefix):].split('/')[0] or None
+    return None
+
+
+def normalize_video_url(video_url):
+    """
+    Normalizes a video URL so that equivalent links share one cache key.
+    YouTube links collapse to 'youtube:<video id>'; other URLs lose tracking
+    parameters, fragments and trailing slashes, and get sorted query strings.
+    """
+    parts = urlsplit(video_url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = parse_qsl(parts.query, keep_blank_values=True)
+
+    if host in YOUTUBE_HOSTS:
+        video_id = _youtube_video_id(host, parts.path, query)
+        if video_id:
+            return f"youtube:{video_id}"
+
+    query = sorted(
+        (key, value) for key, value in query
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith('utm_')
+    )
+    netloc = host if parts.port is None else f"{host}:{parts.port}"
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(((parts.scheme or 'https').lower(), netloc, path, urlencode(query), ''))
+
+
+def audio_fingerprint(pcm):
+    """
+    Content hash of decoded 16 kHz PCM. Samples are quantised to 16 bit first,
+    so tiny float differences between decodes of the same audio don't change the key.
+    """
+    samples = np.clip(np.asarray(pcm, dtype=np.float32).reshape(-1), -1.0, 1.0)
+    return hashlib.sha256((samples * 32767).astype('<i2').tobytes()).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent SQLite cache of completed analysis results.
+
+    Entries are keyed either by normalized video URL ('url:' keys, checked before
+    downloading anything) or by audio fingerprint ('audio:' keys, checked after decoding).
+    Entries older than ttl_seconds are ignored and evicted; beyond max_entries the
+    least recently used entries are evicted first.
+    """
+
+    def __init__(self, db_path=RESULT_CACHE_DB, ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+                 max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = {'url': 0, 'audio': 0}
+        self.misses = {'url': 0, 'audio': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " source TEXT,"
+                " result TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " hit_count INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    # --- Lookups ---
+    def get_by_url(self, video_url):
+        return self._get('url', normalize_video_url(video_url))
+
+    def get_by_audio(self, fingerprint):
+        return self._get('audio', fingerprint)
+
+    def _get(self, kind, value):
+        key = f"{kind}:{value}"
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result FROM results WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                self.misses[kind] += 1
+                return None
+            self._conn.execute(
+                "UPDATE results SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?", (now, key)
+            )
+            self.hits[kind] += 1
+        return json.loads(row[0])
+
+    # --- Stores ---
+    def put(self, result, video_url=None, fingerprint=None):
+        """Stores a result under its URL key and/or audio fingerprint key, then applies eviction."""
+        now = time.time()
+        payload = json.dumps(result)
+        rows = []
+        if video_url:
+            rows.append((f"url:{normalize_video_url(video_url)}", 'url', video_url, payload, now, now))
+        if fingerprint:
+            rows.append((f"audio:{fingerprint}", 'audio', video_url, payload, now, now))
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (key, kind, source, result, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._evict_locked(now)
+
+    def evict(self):
+        """Removes expired entries and trims the cache to max_entries. Returns the number removed."""
+        with self._lock, self._conn:
+            return self._evict_locked(time.time())
+
+    def _evict_locked(self, now):
+        removed = self._conn.execute(
+            "DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.max_entries:
+            removed += self._conn.execute(
+                "DELETE FROM results WHERE key IN"
+                " (SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,),
+            ).rowcount
+        return removed
+
+    # --- Administration ---
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+            hits = sum(self.hits.values())
+            lookups = hits + sum(self.misses.values())
+            return {
+                "entries": count,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+            }
+
+    def entries(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, kind, source, result, created_at, last_access, hit_count"
+                " FROM results ORDER BY last_access DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {
+                "key": key, "kind": kind, "source": source, "result": json.loads(result),
+                "created_at": created_at, "last_access": last_access, "hit_count": hit_count,
+            }
+            for key, kind, source, result, created_at, last_access, hit_count in rows
+        ]
+
+    def purge(self, key=None):
+        """Deletes one entry (by full key, e.g. 'url:youtube:abc') or every entry. Returns the number removed."""
+        with self._lock, self._conn:
+            if key is None:
+                return self._conn.execute("DELETE FROM results").rowcount
+            return self._conn.execute("DELETE FROM results WHERE key = ?", (key,)).rowcount
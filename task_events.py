@@ -0,0 +1,301 @@
+"""
+Pushes task progress to waiting clients as server-sent events (text/event-stream), so they
+do not have to poll /status.
+
+One watcher thread per process reads the task store for the tasks that currently have
+listeners, with one query per EVENTS_POLL_SECONDS however many listeners there are, and
+hands each change to them. The task state lives in the shared task store, so any worker
+can stream any task.
+
+Streams are served in two ways:
+
+- EventStreamServer, an asyncio listener on EVENTS_PORT (on by default): every stream is a
+  coroutine on a single thread, so thousands of idle clients cost a socket and a few KB each.
+  Responses' events_url points here.
+- /events/<task_id> on the Flask app, a fallback for clients that cannot reach EVENTS_PORT:
+  every open stream holds one of the worker's threads, so only a few (EVENTS_MAX_STREAMS)
+  are open per process at a time.
+"""
+import asyncio
+import itertools
+import json
+import os
+import queue
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from task_store import TERMINAL_STATES
+
+# --- Event stream configuration (overridable through environment variables) ---
+EVENTS_POLL_SECONDS = float(os.environ.get('EVENTS_POLL_SECONDS', 0.5))
+# A comment line is sent after this long without an event, so proxies keep the stream open
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', 15))
+# Streams open at once on the fallback Flask /events route (each holds a thread) per process. The
+# default is an eighth of the server's threads (WEB_THREADS, gunicorn's --threads), so idle streams
+# cannot starve /analyze, /status and /readyz
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', max(WEB_THREADS // 8, 1)))
+# Port of the asyncio event stream listener (0 = disabled); every gunicorn worker listens on it
+EVENTS_PORT = int(os.environ.get('EVENTS_PORT', 5001))
+# Base URL clients reach the listener at (e.g. behind a TLS proxy); default http://<request host>:EVENTS_PORT
+EVENTS_PUBLIC_URL = os.environ.get('EVENTS_PUBLIC_URL', '')
+EVENTS_MAX_CONNECTIONS = int(os.environ.get('EVENTS_MAX_CONNECTIONS', 10000))
+# Access-Control-Allow-Origin of the asyncio listener (it is a different origin than the app)
+EVENTS_ALLOW_ORIGIN = os.environ.get('EVENTS_ALLOW_ORIGIN', '*')
+
+# Browsers' EventSource reconnects this long (ms) after a dropped stream
+_RETRY_MS = 3000
+_EVENTS_PATH = re.compile(r'/events/([A-Za-z0-9-]{1,64})')
+_MISSING = object()
+_REASONS = {200: "OK", 204: "No Content", 404: "Not Found", 503: "Service Unavailable"}
+
+
+def format_event(event, data, event_id=None):
+    """One server-sent event with a JSON data line."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+def task_event(task, render):
+    """
+    The event for a task record: 'stage' while it runs, 'result' once it is finished, 'expired'
+    if it no longer exists. Returns (message, event id, whether the stream ends with it).
+    render(task) builds the data (the same JSON /status returns).
+    """
+    if task is None:
+        return format_event('expired', {"status": "error", "message": "Unknown or expired task ID."}), None, True
+    event_id = repr(task["updated_at"])
+    terminal = task["state"] in TERMINAL_STATES
+    return format_event('result' if terminal else 'stage', render(task), event_id), event_id, terminal
+
+
+def already_delivered(task, last_event_id):
+    """True if a reconnecting client (Last-Event-ID) has already received this finished task's result."""
+    return task is not None and task["state"] in TERMINAL_STATES and last_event_id == repr(task["updated_at"])
+
+
+class TaskEventHub:
+    """Calls listeners back whenever a watched task's record changes in the task store."""
+
+    def __init__(self, task_store, poll_interval=EVENTS_POLL_SECONDS):
+        self.task_store = task_store
+        self.poll_interval = poll_interval
+        self._listeners = {} # task_id -> {token: callback}
+        self._versions = {} # task_id -> updated_at last handed to its listeners (None once gone)
+        self._lock = threading.Lock()
+        self._tokens = itertools.count()
+        self._watcher_thread = None
+
+    def listener_count(self):
+        with self._lock:
+            return sum(len(listeners) for listeners in self._listeners.values())
+
+    def subscribe(self, task_id, callback):
+        """
+        Calls callback(task) with the current record right away and then from the watcher
+        thread after every change (with None once the task is gone). Callbacks must return
+        quickly (e.g. put the record on a queue). Returns a token for unsubscribe.
+        """
+        task = self.task_store.get(task_id)
+        token = next(self._tokens)
+        with self._lock:
+            self._listeners.setdefault(task_id, {})[token] = callback
+            self._versions.setdefault(task_id, task["updated_at"] if task else None)
+        callback(task)
+        self._start_watcher()
+        return token
+
+    def unsubscribe(self, task_id, token):
+        with self._lock:
+            listeners = self._listeners.get(task_id, {})
+            listeners.pop(token, None)
+            if not listeners:
+                self._listeners.pop(task_id, None)
+                self._versions.pop(task_id, None)
+
+    def poll(self):
+        """Reads the watched tasks' versions once and notifies the listeners of changed ones."""
+        with self._lock:
+            task_ids = list(self._listeners)
+        if not task_ids:
+            return
+        versions = self.task_store.versions(task_ids)
+        for task_id in task_ids:
+            version = versions.get(task_id)
+            with self._lock:
+                if self._versions.get(task_id, _MISSING) in (version, _MISSING):
+                    continue # Unchanged, or unsubscribed meanwhile
+            task = self.task_store.get(task_id) if version is not None else None
+            with self._lock:
+                self._versions[task_id] = task["updated_at"] if task else None
+                callbacks = list(self._listeners.get(task_id, {}).values())
+            for callback in callbacks:
+                callback(task)
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher_thread is not None:
+                return
+            self._watcher_thread = threading.Thread(target=self._watch, name="task-event-watcher", daemon=True)
+        self._watcher_thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Task events: watcher poll failed: {e}")
+
+
+def stream_task_events(hub, task_id, render, last_event_id=None, heartbeat=EVENTS_HEARTBEAT_SECONDS):
+    """
+    Server-sent events for one task as a generator of strings (for a streaming Flask response).
+    It ends after the final result; closing it early unsubscribes from the hub.
+    """
+    updates = queue.Queue()
+    token = hub.subscribe(task_id, updates.put)
+    try:
+        yield f"retry: {_RETRY_MS}\n\n"
+        while True:
+            try:
+                task = updates.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            message, event_id, final = task_event(task, render)
+            if event_id is None or event_id != last_event_id:
+                yield message
+                last_event_id = event_id
+            if final:
+                return
+    finally:
+        hub.unsubscribe(task_id, token)
+
+
+class EventStreamServer:
+    """
+    Serves GET /events/<task_id> as server-sent events from an asyncio event loop on one
+    daemon thread, with the same events as the Flask route. Waiting clients are coroutines
+    rather than threads. The socket is bound with SO_REUSEPORT, so every gunicorn worker
+    can listen on the same port and the kernel spreads connections between them.
+    """
+
+    def __init__(self, hub, render, host='0.0.0.0', port=EVENTS_PORT, max_connections=EVENTS_MAX_CONNECTIONS,
+                 heartbeat=EVENTS_HEARTBEAT_SECONDS, allow_origin=EVENTS_ALLOW_ORIGIN):
+        self.hub = hub
+        self.render = render
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.heartbeat = heartbeat
+        self.allow_origin = allow_origin
+        self.active_streams = 0
+        self._loop = None
+
+    def start(self):
+        """Starts listening on a daemon thread; returns itself once the socket is bound (self.port is then set)."""
+        started = threading.Event()
+        errors = []
+        thread = threading.Thread(target=self._run, args=(started, errors), name="event-stream-server", daemon=True)
+        thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def _run(self, started, errors):
+        self._loop = asyncio.new_event_loop()
+        try:
+            server = self._loop.run_until_complete(asyncio.start_server(
+                self._handle, self.host, self.port, reuse_port=hasattr(socket, 'SO_REUSEPORT'), backlog=1024))
+        except Exception as e:
+            errors.append(e)
+            started.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            match = _EVENTS_PATH.fullmatch(urlsplit(parts[1]).path) if len(parts) == 3 else None
+            if not match or parts[0] not in ('GET', 'OPTIONS'):
+                await self._respond(writer, 404, {"status": "error", "message": "Not found."})
+            elif parts[0] == 'OPTIONS':
+                await self._respond(writer, 204, None, {"Access-Control-Allow-Headers": "Last-Event-ID"})
+            elif self.active_streams >= self.max_connections:
+                await self._respond(writer, 503, {"status": "error", "message": "Too many event streams."},
+                                    {"Retry-After": "5"})
+            else:
+                self.active_streams += 1
+                try:
+                    await self._stream(writer, match[1], headers.get('last-event-id'))
+                finally:
+                    self.active_streams -= 1
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            pass # Slow, malformed or vanished client
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, data, headers=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json",
+                 f"Content-Length: {len(body)}", f"Access-Control-Allow-Origin: {self.allow_origin}",
+                 "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _stream(self, writer, task_id, last_event_id):
+        loop = asyncio.get_running_loop()
+        updates = asyncio.Queue()
+        # subscribe() reads the task store, so it runs off the event loop
+        token = await loop.run_in_executor(
+            None, self.hub.subscribe, task_id, lambda task: loop.call_soon_threadsafe(updates.put_nowait, task))
+        try:
+            task = await updates.get()
+            if task is None:
+                return await self._respond(writer, 404, {"status": "error", "message": "Unknown or expired task ID."})
+            if already_delivered(task, last_event_id):
+                return await self._respond(writer, 204, None) # Tells EventSource to stop reconnecting
+            writer.write((
+                "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                f"Access-Control-Allow-Origin: {self.allow_origin}\r\nConnection: close\r\n\r\n"
+                f"retry: {_RETRY_MS}\n\n"
+            ).encode('latin-1'))
+            while True:
+                message, event_id, final = task_event(task, self.render)
+                if event_id is None or event_id != last_event_id:
+                    writer.write(message.encode())
+                    last_event_id = event_id
+                await writer.drain()
+                if final:
+                    return
+                while True:
+                    try:
+                        task = await asyncio.wait_for(updates.get(), self.heartbeat)
+                        break
+                    except asyncio.TimeoutError:
+                        writer.write(b": keep-alive\n\n")
+                        await writer.drain()
+        finally:
+            self.hub.unsubscribe(task_id, token)
+
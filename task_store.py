@@ -0,0 +1,444 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError: # Only needed for redis:// task stores
+    redis = None
+
+# --- Task store configuration (overridable through environment variables) ---
+# sqlite:///<path> (default) or redis://host:port/db
+TASK_STORE_URL = os.environ.get('TASK_STORE_URL', f"sqlite:///{os.path.join(os.getcwd(), 'task_store.sqlite3')}")
+# How long finished results stay readable
+TASK_RESULT_TTL_SECONDS = int(os.environ.get('TASK_RESULT_TTL_SECONDS', 3600))
+# Unfinished tasks not updated for this long (e.g. lost in a crash) are evicted too
+TASK_STALE_SECONDS = int(os.environ.get('TASK_STALE_SECONDS', 24 * 3600))
+TASK_EVICTION_INTERVAL_SECONDS = int(os.environ.get('TASK_EVICTION_INTERVAL_SECONDS', 60))
+# Every process refreshes the heartbeat of the unfinished tasks it runs this often...
+TASK_HEARTBEAT_SECONDS = int(os.environ.get('TASK_HEARTBEAT_SECONDS', 15))
+# ...and an unfinished task without a heartbeat for this long is orphaned (its worker crashed, was
+# killed or redeployed, or nobody ever claimed it): it no longer counts toward the queue depth and
+# is marked as an error
+TASK_ORPHAN_SECONDS = int(os.environ.get('TASK_ORPHAN_SECONDS', 60))
+
+# Pipeline states, in order; completed and error are terminal
+QUEUED, DOWNLOADING, EXTRACTING, CLASSIFYING, COMPLETED, ERROR = (
+    'queued', 'downloading', 'extracting', 'classifying', 'completed', 'error'
+)
+TERMINAL_STATES = (COMPLETED, ERROR)
+
+
+class TaskStore:
+    """
+    Interface for task-state backends shared by every web worker.
+
+    A task record is a dict with task_id, state, timestamps (state -> time entered),
+    progress (interim data while running), result (once terminal), created_at and updated_at.
+    Results stay readable (idempotently) until they expire.
+
+    Unfinished tasks also carry a heartbeat, refreshed by the process that runs them (see
+    claim); only tasks with a recent heartbeat count as active, and the others are failed
+    as orphaned.
+    """
+
+    def __init__(self, ttl_seconds=TASK_RESULT_TTL_SECONDS, stale_seconds=TASK_STALE_SECONDS,
+                 orphan_seconds=TASK_ORPHAN_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.orphan_seconds = orphan_seconds
+        self._claimed = set() # Unfinished tasks run by this process
+        self._claimed_lock = threading.Lock()
+        self._eviction_thread = None
+
+    def create(self, task_id, claim=True, **fields):
+        """Records a new queued task, claimed by this process unless claim is False."""
+        raise NotImplementedError
+
+    def create_if_below(self, task_id, max_active, claim=True, **fields):
+        """
+        Like create, but only while fewer than max_active tasks are active (0 = no limit), checked
+        and recorded in one transaction so concurrent submissions cannot overshoot the limit.
+        Returns (created, number of active tasks before this one).
+        """
+        raise NotImplementedError
+
+    def claim(self, task_id):
+        """Makes this process refresh the task's heartbeat until it completes."""
+        with self._claimed_lock:
+            self._claimed.add(task_id)
+        self.heartbeat([task_id])
+
+    def _release(self, task_id):
+        with self._claimed_lock:
+            self._claimed.discard(task_id)
+
+    def heartbeat(self, task_ids):
+        """Refreshes the heartbeat of the given unfinished tasks (updated_at is left alone)."""
+        raise NotImplementedError
+
+    def fail_orphaned(self):
+        """Marks unfinished tasks without a recent heartbeat as errors; returns how many there were."""
+        raise NotImplementedError
+
+    def _orphaned_result(self):
+        return {"status": "error", "message": "The task was abandoned before it finished (its worker stopped, "
+                                              "or a live audio stream was never started). Please resubmit it."}
+
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def set_state(self, task_id, state):
+        raise NotImplementedError
+
+    def set_progress(self, task_id, progress):
+        raise NotImplementedError
+
+    def complete(self, task_id, result):
+        """Stores the final result; the state becomes 'completed' or 'error' from result['status']."""
+        raise NotImplementedError
+
+    def versions(self, task_ids):
+        """updated_at of each of the given tasks that still exists (task_id -> timestamp), in one round trip."""
+        raise NotImplementedError
+
+    def count_active(self):
+        """Number of tasks that are queued or running (with a recent heartbeat)."""
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """Removes expired tasks and returns how many were removed."""
+        raise NotImplementedError
+
+    def _sweep(self):
+        orphaned = self.fail_orphaned()
+        if orphaned:
+            print(f"Task store: marked {orphaned} orphaned task(s) as errors")
+        removed = self.evict_expired()
+        if removed:
+            print(f"Task store: evicted {removed} expired task(s)")
+
+    def start_eviction(self, interval=TASK_EVICTION_INTERVAL_SECONDS, heartbeat_interval=TASK_HEARTBEAT_SECONDS):
+        """
+        On a daemon thread: refreshes the heartbeat of the tasks this process has claimed every
+        `heartbeat_interval` seconds, and every `interval` seconds (and right away, to clean up
+        after a crash) fails orphaned tasks and evicts expired ones.
+        """
+        if self._eviction_thread is not None:
+            return
+
+        def _loop():
+            next_sweep = time.monotonic()
+            while True:
+                try:
+                    with self._claimed_lock:
+                        claimed = list(self._claimed)
+                    if claimed:
+                        self.heartbeat(claimed)
+                    if time.monotonic() >= next_sweep:
+                        next_sweep = time.monotonic() + interval
+                        self._sweep()
+                except Exception as e:
+                    print(f"Task store: maintenance failed: {e}")
+                time.sleep(heartbeat_interval)
+
+        self._eviction_thread = threading.Thread(target=_loop, name="task-store-eviction", daemon=True)
+        self._eviction_thread.start()
+
+
+class SQLiteTaskStore(TaskStore):
+    """Task store in a local SQLite file; safe to share between gunicorn workers on one host."""
+
+    def __init__(self, db_path, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " timestamps TEXT NOT NULL,"
+                " progress TEXT,"
+                " result TEXT,"
+                " fields TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " heartbeat_at REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+            if 'heartbeat_at' not in columns: # Store created before tasks had heartbeats
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN heartbeat_at REAL")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_state_updated ON tasks (state, updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_state_heartbeat ON tasks (state, heartbeat_at)")
+
+    def _insert(self, task_id, fields):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, state, timestamps, fields, created_at, updated_at, heartbeat_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, QUEUED, json.dumps({QUEUED: now}), json.dumps(fields), now, now, now),
+        )
+
+    def _count_active(self):
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE state NOT IN (?, ?) AND COALESCE(heartbeat_at, updated_at) >= ?",
+            (*TERMINAL_STATES, time.time() - self.orphan_seconds)
+        ).fetchone()
+        return count
+
+    def create(self, task_id, claim=True, **fields):
+        with self._lock, self._conn:
+            self._insert(task_id, fields)
+        if claim:
+            self.claim(task_id)
+
+    def create_if_below(self, task_id, max_active, claim=True, **fields):
+        with self._lock, self._conn:
+            # Takes the database's write lock before counting, so no other process can insert in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            active = self._count_active()
+            if max_active > 0 and active >= max_active:
+                return False, active
+            self._insert(task_id, fields)
+        if claim:
+            self.claim(task_id)
+        return True, active
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, timestamps, progress, result, fields, created_at, updated_at"
+                " FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        state, timestamps, progress, result, fields, created_at, updated_at = row
+        return {
+            "task_id": task_id,
+            "state": state,
+            "timestamps": json.loads(timestamps),
+            "progress": json.loads(progress) if progress else None,
+            "result": json.loads(result) if result else None,
+            "fields": json.loads(fields) if fields else {},
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def _update(self, task_id, state=None, **columns):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT timestamps FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return
+            assignments = {"updated_at": now, "heartbeat_at": now, **columns}
+            if state is not None:
+                timestamps = json.loads(row[0])
+                timestamps[state] = now
+                assignments.update(state=state, timestamps=json.dumps(timestamps))
+            sql = ", ".join(f"{column} = ?" for column in assignments)
+            self._conn.execute(f"UPDATE tasks SET {sql} WHERE task_id = ?", (*assignments.values(), task_id))
+
+    def set_state(self, task_id, state):
+        self._update(task_id, state=state)
+
+    def set_progress(self, task_id, progress):
+        self._update(task_id, progress=json.dumps(progress))
+
+    def complete(self, task_id, result):
+        state = COMPLETED if result.get("status") == COMPLETED else ERROR
+        self._update(task_id, state=state, result=json.dumps(result))
+        self._release(task_id)
+
+    def heartbeat(self, task_ids):
+        task_ids = list(task_ids)
+        now = time.time()
+        with self._lock, self._conn:
+            for i in range(0, len(task_ids), 500):
+                chunk = task_ids[i:i + 500]
+                self._conn.execute(
+                    f"UPDATE tasks SET heartbeat_at = ? WHERE task_id IN ({','.join('?' * len(chunk))})"
+                    " AND state NOT IN (?, ?)", (now, *chunk, *TERMINAL_STATES)
+                )
+
+    def fail_orphaned(self):
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT task_id, timestamps FROM tasks WHERE state NOT IN (?, ?)"
+                " AND COALESCE(heartbeat_at, updated_at) < ?", (*TERMINAL_STATES, now - self.orphan_seconds)
+            ).fetchall()
+            for task_id, timestamps in rows:
+                timestamps = dict(json.loads(timestamps), **{ERROR: now})
+                self._conn.execute(
+                    "UPDATE tasks SET state = ?, timestamps = ?, result = ?, updated_at = ?"
+                    " WHERE task_id = ? AND state NOT IN (?, ?)",
+                    (ERROR, json.dumps(timestamps), json.dumps(self._orphaned_result()), now, task_id, *TERMINAL_STATES),
+                )
+        return len(rows)
+
+    def versions(self, task_ids):
+        task_ids = list(task_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(task_ids), 500): # Stay below SQLite's bound-parameter limit
+                chunk = task_ids[i:i + 500]
+                found.update(self._conn.execute(
+                    f"SELECT task_id, updated_at FROM tasks WHERE task_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return found
+
+    def count_active(self):
+        with self._lock:
+            return self._count_active()
+
+    def evict_expired(self):
+        now = time.time()
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM tasks WHERE (state IN (?, ?) AND updated_at < ?) OR updated_at < ?",
+                (*TERMINAL_STATES, now - self.ttl_seconds, now - self.stale_seconds),
+            ).rowcount
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Task store in Redis (or any server speaking the Redis protocol), for workers spread over
+    several hosts. Each task is a hash whose expiry Redis enforces, so evict_expired is a no-op;
+    unfinished tasks are also in a sorted set scored by their last heartbeat.
+    """
+
+    def __init__(self, url, **kwargs):
+        super().__init__(**kwargs)
+        if redis is None:
+            raise RuntimeError("TASK_STORE_URL points to Redis but the 'redis' package is not installed.")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._active_key = "accent:tasks:active"
+        # Counts the active tasks and creates the new one (as create does) in one atomic step
+        self._create_if_below = self._redis.register_script("""
+            local active = redis.call('ZCOUNT', KEYS[1], ARGV[1], '+inf')
+            if tonumber(ARGV[2]) > 0 and active >= tonumber(ARGV[2]) then
+                return {0, active}
+            end
+            redis.call('DEL', KEYS[2])
+            redis.call('HSET', KEYS[2], 'state', ARGV[3], 'timestamps', ARGV[4], 'fields', ARGV[5],
+                       'created_at', ARGV[6], 'updated_at', ARGV[6])
+            redis.call('EXPIRE', KEYS[2], ARGV[7])
+            redis.call('ZADD', KEYS[1], ARGV[6], ARGV[8])
+            return {1, active}
+        """)
+
+    def _key(self, task_id):
+        return f"accent:task:{task_id}"
+
+    def create(self, task_id, claim=True, **fields):
+        now = time.time()
+        with self._redis.pipeline() as pipe:
+            pipe.delete(self._key(task_id))
+            pipe.hset(self._key(task_id), mapping={
+                "state": QUEUED, "timestamps": json.dumps({QUEUED: now}), "fields": json.dumps(fields),
+                "created_at": now, "updated_at": now,
+            })
+            pipe.expire(self._key(task_id), self.stale_seconds)
+            pipe.zadd(self._active_key, {task_id: now})
+            pipe.execute()
+        if claim:
+            self.claim(task_id)
+
+    def create_if_below(self, task_id, max_active, claim=True, **fields):
+        now = time.time()
+        created, active = self._create_if_below(
+            keys=[self._active_key, self._key(task_id)],
+            args=[now - self.orphan_seconds, max_active, QUEUED, json.dumps({QUEUED: now}), json.dumps(fields),
+                  repr(now), self.stale_seconds, task_id],
+        )
+        if created and claim:
+            self.claim(task_id)
+        return bool(created), active
+
+    def get(self, task_id):
+        data = self._redis.hgetall(self._key(task_id))
+        if not data:
+            return None
+        return {
+            "task_id": task_id,
+            "state": data["state"],
+            "timestamps": json.loads(data["timestamps"]),
+            "progress": json.loads(data["progress"]) if data.get("progress") else None,
+            "result": json.loads(data["result"]) if data.get("result") else None,
+            "fields": json.loads(data.get("fields") or "{}"),
+            "created_at": float(data["created_at"]),
+            "updated_at": float(data["updated_at"]),
+        }
+
+    def _update(self, task_id, state=None, ttl=None, **fields):
+        key = self._key(task_id)
+        now = time.time()
+        if not self._redis.exists(key):
+            return
+        mapping = {"updated_at": now, **fields}
+        if state is not None:
+            timestamps = json.loads(self._redis.hget(key, "timestamps") or "{}")
+            timestamps[state] = now
+            mapping.update(state=state, timestamps=json.dumps(timestamps))
+        with self._redis.pipeline() as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, ttl or self.stale_seconds)
+            if state in TERMINAL_STATES:
+                pipe.zrem(self._active_key, task_id)
+            else:
+                pipe.zadd(self._active_key, {task_id: now}, xx=True)
+            pipe.execute()
+
+    def set_state(self, task_id, state):
+        self._update(task_id, state=state)
+
+    def set_progress(self, task_id, progress):
+        self._update(task_id, progress=json.dumps(progress))
+
+    def complete(self, task_id, result):
+        state = COMPLETED if result.get("status") == COMPLETED else ERROR
+        self._update(task_id, state=state, ttl=self.ttl_seconds, result=json.dumps(result))
+        self._release(task_id)
+
+    def heartbeat(self, task_ids):
+        now = time.time()
+        with self._redis.pipeline() as pipe:
+            for task_id in task_ids:
+                pipe.zadd(self._active_key, {task_id: now}, xx=True) # Only while still unfinished
+            pipe.execute()
+
+    def fail_orphaned(self):
+        failed = 0
+        for task_id in self._redis.zrangebyscore(self._active_key, 0, time.time() - self.orphan_seconds):
+            if self._redis.zrem(self._active_key, task_id): # Only one worker fails each task
+                self._update(task_id, state=ERROR, ttl=self.ttl_seconds, result=json.dumps(self._orphaned_result()))
+                failed += 1
+        return failed
+
+    def versions(self, task_ids):
+        task_ids = list(task_ids)
+        with self._redis.pipeline() as pipe:
+            for task_id in task_ids:
+                pipe.hget(self._key(task_id), "updated_at")
+            values = pipe.execute()
+        return {task_id: float(value) for task_id, value in zip(task_ids, values) if value is not None}
+
+    def count_active(self):
+        return self._redis.zcount(self._active_key, time.time() - self.orphan_seconds, '+inf')
+
+    def evict_expired(self):
+        return 0
+
+
+def create_task_store(url=TASK_STORE_URL):
+    """Builds the task store backend selected by TASK_STORE_URL."""
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisTaskStore(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteTaskStore(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported TASK_STORE_URL: {url}")
@@ -0,0 +1,42 @@
+"""
+Shared fixtures: media generated with FFmpeg (benchmarks.fixtures) and served over a local
+HTTP server (benchmarks.media_server), so downloads and decoding run without network access.
+Tests that need them are skipped when ffmpeg or yt-dlp is not on PATH.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import generate_fixtures
+from benchmarks.media_server import serve_directory
+
+# name -> (seconds, with video, moov atom at the front)
+MEDIA_FIXTURES = {
+    "audio_20s.m4a": (20, False, True),
+    "audio_60s.m4a": (60, False, True),
+    "video_10s_moov_end.mp4": (10, True, False), # Not streamable from a pipe
+}
+
+
+@pytest.fixture(scope='session')
+def media_dir(tmp_path_factory):
+    if not (shutil.which('ffmpeg') and shutil.which('yt-dlp')):
+        pytest.skip("ffmpeg and yt-dlp are needed on PATH")
+    directory = str(tmp_path_factory.mktemp("media"))
+    generate_fixtures(directory, MEDIA_FIXTURES)
+    return directory
+
+
+@pytest.fixture
+def media_server(media_dir):
+    """(base URL, request stats) of a server for media_dir, fresh for each test."""
+    stats = {}
+    with serve_directory(media_dir, stats=stats) as base_url:
+        yield base_url, stats
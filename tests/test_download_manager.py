@@ -0,0 +1,150 @@
+import os
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+from download_manager import DownloadManager, DownloadLimitError, host_slot
+from video_processing import STREAM_AUDIO_FORMAT
+
+
+def _download(manager, url):
+    """A download_audio-style download; returns (returncode, output path)."""
+    output_path = os.path.join(manager.temp_dir, f"audio_{uuid.uuid4()}.media")
+    command = ['yt-dlp', '-f', STREAM_AUDIO_FORMAT, '-o', output_path, '--no-playlist',
+               '--no-part', '--quiet', '--no-warnings', url]
+    returncode, _ = manager.download(url, command, output_path, "test")
+    return returncode, output_path
+
+
+def _slow_writer(output_path, chunks, chunk_bytes=100000):
+    """A stand-in for yt-dlp that grows output_path by chunk_bytes every 50 ms, for the watchdog."""
+    script = (f"import time\nf = open({output_path!r}, 'wb')\n"
+              f"for _ in range({chunks}):\n    f.write(b'x' * {chunk_bytes}); f.flush(); time.sleep(0.05)")
+    return [sys.executable, '-c', script]
+
+
+def _files(directory):
+    return sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name)))
+
+
+# --- Per-host download slots ---
+def test_host_slot_times_out_when_the_host_is_busy():
+    url = f"http://busy-{uuid.uuid4().hex}.test/media"
+    with host_slot(url, max_per_host=1):
+        waiter = {}
+
+        def _wait():
+            try:
+                with host_slot(url, max_per_host=1, timeout=0.2):
+                    waiter["outcome"] = "got a slot"
+            except DownloadLimitError:
+                waiter["outcome"] = "timed out"
+
+        thread = threading.Thread(target=_wait)
+        thread.start()
+        thread.join()
+        assert waiter["outcome"] == "timed out"
+        # The thread holding the slot reuses it (e.g. the file fallback after a failed stream)
+        with host_slot(url, max_per_host=1, timeout=0.2):
+            pass
+
+
+def test_downloads_per_host_are_capped(media_server, tmp_path):
+    base_url, stats = media_server
+    manager = DownloadManager(str(tmp_path), max_seconds=0, max_per_host=2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(_download(manager, f"{base_url}/audio_20s.m4a")))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [returncode for returncode, _ in results] == [0] * 5
+    assert 1 <= stats["peak_concurrency"] <= 2
+
+
+# --- Byte and duration limits ---
+def test_section_download_fetches_only_the_first_seconds(media_server, media_dir, tmp_path):
+    base_url, _ = media_server
+    returncode, output_path = _download(DownloadManager(str(tmp_path), max_seconds=5), f"{base_url}/audio_60s.m4a")
+    assert returncode == 0
+    assert 0 < os.path.getsize(output_path) < os.path.getsize(os.path.join(media_dir, "audio_60s.m4a")) / 4
+
+
+def test_whole_file_over_the_byte_limit_is_refused(media_server, media_dir, tmp_path):
+    base_url, _ = media_server
+    size = os.path.getsize(os.path.join(media_dir, "audio_60s.m4a"))
+    manager = DownloadManager(str(tmp_path), max_seconds=0, max_bytes=size // 2)
+    with pytest.raises(DownloadLimitError):
+        _download(manager, f"{base_url}/audio_60s.m4a")
+    assert _files(tmp_path) == []
+
+
+def test_watchdog_stops_a_download_past_the_byte_limit(tmp_path):
+    manager = DownloadManager(str(tmp_path), max_seconds=0, max_bytes=300000, quota_bytes=0)
+    output_path = os.path.join(str(tmp_path), "audio_slow.media")
+    start = time.monotonic()
+    with pytest.raises(DownloadLimitError, match="byte limit"):
+        manager.download("http://slow.test/media", _slow_writer(output_path, 100), output_path, "test")
+    assert time.monotonic() - start < 4 # Stopped long before the 5 s the writer would take
+    assert _files(tmp_path) == []
+
+
+# --- Disk quota and janitor ---
+def test_download_is_refused_while_the_temp_dir_is_over_quota(media_server, tmp_path):
+    base_url, stats = media_server
+    manager = DownloadManager(str(tmp_path), max_seconds=0, quota_bytes=5000000) # Well above one clip
+    filler = os.path.join(str(tmp_path), "orphaned.media")
+    with open(filler, 'wb') as f:
+        f.truncate(6000000)
+    with pytest.raises(DownloadLimitError, match="quota"):
+        _download(manager, f"{base_url}/audio_20s.m4a")
+    assert stats["requests"] == 0
+
+    # Once the file is stale, the janitor sweep on the refused path frees the space
+    stale = time.time() - 2 * manager.max_file_age
+    os.utime(filler, (stale, stale))
+    returncode, output_path = _download(manager, f"{base_url}/audio_20s.m4a")
+    assert returncode == 0 and os.path.exists(output_path)
+    assert not os.path.exists(filler)
+
+
+def test_watchdog_stops_a_download_that_fills_the_quota(tmp_path):
+    manager = DownloadManager(str(tmp_path), max_seconds=0, max_bytes=0, quota_bytes=500000)
+    with open(os.path.join(str(tmp_path), "fresh.media"), 'wb') as f:
+        f.truncate(200000)
+    output_path = os.path.join(str(tmp_path), "audio_slow.media")
+    with pytest.raises(DownloadLimitError, match="quota"):
+        manager.download("http://slow.test/media", _slow_writer(output_path, 100), output_path, "test")
+    assert _files(tmp_path) == ["fresh.media"]
+    assert manager.usage() == 200000
+
+
+def test_usage_counts_finished_downloads_until_the_next_walk(tmp_path):
+    manager = DownloadManager(str(tmp_path), max_seconds=0, max_bytes=0, quota_bytes=0,
+                              usage_refresh_seconds=3600)
+    assert manager.usage() == 0
+    output_path = os.path.join(str(tmp_path), "audio_slow.media")
+    manager.download("http://slow.test/media", _slow_writer(output_path, 3), output_path, "test")
+    assert manager.usage() == 300000
+    os.remove(output_path)
+    manager.refresh_usage()
+    assert manager.usage() == 0
+
+
+def test_janitor_sweep_removes_only_stale_top_level_files(tmp_path):
+    manager = DownloadManager(str(tmp_path))
+    stale = time.time() - 2 * manager.max_file_age
+    os.makedirs(os.path.join(str(tmp_path), "batch_jobs"))
+    for name in ("stale_1.media", "stale_2.media.part", "fresh.media", os.path.join("batch_jobs", "old.jsonl")):
+        path = os.path.join(str(tmp_path), name)
+        with open(path, 'wb') as f:
+            f.write(b"\0" * 1024)
+        if not name.startswith("fresh"):
+            os.utime(path, (stale, stale))
+    assert manager.sweep() == 2
+    assert _files(tmp_path) == ["fresh.media"]
+    assert os.listdir(os.path.join(str(tmp_path), "batch_jobs")) == ["old.jsonl"]
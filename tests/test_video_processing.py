@@ -0,0 +1,50 @@
+import os
+
+from video_processing import SAMPLE_RATE, acquire_audio, decode_audio, stream_audio
+
+
+def _seconds(pcm):
+    return pcm.size / SAMPLE_RATE
+
+
+def test_stream_audio_decodes_a_streamable_file_in_memory(media_server):
+    base_url, _ = media_server
+    pcm, error = stream_audio(f"{base_url}/audio_20s.m4a", "test")
+    assert error is None
+    assert pcm.dtype.name == 'float32'
+    assert abs(_seconds(pcm) - 20) < 0.5
+
+
+def test_stream_audio_reports_a_file_with_the_moov_atom_at_the_end(media_server):
+    base_url, _ = media_server
+    pcm, error = stream_audio(f"{base_url}/video_10s_moov_end.mp4", "test")
+    assert pcm is None
+    assert error
+
+
+def test_acquire_audio_falls_back_to_a_file_download_for_moov_at_end(media_server, tmp_path):
+    base_url, _ = media_server
+    pcm, error = acquire_audio(f"{base_url}/video_10s_moov_end.mp4", "test", str(tmp_path))
+    assert error is None
+    assert abs(_seconds(pcm) - 10) < 0.5
+    assert os.listdir(str(tmp_path)) == [] # The download is removed once decoded
+
+
+def test_acquire_audio_reports_both_failures(media_server, tmp_path):
+    base_url, _ = media_server
+    pcm, error = acquire_audio(f"{base_url}/missing.mp4", "test", str(tmp_path))
+    assert pcm is None
+    assert "streaming also failed" in error
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_decode_audio_decodes_a_local_file(media_dir):
+    pcm, error = decode_audio(os.path.join(media_dir, "audio_20s.m4a"), "test")
+    assert error is None
+    assert abs(_seconds(pcm) - 20) < 0.5
+
+
+def test_decode_audio_returns_an_error_for_a_missing_file(tmp_path):
+    pcm, error = decode_audio(os.path.join(str(tmp_path), "missing.media"), "test")
+    assert pcm is None
+    assert error
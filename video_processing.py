@@ -1,12 +1,26 @@
 import os
 import subprocess
+import threading
 import uuid
 
+import numpy as np
+
+import metrics
+from download_manager import get_download_manager, host_slot, DownloadLimitError, DOWNLOAD_MAX_BYTES
+
+# --- Audio decoding settings (what the accent model expects) ---
+SAMPLE_RATE = 16000
+# Audio-only formats so no video frames are transferred when streaming
+STREAM_AUDIO_FORMAT = 'bestaudio/best'
+# Only the first MAX_AUDIO_SECONDS are decoded, which bounds the PCM held in memory
+# (float32 at 16 kHz is ~3.8 MB per minute). 0 disables the limit.
+MAX_AUDIO_SECONDS = float(os.environ.get('MAX_AUDIO_SECONDS', 1200))
+
 def download_video(video_url, task_id, temp_dir):
     """
     Downloads a video from the given URL to a temporary file.
     Uses yt-dlp for robust video downloading.
-    Returns the path to the downloaded video or None if an error occurs.
+    Returns (path to the downloaded video, None), or (None, error message) if an error occurs.
     """
     video_path = None
     try:
@@ -46,12 +60,11 @@ def download_video(video_url, task_id, temp_dir):
         if yt_dlp_options['no_warnings']:
             command.append('--no-warnings')
 
-        print(f"Task {task_id}: yt-dlp command: {' '.join(command)}") # <-- NEW: Print the command
+        # The download manager logs the command with the size/duration limits it appends
+        returncode, stderr = get_download_manager(normalized_temp_dir).download(video_url, command, video_path, task_id)
 
-        process = subprocess.run(command, capture_output=True, text=True, check=False)
-
-        if process.returncode != 0:
-            error_message = f"yt-dlp failed: {process.stderr.strip()}"
+        if returncode != 0:
+            error_message = f"yt-dlp failed: {stderr}"
             print(f"Task {task_id}: {error_message}")
             return None, error_message
 
@@ -60,6 +73,7 @@ def download_video(video_url, task_id, temp_dir):
             print(f"Task {task_id}: {error_message}")
             return None, error_message
 
+        metrics.BYTES_DOWNLOADED.inc(os.path.getsize(video_path))
         print(f"Task {task_id}: Video downloaded to {video_path}")
         return video_path, None
 
@@ -69,74 +83,306 @@ def download_video(video_url, task_id, temp_dir):
         return None, error_message
 
 
-def extract_audio(video_path, task_id, temp_dir):
+def download_audio(video_url, task_id, temp_dir):
     """
-    Extracts audio from the given video file to a temporary WAV file.
-    Uses FFmpeg for robust audio extraction and conversion.
-    Returns the path to the extracted audio or None if an error occurs.
+    Downloads only the audio track (STREAM_AUDIO_FORMAT) of the given URL to a temporary file,
+    which is much smaller than the merged video download_video fetches.
+    Returns (path to the downloaded file, None), or (None, error message) if an error occurs.
     """
-    audio_path = None
     try:
-        print(f"Task {task_id}: Extracting audio from video...")
-        # Generate a unique filename for the audio
-        audio_filename = f"audio_{uuid.uuid4()}.wav"
-        audio_path = os.path.join(temp_dir, audio_filename)
-
-        # FFmpeg command to extract audio as 16kHz mono WAV
-        ffmpeg_command = [
-            'ffmpeg', '-i', video_path, '-ar', '16000', '-ac', '1', '-vn', '-y', audio_path
-        ]
-        print(f"Task {task_id}: FFmpeg command: {' '.join(ffmpeg_command)}") # <-- NEW: Print the command
-        process = subprocess.run(ffmpeg_command, capture_output=True, text=True, check=False)
+        os.makedirs(temp_dir, exist_ok=True)
+        # FFmpeg probes the container itself, so the extension does not matter
+        audio_path = os.path.join(os.path.abspath(temp_dir), f"audio_{uuid.uuid4()}.media")
+        command = ['yt-dlp', '-f', STREAM_AUDIO_FORMAT, '-o', audio_path, '--no-playlist',
+                   '--no-part', '--quiet', '--no-warnings', video_url]
+        returncode, stderr = get_download_manager(temp_dir).download(video_url, command, audio_path, task_id)
 
-        if process.returncode != 0:
-            error_message = f"FFmpeg audio extraction failed: {process.stderr.strip()}"
+        if returncode != 0:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+            error_message = f"yt-dlp failed: {stderr}"
             print(f"Task {task_id}: {error_message}")
             return None, error_message
 
         if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
-            error_message = "Audio extraction failed or resulted in an empty file."
+            error_message = "Audio download failed or resulted in an empty file."
             print(f"Task {task_id}: {error_message}")
             return None, error_message
 
-        print(f"Task {task_id}: Audio extracted to {audio_path}")
+        metrics.BYTES_DOWNLOADED.inc(os.path.getsize(audio_path))
+        print(f"Task {task_id}: Audio downloaded to {audio_path}")
         return audio_path, None
 
     except Exception as e:
-        error_message = f"An error occurred during audio extraction: {e}"
+        error_message = f"An error occurred during audio download: {e}"
         print(f"Task {task_id}: {error_message}")
         return None, error_message
 
 
+def _ffmpeg_decode_command(input_spec):
+    """FFmpeg command that decodes any media input to raw 16 kHz mono float32 PCM on stdout."""
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', input_spec]
+    if MAX_AUDIO_SECONDS > 0:
+        command += ['-t', str(MAX_AUDIO_SECONDS)]
+    return command + ['-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 'f32le', 'pipe:1']
+
 
-# # Example Usage (for demonstration, not part of the Flask app flow directly)
-# if __name__ == '__main__':
-#     TEMP_DIR = os.path.join(os.getcwd(), 'temp_folder')
-#     os.makedirs(TEMP_DIR, exist_ok=True) # Create the directory if it doesn't exist
-#     print(f"Temporary directory created/ensured at: {TEMP_DIR}")
+def _relay(source, sink, state):
+    """
+    Copies yt-dlp's stdout into FFmpeg's stdin, counting the downloaded bytes in state["bytes"].
+    Stops quietly when FFmpeg stops reading (e.g. MAX_AUDIO_SECONDS reached or stream closed)
+    or after DOWNLOAD_MAX_BYTES; closing yt-dlp's stdout then lets it exit with a broken pipe.
+    """
+    try:
+        while True:
+            data = source.read1(65536)
+            if not data:
+                break
+            sink.write(data)
+            state["bytes"] += len(data)
+            metrics.BYTES_DOWNLOADED.inc(len(data))
+            if DOWNLOAD_MAX_BYTES > 0 and state["bytes"] >= DOWNLOAD_MAX_BYTES:
+                break
+    except (BrokenPipeError, OSError, ValueError):
+        pass
+    finally:
+        for stream in (sink, source):
+            try:
+                stream.close()
+            except (BrokenPipeError, OSError):
+                pass
 
-#     # You would replace this with an actual video URL for testing
-#     # test_video_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ" # Example YouTube URL
-#     test_video_url = input("ENter video link: ")
-#     test_task_id = "test_task_123"
 
-#     downloaded_video_path, download_error = download_video(test_video_url, test_task_id, TEMP_DIR)
+def _drain(stream, sink):
+    """Reads a subprocess pipe to EOF in a helper thread so it can never fill up and block the process."""
+    sink.append(stream.read())
+    stream.close()
+
+
+def _close_quietly(stream):
+    """Closes a pipe whose reader may already be gone."""
+    try:
+        stream.close()
+    except (BrokenPipeError, OSError):
+        pass
+
+
+class AudioStreamError(RuntimeError):
+    """Raised by stream_audio_chunks when the source cannot be streamed and decoded."""
+
+
+def stream_audio_chunks(video_url, task_id, chunk_seconds=1.0):
+    """
+    Streams the audio track of the given URL without touching the disk:
+    yt-dlp writes an audio-only format to stdout, which is piped into FFmpeg's stdin
+    and decoded to 16 kHz mono float32 PCM.
+    Yields numpy chunks of chunk_seconds as soon as they are decoded. Closing the
+    generator early (e.g. once a progressive classifier is confident) kills both
+    processes, which stops the download and decoding immediately.
+    Raises AudioStreamError if the source cannot be streamed, or DownloadLimitError if
+    no download slot for its host becomes free.
+    """
+    with host_slot(video_url):
+        yield from _stream_audio_chunks(video_url, task_id, chunk_seconds)
 
-#     if downloaded_video_path:
-#         extracted_audio_path, extract_error = extract_audio(downloaded_video_path, test_task_id, TEMP_DIR)
 
-#         if extracted_audio_path:
-#             print(f"Successfully downloaded video to: {downloaded_video_path}")
-#             print(f"Successfully extracted audio to: {extracted_audio_path}")
-#         else:
-#             print(f"Audio extraction failed: {extract_error}")
+def _stream_audio_chunks(video_url, task_id, chunk_seconds):
+    print(f"Task {task_id}: Streaming audio for {video_url}")
+    yt_dlp_command = [
+        'yt-dlp', '-f', STREAM_AUDIO_FORMAT, '-o', '-',
+        '--no-playlist', '--quiet', '--no-warnings', video_url
+    ]
+    ffmpeg_command = _ffmpeg_decode_command('pipe:0')
+    print(f"Task {task_id}: yt-dlp command: {' '.join(yt_dlp_command)} | {' '.join(ffmpeg_command)}")
+
+    yt_dlp_process = subprocess.Popen(yt_dlp_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ffmpeg_process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    yt_dlp_stderr, ffmpeg_stderr = [], []
+    relay_state = {"bytes": 0}
+    helper_threads = [
+        threading.Thread(target=_relay, args=(yt_dlp_process.stdout, ffmpeg_process.stdin, relay_state),
+                         daemon=True),
+        threading.Thread(target=_drain, args=(yt_dlp_process.stderr, yt_dlp_stderr), daemon=True),
+        threading.Thread(target=_drain, args=(ffmpeg_process.stderr, ffmpeg_stderr), daemon=True),
+    ]
+    for thread in helper_threads:
+        thread.start()
+
+    chunk_bytes = max(int(chunk_seconds * SAMPLE_RATE), 1) * 4 # float32 samples
+    total_samples = 0
+    try:
+        while True:
+            data = ffmpeg_process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            chunk = np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+            total_samples += chunk.size
+            yield chunk
+
+        ffmpeg_returncode = ffmpeg_process.wait()
+        yt_dlp_returncode = yt_dlp_process.wait()
+        for thread in helper_threads:
+            thread.join()
+
+        if ffmpeg_returncode != 0:
+            raise AudioStreamError(f"FFmpeg stream decoding failed: {b''.join(ffmpeg_stderr).decode(errors='replace').strip()}")
+
+        # FFmpeg stops reading once MAX_AUDIO_SECONDS are decoded (and the relay after
+        # DOWNLOAD_MAX_BYTES), so yt-dlp dying of a broken pipe at that point is expected
+        # rather than a download failure.
+        reached_limit = ((MAX_AUDIO_SECONDS > 0 and total_samples >= int(MAX_AUDIO_SECONDS * SAMPLE_RATE))
+                         or (DOWNLOAD_MAX_BYTES > 0 and relay_state["bytes"] >= DOWNLOAD_MAX_BYTES))
+        if yt_dlp_returncode != 0 and not reached_limit:
+            raise AudioStreamError(f"yt-dlp streaming failed: {b''.join(yt_dlp_stderr).decode(errors='replace').strip()}")
+
+        if total_samples == 0:
+            raise AudioStreamError("Audio streaming resulted in no decoded samples.")
+
+        print(f"Task {task_id}: Streamed {total_samples / SAMPLE_RATE:.1f}s of audio")
+    finally:
+        for process in (ffmpeg_process, yt_dlp_process):
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        ffmpeg_process.stdout.close()
+        metrics.AUDIO_SECONDS_DECODED.inc(total_samples / SAMPLE_RATE)
+
+
+def stream_audio(video_url, task_id):
+    """
+    Streams and decodes the whole audio track of the given URL in memory (see stream_audio_chunks).
+    Returns (PCM samples as a float32 numpy array, None), or (None, error message) if an error occurs.
+    """
+    try:
+        chunks = list(stream_audio_chunks(video_url, task_id, chunk_seconds=30.0))
+        return np.concatenate(chunks), None
+
+    except Exception as e:
+        error_message = f"An error occurred during audio streaming: {e}"
+        print(f"Task {task_id}: {error_message}")
+        return None, error_message
 
-#         # Clean up after testing
-#         # cleanup_temp_files(downloaded_video_path) # This would be handled by the main app's finally block
-#         # cleanup_temp_files(extracted_audio_path) # This would be handled by the main app's finally block
-#     else:
-#         print(f"Video download failed: {download_error}")
 
-#     # Clean up the entire temp_files directory if it's the end of the application lifecycle
-#     # shutil.rmtree(TEMP_DIR)
-#     # print(f"Temporary direc
\ No newline at end of file
+def decode_audio(media_path, task_id):
+    """
+    Decodes the audio track of a local media file to 16 kHz mono float32 PCM in memory.
+    No intermediate WAV file is written.
+    Returns (PCM samples as a float32 numpy array, None), or (None, error message) if an error occurs.
+    """
+    try:
+        ffmpeg_command = _ffmpeg_decode_command(media_path)
+        print(f"Task {task_id}: FFmpeg command: {' '.join(ffmpeg_command)}")
+        process = subprocess.run(ffmpeg_command, capture_output=True, check=False)
+
+        if process.returncode != 0:
+            error_message = f"FFmpeg audio decoding failed: {process.stderr.decode(errors='replace').strip()}"
+            print(f"Task {task_id}: {error_message}")
+            return None, error_message
+
+        pcm = np.frombuffer(process.stdout, dtype=np.float32)
+        if pcm.size == 0:
+            error_message = "Audio decoding resulted in no samples."
+            print(f"Task {task_id}: {error_message}")
+            return None, error_message
+        metrics.AUDIO_SECONDS_DECODED.inc(pcm.size / SAMPLE_RATE)
+
+        print(f"Task {task_id}: Decoded {pcm.size / SAMPLE_RATE:.1f}s of audio")
+        return pcm, None
+
+    except Exception as e:
+        error_message = f"An error occurred during audio decoding: {e}"
+        print(f"Task {task_id}: {error_message}")
+        return None, error_message
+
+
+def decode_audio_stream(chunks, task_id):
+    """
+    Decodes media that arrives as an iterable of byte chunks (e.g. an upload being received)
+    to 16 kHz mono float32 PCM by writing it to FFmpeg's stdin, so the encoded file is neither
+    held in memory nor written to disk. The format must be readable from a pipe (not an MP4
+    with its moov atom at the end). Input past MAX_AUDIO_SECONDS is read but discarded.
+    Returns (PCM samples as a float32 numpy array, None), or (None, error message) if an error
+    occurs; exceptions raised by the chunk iterable are passed on.
+    """
+    ffmpeg_command = _ffmpeg_decode_command('pipe:0')
+    print(f"Task {task_id}: FFmpeg command: {' '.join(ffmpeg_command)}")
+    process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, stderr = [], []
+    helper_threads = [threading.Thread(target=_drain, args=(process.stdout, output), daemon=True),
+                      threading.Thread(target=_drain, args=(process.stderr, stderr), daemon=True)]
+    for thread in helper_threads:
+        thread.start()
+    try:
+        for data in chunks:
+            if process.stdin.closed:
+                continue # FFmpeg has stopped reading; consume the rest of the input
+            try:
+                process.stdin.write(data)
+            except (BrokenPipeError, OSError):
+                _close_quietly(process.stdin)
+        _close_quietly(process.stdin)
+        returncode = process.wait()
+        for thread in helper_threads:
+            thread.join()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    if returncode != 0:
+        error_message = f"FFmpeg audio decoding failed: {b''.join(stderr).decode(errors='replace').strip()}"
+        print(f"Task {task_id}: {error_message}")
+        return None, error_message
+    pcm = np.frombuffer(output[0], dtype=np.float32)
+    if pcm.size == 0:
+        error_message = "Audio decoding resulted in no samples."
+        print(f"Task {task_id}: {error_message}")
+        return None, error_message
+    metrics.AUDIO_SECONDS_DECODED.inc(pcm.size / SAMPLE_RATE)
+    print(f"Task {task_id}: Decoded {pcm.size / SAMPLE_RATE:.1f}s of streamed audio")
+    return pcm, None
+
+
+def download_and_decode_audio(video_url, task_id, temp_dir):
+    """
+    File-based fallback for sources that cannot be streamed: downloads the media to
+    temp_dir, decodes its audio to 16 kHz mono float32 PCM in memory and removes the download.
+    Returns (PCM samples as a float32 numpy array, None), or (None, error message) if an error occurs.
+    """
+    video_path, download_error = download_video(video_url, task_id, temp_dir)
+    if download_error:
+        return None, download_error
+    try:
+        return decode_audio(video_path, task_id)
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+
+def acquire_audio(video_url, task_id, temp_dir):
+    """
+    Gets the audio of the given URL as 16 kHz mono float32 PCM.
+    Streams straight from yt-dlp into FFmpeg first; sources that cannot be decoded
+    from a pipe (e.g. MP4 files with the moov atom at the end, or formats that need
+    merging) fall back to downloading the file and decoding it from disk.
+    Both attempts share one download slot for the URL's host.
+    Returns (PCM samples as a numpy array, None), or (None, error message) if both attempts
+    fail or a download limit is hit.
+    """
+    try:
+        with host_slot(video_url):
+            pcm, stream_error = stream_audio(video_url, task_id)
+            if stream_error is None:
+                return pcm, None
+
+            print(f"Task {task_id}: Streaming unavailable, falling back to file download.")
+            pcm, fallback_error = download_and_decode_audio(video_url, task_id, temp_dir)
+    except DownloadLimitError as e:
+        print(f"Task {task_id}: {e}")
+        return None, str(e)
+    if fallback_error:
+        return None, f"{fallback_error} (streaming also failed: {stream_error})"
+    return pcm, None
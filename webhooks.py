@@ -0,0 +1,240 @@
+"""
+Delivers finished results to the callback_url given to /analyze. The result is POSTed as
+JSON, and failed deliveries are retried with exponential backoff and jitter, so an API client
+neither polls nor keeps a connection open while it waits.
+
+Pending deliveries are kept in memory by the worker process that ran the task; they do not
+survive a restart.
+
+Callbacks only go to public addresses (or to WEBHOOK_ALLOWED_HOSTS), checked when the URL is
+submitted and again on every connection, so clients cannot make the server POST to itself or
+to hosts on its internal network.
+"""
+import hashlib
+import heapq
+import hmac
+import http.client
+import ipaddress
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+
+import metrics
+
+# --- Webhook configuration (overridable through environment variables) ---
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 6))
+# Delay before the first retry; it doubles with every further attempt, up to the maximum
+WEBHOOK_BACKOFF_SECONDS = float(os.environ.get('WEBHOOK_BACKOFF_SECONDS', 2))
+WEBHOOK_MAX_BACKOFF_SECONDS = float(os.environ.get('WEBHOOK_MAX_BACKOFF_SECONDS', 300))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get('WEBHOOK_TIMEOUT_SECONDS', 10))
+# Deliveries in flight at once per process (slow receivers do not hold up the others)
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 4))
+# If set, every request carries X-Webhook-Signature: sha256=<HMAC-SHA256 of the body with this key>
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# Comma-separated hosts (or .domain suffixes) callbacks may go to. If set, no other host is allowed,
+# and these may resolve to private addresses (e.g. an internal receiver); if unset, any host that
+# resolves to public addresses only is allowed
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.environ.get('WEBHOOK_ALLOWED_HOSTS', '').split(',')
+                         if host.strip()]
+
+# Responses worth retrying; any other non-2xx status is a permanent failure
+_RETRYABLE_STATUSES = {408, 425, 429}
+
+
+class CallbackAddressError(OSError):
+    """Raised for a callback host the server may not connect to."""
+
+
+def _host_allowed(host, allowed_hosts):
+    host = host.lower().rstrip('.')
+    return any(host == entry or (entry.startswith('.') and host.endswith(entry)) for entry in allowed_hosts)
+
+
+def resolve_callback_host(host, port, allowed_hosts=WEBHOOK_ALLOWED_HOSTS):
+    """
+    The addresses (getaddrinfo entries) to connect to for a callback host. Raises
+    CallbackAddressError for a host outside allowed_hosts or, without an allowlist, for one that
+    resolves to any loopback, private, link-local, reserved or otherwise non-public address.
+    """
+    if allowed_hosts and not _host_allowed(host, allowed_hosts):
+        raise CallbackAddressError(f"callback_url host {host} is not allowed.")
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise CallbackAddressError(f"callback_url host {host} could not be resolved ({e}).")
+    if not allowed_hosts:
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+            if not address.is_global or address.is_multicast:
+                raise CallbackAddressError(f"callback_url host {host} resolves to a non-public address ({address}).")
+    return addresses
+
+
+def validate_callback_url(url):
+    """Returns an error message if url is not an absolute http(s) URL to an allowed host, otherwise None."""
+    if not isinstance(url, str):
+        return "callback_url must be a string."
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        port = None
+    if parts.scheme not in ('http', 'https') or not parts.hostname or port is None:
+        return "callback_url must be an absolute http:// or https:// URL."
+    try:
+        resolve_callback_host(parts.hostname, port)
+    except CallbackAddressError as e:
+        return str(e)
+    return None
+
+
+def _connect_checked(address, timeout=None, source_address=None):
+    """socket.create_connection, but only to the addresses resolve_callback_host allows (no DNS rebinding)."""
+    host, port = address
+    error = None
+    for family, kind, proto, _, sockaddr in resolve_callback_host(host, port):
+        sock = socket.socket(family, kind, proto)
+        try:
+            if isinstance(timeout, (int, float)):
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f"Could not connect to {host}:{port}")
+
+
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_checked # Used by connect(); HTTPS wraps the socket afterwards
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_checked
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req)
+
+
+def sign(body, secret=WEBHOOK_SECRET):
+    """The X-Webhook-Signature value for a request body (receivers recompute it to authenticate the sender)."""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class WebhookDispatcher:
+    """Queue of webhook deliveries ordered by due time, sent by a few daemon threads."""
+
+    def __init__(self, max_attempts=WEBHOOK_MAX_ATTEMPTS, backoff=WEBHOOK_BACKOFF_SECONDS,
+                 max_backoff=WEBHOOK_MAX_BACKOFF_SECONDS, timeout=WEBHOOK_TIMEOUT_SECONDS,
+                 concurrency=WEBHOOK_CONCURRENCY, secret=WEBHOOK_SECRET):
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.concurrency = max(concurrency, 1)
+        self.secret = secret
+        self._pending = [] # heap of (due time, sequence, delivery)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        # Every connection (redirects included) is checked again; no proxies, so the check sees the real peer
+        self._opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _CheckedHTTPHandler,
+                                                   _CheckedHTTPSHandler)
+
+    def pending(self):
+        """Deliveries waiting for their first attempt or a retry."""
+        with self._condition:
+            return len(self._pending)
+
+    def submit(self, url, payload, task_id=None):
+        """Queues a POST of payload (as JSON) to url."""
+        delivery = {"url": url, "body": json.dumps(payload).encode(), "task_id": task_id, "attempt": 1}
+        self._schedule(delivery, time.time())
+        self._start()
+
+    def retry_delay(self, attempt):
+        """Seconds before retrying after `attempt` failed: doubling from backoff, capped, with jitter."""
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _schedule(self, delivery, due):
+        with self._condition:
+            heapq.heappush(self._pending, (due, next(self._sequence), delivery))
+            self._condition.notify()
+
+    def _start(self):
+        with self._condition:
+            while len(self._threads) < self.concurrency:
+                thread = threading.Thread(target=self._work, name=f"webhook-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending or self._pending[0][0] > time.time():
+                    self._condition.wait(self._pending[0][0] - time.time() if self._pending else None)
+                _, _, delivery = heapq.heappop(self._pending)
+            try:
+                self._deliver(delivery)
+            except Exception as e:
+                print(f"Task {delivery['task_id']}: webhook delivery crashed: {e}")
+
+    def _deliver(self, delivery):
+        """One attempt; schedules a retry or records the outcome."""
+        headers = {"Content-Type": "application/json", "User-Agent": "accent-analyzer-webhook",
+                   "X-Webhook-Attempt": str(delivery["attempt"])}
+        if delivery["task_id"]:
+            headers["X-Task-Id"] = delivery["task_id"]
+        if self.secret:
+            headers["X-Webhook-Signature"] = sign(delivery["body"], self.secret)
+        request = urllib.request.Request(delivery["url"], data=delivery["body"], headers=headers, method='POST')
+
+        retry_after, forbidden = None, False
+        try:
+            with self._opener.open(request, timeout=self.timeout) as response:
+                status, error = response.status, None
+        except urllib.error.HTTPError as e:
+            status, error = e.code, f"HTTP {e.code}"
+            retry_after = e.headers.get('Retry-After')
+        except Exception as e: # Connection refused, DNS failure, timeout...
+            status, error = None, str(e)
+            forbidden = isinstance(getattr(e, 'reason', e), CallbackAddressError)
+
+        if error is None:
+            metrics.WEBHOOK_DELIVERIES.inc(outcome='delivered')
+            print(f"Task {delivery['task_id']}: webhook delivered to {delivery['url']} (attempt {delivery['attempt']})")
+            return
+        retryable = not forbidden and (status is None or status >= 500 or status in _RETRYABLE_STATUSES)
+        if retryable and delivery["attempt"] < self.max_attempts:
+            delay = self.retry_delay(delivery["attempt"])
+            if retry_after and retry_after.isdigit():
+                delay = min(max(delay, float(retry_after)), self.max_backoff)
+            metrics.WEBHOOK_DELIVERIES.inc(outcome='retried')
+            print(f"Task {delivery['task_id']}: webhook attempt {delivery['attempt']} to {delivery['url']} failed"
+                  f" ({error}); retrying in {delay:.1f}s")
+            self._schedule(dict(delivery, attempt=delivery["attempt"] + 1), time.time() + delay)
+        else:
+            metrics.WEBHOOK_DELIVERIES.inc(outcome='failed')
+            print(f"Task {delivery['task_id']}: webhook to {delivery['url']} failed after"
+                  f" {delivery['attempt']} attempt(s) ({error})")